@@ -1,8 +1,15 @@
+from datetime import date, timedelta
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.db.models import DateTimeField, Max, Min, QuerySet
 from .models import (
     Department, ClinicRoom, Doctor, Patient,
     Schedule, Appointment, MedicalRecord, Payment
 )
+from . import search
+from .pagination import EstimatedCountPaginator, KeysetPaginator
+from .replica import SAFE_METHODS, call_on_replica
 
 # 注册模型到后台
 admin.site.register(Department)
@@ -14,23 +21,244 @@ admin.site.register(Appointment)
 admin.site.register(MedicalRecord)
 admin.site.register(Payment)
 
+# 大表的列表页（GET）读只读副本；新增、修改、删除和批量操作仍走主库
+class ReplicaChangelistMixin:
+    def changelist_view(self, request, extra_context=None):
+        if request.method not in SAFE_METHODS:
+            return super().changelist_view(request, extra_context)
+        return call_on_replica(request, super().changelist_view, extra_context)
+
+# 列表页搜索走 FTS5 全文索引，代替 search_fields 的 icontains 全表扫描；search_fields 只用于显示搜索框
+class FullTextSearchMixin:
+    search_index = None
+    search_limit = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(pk__in=search.search(self.search_index, search_term, self.search_limit)), False
+
+
+# 外键下拉框选项的 __str__ 会访问外键，取选项时一并 JOIN
+CHOICE_SELECT_RELATED = {
+    ClinicRoom: ('dept',),
+}
+
+
+class ChoiceSelectRelatedMixin:
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        related = CHOICE_SELECT_RELATED.get(db_field.related_model)
+        if related and 'queryset' not in kwargs:
+            kwargs['queryset'] = db_field.related_model._default_manager.select_related(*related)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class SeekDatesQuerySet(QuerySet):
+    """
+    日期层级（date_hierarchy）用的查询集。Django 默认用 SELECT DISTINCT 截断日期 扫全表列出年/月/日，
+    这里沿日期字段的索引跳着取：每次取不小于下一个边界的最小值，有几个年/月/日就查几次；
+    首尾日期也拆成两条按索引取首尾的查询（SQLite 只在单独的 MIN/MAX 上走索引）。只处理 DateField。
+    """
+
+    def _date_values(self, field_name):
+        return self.filter(**{f'{field_name}__isnull': False}).order_by(field_name).values_list(field_name, flat=True)
+
+    def _is_date_field(self, field_name):
+        return not isinstance(self.model._meta.get_field(field_name), DateTimeField)
+
+    def aggregate(self, *args, **kwargs):
+        first, last = kwargs.get('first'), kwargs.get('last')
+        if (
+            not args and len(kwargs) == 2 and isinstance(first, Min) and isinstance(last, Max)
+            and first.source_expressions[0].name == last.source_expressions[0].name
+            and self._is_date_field(first.source_expressions[0].name)
+        ):
+            values = self._date_values(first.source_expressions[0].name)
+            return {'first': values.first(), 'last': values.last()}
+        return super().aggregate(*args, **kwargs)
+
+    def _first_from(self, field_name, bound):
+        # 同一列有多个下界时 SQLite 只拿第一个做索引范围，跳跃的边界要排在日期层级自身的筛选条件前面
+        seek = type(self)(model=self.model, using=self._db).filter(**{f'{field_name}__gte': bound}) & self
+        return seek._date_values(field_name).first()
+
+    def dates(self, field_name, kind, order='ASC'):
+        if kind not in ('year', 'month', 'day') or not self._is_date_field(field_name):
+            return super().dates(field_name, kind, order)
+        result = []
+        value = self._date_values(field_name).first()
+        while value is not None:
+            if kind == 'year':
+                value = date(value.year, 1, 1)
+                bound = date(value.year + 1, 1, 1)
+            elif kind == 'month':
+                value = value.replace(day=1)
+                bound = date(value.year + value.month // 12, value.month % 12 + 1, 1)
+            else:
+                bound = value + timedelta(days=1)
+            result.append(value)
+            value = self._first_from(field_name, bound)
+        return result if order == 'ASC' else result[::-1]
+
+
+class KeysetChangeList(ChangeList):
+    """
+    大表列表页：按默认排序（Admin 的 ordering，须全部倒序、最后是主键）浏览时，每页给出按排序键定位的
+    “上一页/下一页”游标链接（after/before），不使用 OFFSET，翻到多深代价都一样；
+    数字页码只覆盖前 CLINIC_ADMIN_COUNT_LIMIT 行。
+    """
+    CURSOR_PARAMS = ('after', 'before')
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = request.GET.get('after')
+        self.before = request.GET.get('before')
+        self.next_cursor = self.prev_cursor = None
+        super().__init__(request, *args, **kwargs)
+        # 生成其他链接（筛选、日期层级、页码）时不带游标
+        for param in self.CURSOR_PARAMS:
+            self.params.pop(param, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for param in self.CURSOR_PARAMS:
+            lookup_params.pop(param, None)
+        return lookup_params
+
+    def get_keyset_paginator(self, request):
+        # 点了列头按其他字段排序时不能按游标定位
+        if ORDER_VAR in self.params:
+            return None
+        ordering = self.model_admin.get_ordering(request) or ('-' + self.lookup_opts.pk.name,)
+        if not all(isinstance(key, str) and key.startswith('-') for key in ordering):
+            return None
+        keys = tuple(key[1:] for key in ordering)
+        if keys[-1] != self.lookup_opts.pk.name:
+            keys += (self.lookup_opts.pk.name,)
+        return KeysetPaginator(self.queryset, keys=keys, per_page=self.list_per_page)
+
+    def get_results(self, request):
+        cursor = self.after or self.before
+        if cursor:
+            self.page_num = 0
+        super().get_results(request)
+        keyset = self.get_keyset_paginator(request)
+        if keyset is None or not self.multi_page or (self.show_all and self.can_show_all):
+            return
+        if cursor:
+            page = keyset.page(after=self.after, before=self.before)
+            self.result_list = page.object_list
+            self.next_cursor, self.prev_cursor = page.next_cursor, page.prev_cursor
+            # 游标页不对应任何数字页码
+            self.page_num = -1
+        else:
+            rows = list(self.result_list)
+            self.result_list = rows
+            if len(rows) == self.list_per_page:
+                self.next_cursor = keyset.encode_cursor(rows[-1])
+
+    @property
+    def next_url(self):
+        return self.get_query_string({'after': self.next_cursor}) if self.next_cursor else None
+
+    @property
+    def prev_url(self):
+        return self.get_query_string({'before': self.prev_cursor}) if self.prev_cursor else None
+
+
+class LargeTableMixin(ChoiceSelectRelatedMixin):
+    """
+    百万行大表的后台：计数有上限或用估算值、不显示不带过滤条件的总数、深分页走游标、
+    日期层级沿索引查找；列表显示的外键由各 Admin 的 list_select_related 一并 JOIN。
+    有日期层级的表按 (日期, 主键) 倒序排列：日期索引里同一日期的行按主键排好，按日期筛选后不用再排序。
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return SeekDatesQuerySet(model=queryset.model, query=queryset.query, using=queryset._db, hints=queryset._hints)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
 # 优化后台显示（可选，让后台更友好）
+class DepartmentAdmin(admin.ModelAdmin):
+    list_display = ('dept_id', 'dept_name', 'dept_desc')
+    search_fields = ('dept_name',)
+
+class ClinicRoomAdmin(admin.ModelAdmin):
+    list_display = ('room_id', 'dept', 'location')
+    list_filter = ('dept',)
+    list_select_related = ('dept',)
+
 class DoctorAdmin(admin.ModelAdmin):
     list_display = ('name', 'dept', 'title', 'mobile', 'work_status')
     search_fields = ('name', 'dept__dept_name')
+    list_select_related = ('dept',)
+    raw_id_fields = ('user',)
 
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(FullTextSearchMixin, ReplicaChangelistMixin, LargeTableMixin, admin.ModelAdmin):
     list_display = ('name', 'gender', 'id_card', 'mobile', 'birth_date')
-    search_fields = ('name', 'id_card')
+    search_fields = ('name', 'mobile', 'id_card')
+    search_index = 'patient'
+    ordering = ('-patient_id',)
+    raw_id_fields = ('user',)
 
-class AppointmentAdmin(admin.ModelAdmin):
-    list_display = ('patient', 'dept', 'appt_time', 'arrival_time', 'status')
+class ScheduleAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('schedule_id', 'doctor', 'room', 'schedule_date', 'time_slot', 'status', 'booked_count', 'capacity')
+    list_filter = ('status',)
+    list_select_related = ('doctor', 'room__dept')
+    date_hierarchy = 'schedule_date'
+    ordering = ('-schedule_date', '-schedule_id')
+
+class AppointmentAdmin(ReplicaChangelistMixin, LargeTableMixin, admin.ModelAdmin):
+    list_display = ('appt_id', 'patient', 'dept', 'appt_time', 'arrival_time', 'status')
     list_filter = ('status', 'dept')
+    list_select_related = ('patient', 'dept')
+    date_hierarchy = 'arrival_date'
+    ordering = ('-arrival_date', '-appt_id')
+    # 患者表百万行：下拉框换成按全文索引搜索的自动补全；号源只填ID
+    autocomplete_fields = ('patient',)
+    raw_id_fields = ('schedule',)
+
+class MedicalRecordAdmin(FullTextSearchMixin, ReplicaChangelistMixin, LargeTableMixin, admin.ModelAdmin):
+    list_display = ('record_id', 'patient', 'doctor', 'room', 'visit_time', 'visit_status')
+    list_filter = ('visit_status',)
+    list_select_related = ('patient', 'doctor', 'room__dept')
+    search_fields = ('symptom', 'prescription')
+    search_index = 'record'
+    date_hierarchy = 'visit_date'
+    ordering = ('-visit_date', '-record_id')
+    autocomplete_fields = ('patient',)
+    raw_id_fields = ('appointment',)
+
+class PaymentAdmin(ReplicaChangelistMixin, LargeTableMixin, admin.ModelAdmin):
+    list_display = ('pay_id', 'patient', 'total_amount', 'medical_insurance', 'self_pay', 'pay_method', 'pay_time')
+    list_filter = ('pay_method',)
+    list_select_related = ('record__patient',)
+    date_hierarchy = 'pay_date'
+    ordering = ('-pay_date', '-pay_id')
+    raw_id_fields = ('record',)
+
+    def patient(self, obj):
+        return obj.record.patient.name
+    patient.short_description = '患者'
 
 # 重新注册优化后的模型
+admin.site.unregister(Department)
+admin.site.register(Department, DepartmentAdmin)
+admin.site.unregister(ClinicRoom)
+admin.site.register(ClinicRoom, ClinicRoomAdmin)
 admin.site.unregister(Doctor)
 admin.site.register(Doctor, DoctorAdmin)
 admin.site.unregister(Patient)
 admin.site.register(Patient, PatientAdmin)
+admin.site.unregister(Schedule)
+admin.site.register(Schedule, ScheduleAdmin)
 admin.site.unregister(Appointment)
-admin.site.register(Appointment, AppointmentAdmin)
\ No newline at end of file
+admin.site.register(Appointment, AppointmentAdmin)
+admin.site.unregister(MedicalRecord)
+admin.site.register(MedicalRecord, MedicalRecordAdmin)
+admin.site.unregister(Payment)
+admin.site.register(Payment, PaymentAdmin)
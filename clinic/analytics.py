@@ -0,0 +1,451 @@
+import time
+from bisect import bisect_right
+from datetime import date, timedelta
+from decimal import Decimal
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时统计分析页给出提示，其他功能不受影响
+    np = None
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import CharField, F, IntegerField
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+from .models import MedicalRecordHistory, Patient, PaymentHistory
+from .rollups import CENT
+
+# 每次从游标取多少行转成一块数组
+ANALYTICS_CHUNK_SIZE = 50000
+# 统计结果的缓存时间（秒）：百万行全表计算要几秒，管理员反复切换页面时不必重算
+ANALYTICS_TTL = 600
+# 默认统计最近12个月
+ANALYTICS_DEFAULT_MONTHS = 12
+
+# 年龄段下界（岁）
+AGE_GROUPS = (0, 7, 18, 35, 60, 80)
+GENDERS = ('男', '女', '其他')
+# 就诊次数分布：1、2、3、4、5次及以上
+VISIT_COUNT_BUCKETS = 5
+
+EPOCH = date(1970, 1, 1)
+# 日期列按 'YYYY-MM-DD' 文本取出，由 numpy 整列解析后换成距 1970-01-01 的天数
+DAYS = 'datetime64[D]'
+
+
+class AnalyticsUnavailable(Exception):
+    """运行环境缺少 numpy"""
+
+
+def _require_numpy():
+    if np is None:
+        raise AnalyticsUnavailable('统计分析需要安装 numpy（pip install numpy）')
+
+
+def _day(value):
+    return (value - EPOCH).days
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def month_starts(first, last):
+    """first 到 last 所在各月的1日"""
+    months = []
+    month = first.replace(day=1)
+    while month <= last:
+        months.append(month)
+        month = _next_month(month)
+    return months
+
+
+def default_range(end=None):
+    """默认统计范围：截至 end（默认今天）的最近 ANALYTICS_DEFAULT_MONTHS 个自然月"""
+    end = end or timezone.localdate()
+    start = end.replace(day=1)
+    for _ in range(ANALYTICS_DEFAULT_MONTHS - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+    return start, end
+
+
+def _yuan(cents):
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+def _per_head(cents, count):
+    return (Decimal(cents) / count / 100).quantize(CENT) if count else _yuan(0)
+
+
+def _percent(part, whole):
+    return round(part * 100 / whole, 1) if whole else 0.0
+
+
+def _label(month):
+    return month.strftime('%Y-%m')
+
+
+# ==================== 按列读取 ====================
+
+def _date(field):
+    # 不经过 Django 逐行转换成 date 对象，取原样文本
+    return Cast(field, CharField())
+
+
+def _cents(field):
+    # 金额在数据库里换算成整数分，整列求和没有浮点误差，也省去逐行构造 Decimal
+    return Cast(Round(F(field) * 100), IntegerField())
+
+
+def load_columns(queryset, columns, chunk_size=ANALYTICS_CHUNK_SIZE):
+    """
+    按 values_list 的查询分块读取若干列，每块整体转成 numpy 结构化数组后按列拼接，返回与 columns 对应的数组列表。
+    columns 为 [(字段名或表达式, dtype)]；dtype 为 DAYS 的日期列返回天数（int64）。
+    取的列都是整数或文本，游标按块 fetchmany 后直接交给 numpy，不经过 Django 逐行的类型转换。
+    """
+    _require_numpy()
+    # 全部作为注解：SQL 里的列顺序就是注解的顺序（普通字段和注解混用时 Django 取出后才调整顺序）
+    annotations = {
+        f'analytics_col{i}': F(column) if isinstance(column, str) else column
+        for i, (column, dtype) in enumerate(columns)
+    }
+    queryset = queryset.annotate(**annotations).values_list(*annotations)
+    row_type = np.dtype([(f'f{i}', dtype) for i, (column, dtype) in enumerate(columns)])
+    sql, params = queryset.query.sql_with_params()
+    blocks = []
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            blocks.append(np.array(rows, dtype=row_type))
+    table = np.concatenate(blocks) if blocks else np.array([], dtype=row_type)
+    return [
+        table[f'f{i}'].astype(np.int64) if dtype == DAYS else table[f'f{i}']
+        for i, (column, dtype) in enumerate(columns)
+    ]
+
+
+def _records(end):
+    return MedicalRecordHistory.objects.filter(visit_date__isnull=False, visit_date__lte=end)
+
+
+def _payments(start, end):
+    return PaymentHistory.objects.filter(pay_date__gte=start, pay_date__lte=end)
+
+
+def _month_index(months, days):
+    """每个日期（天数）所在月份在 months 中的下标"""
+    bounds = np.array([_day(month) for month in months], dtype=np.int64)
+    return np.searchsorted(bounds, days, side='right') - 1
+
+
+def _first_visits(patient_ids, days):
+    """每个患者（按患者ID下标）最早的就诊日，没有就诊的为 int64 最大值"""
+    first = np.full(int(patient_ids.max()) + 1 if patient_ids.size else 1, np.iinfo(np.int64).max)
+    np.minimum.at(first, patient_ids, days)
+    return first
+
+
+# ==================== 报表（两种实现共用的结果格式） ====================
+# 每个报表返回 {'headers': 表头, 'rows': 行, 'summary': [(指标, 值)]}，页面和命令行按同一格式输出。
+
+def _age_report(counts, age_sum):
+    total = sum(map(sum, counts))
+    labels = [
+        f'{low}-{high - 1}岁' for low, high in zip(AGE_GROUPS, AGE_GROUPS[1:])
+    ] + [f'{AGE_GROUPS[-1]}岁及以上']
+    return {
+        'headers': ['年龄段', *GENDERS, '合计', '占比（%）'],
+        'rows': [
+            [label, *row, sum(row), _percent(sum(row), total)] for label, row in zip(labels, counts)
+        ],
+        'summary': [('患者数', total), ('平均年龄', round(age_sum / total, 1) if total else 0.0)],
+    }
+
+
+def _repeat_report(months, visits, visitors, returning, distribution, patients):
+    total_visits = sum(visits)
+    repeat = sum(distribution[1:])
+    return {
+        'headers': ['月份', '就诊人次', '就诊患者', '其中老患者', '老患者占比（%）'],
+        'rows': [
+            [_label(month), visits[i], visitors[i], returning[i], _percent(returning[i], visitors[i])]
+            for i, month in enumerate(months)
+        ],
+        'summary': [
+            ('就诊人次', total_visits),
+            ('就诊患者', patients),
+            ('多次就诊患者', repeat),
+            ('复诊率（%）', _percent(repeat, patients)),
+        ] + [
+            (f'就诊{n}次' + ('及以上' if n == VISIT_COUNT_BUCKETS else ''), distribution[n - 1])
+            for n in range(1, VISIT_COUNT_BUCKETS + 1)
+        ],
+    }
+
+
+def _cohort_report(months, patients, paying, revenue):
+    rows = [
+        [_label(month), patients[i], paying[i], _yuan(revenue[i]), _per_head(revenue[i], patients[i])]
+        for i, month in enumerate(months) if patients[i]
+    ]
+    total_paying = sum(paying)
+    return {
+        'headers': ['首诊月份', '患者数', '期间缴费患者', '期间收入（元）', '人均收入（元）'],
+        'rows': rows,
+        'summary': [
+            ('期间收入（元）', _yuan(sum(revenue))),
+            ('缴费患者', total_paying),
+            ('缴费患者人均（元）', _per_head(sum(revenue), total_paying)),
+        ],
+    }
+
+
+def _insurance_report(months, counts, totals, insurance):
+    return {
+        'headers': ['月份', '缴费笔数', '总金额（元）', '医保金额（元）', '自费金额（元）', '医保占比（%）'],
+        'rows': [
+            [_label(month), counts[i], _yuan(totals[i]), _yuan(insurance[i]),
+             _yuan(totals[i] - insurance[i]), _percent(insurance[i], totals[i])]
+            for i, month in enumerate(months)
+        ],
+        'summary': [
+            ('缴费笔数', sum(counts)),
+            ('总金额（元）', _yuan(sum(totals))),
+            ('医保占比（%）', _percent(sum(insurance), sum(totals))),
+        ],
+    }
+
+
+# ==================== numpy 实现 ====================
+
+def age_distribution(start, end):
+    """截至 end 各年龄段、性别的患者数（start 不参与计算，只为与其他报表统一参数）"""
+    birth, gender = load_columns(
+        Patient.objects.filter(birth_date__lte=end),
+        [(_date('birth_date'), DAYS), ('gender', 'U2')]
+    )
+    # 天数换成 YYYYMMDD 整数：周岁 = (end - 出生日期) // 10000，闰年、生日未到都不用单独处理
+    dates = birth.astype(DAYS)
+    months = dates.astype('datetime64[M]')
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    ymd = years * 10000 + (months.astype(np.int64) % 12 + 1) * 100 + (dates - months).astype(np.int64) + 1
+    ages = (end.year * 10000 + end.month * 100 + end.day - ymd) // 10000
+    groups = np.searchsorted(AGE_GROUPS, ages, side='right') - 1
+    genders = np.full(gender.size, len(GENDERS) - 1)
+    for code, name in enumerate(GENDERS[:-1]):
+        genders[gender == name] = code
+    counts = np.bincount(groups * len(GENDERS) + genders, minlength=len(AGE_GROUPS) * len(GENDERS))
+    return _age_report(counts.reshape(len(AGE_GROUPS), len(GENDERS)).tolist(), int(ages.sum()))
+
+
+def repeat_visits(start, end):
+    """期间复诊率，以及每月就诊患者中此前来过的老患者占比"""
+    patient_ids, days = load_columns(_records(end), [('patient_id', np.int64), (_date('visit_date'), DAYS)])
+    months = month_starts(start, end)
+    first = _first_visits(patient_ids, days)
+    in_range = days >= _day(start)
+    patient_ids, days = patient_ids[in_range], days[in_range]
+
+    per_patient = np.bincount(patient_ids)
+    per_patient = per_patient[per_patient > 0]
+    distribution = np.bincount(np.minimum(per_patient, VISIT_COUNT_BUCKETS), minlength=VISIT_COUNT_BUCKETS + 1)[1:]
+
+    month_index = _month_index(months, days)
+    # (月份, 患者) 去重：同一患者一个月来多次只算一位就诊患者
+    width = first.size
+    pairs = np.unique(month_index * width + patient_ids)
+    pair_months, pair_patients = pairs // width, pairs % width
+    month_first = np.array([_day(month) for month in months], dtype=np.int64)
+    returning = first[pair_patients] < month_first[pair_months]
+    return _repeat_report(
+        months,
+        np.bincount(month_index, minlength=len(months)).tolist(),
+        np.bincount(pair_months, minlength=len(months)).tolist(),
+        np.bincount(pair_months[returning], minlength=len(months)).tolist(),
+        distribution.tolist(),
+        int(per_patient.size),
+    )
+
+
+def cohort_revenue(start, end):
+    """按首诊月份划分患者群，统计期间各群的收入和人均收入"""
+    patient_ids, days = load_columns(_records(end), [('patient_id', np.int64), (_date('visit_date'), DAYS)])
+    pay_patients, amounts = load_columns(
+        _payments(start, end), [('patient_id', np.int64), (_cents('total_amount'), np.int64)]
+    )
+    if not patient_ids.size:
+        return _cohort_report([], [], [], [])
+    first = _first_visits(patient_ids, days)
+    months = month_starts(EPOCH + timedelta(days=int(days.min())), end)
+    cohorts = np.full(first.size, -1)
+    seen = first != np.iinfo(np.int64).max
+    cohorts[seen] = _month_index(months, first[seen])
+
+    # 缴费的患者都有就诊记录；个别患者ID超出就诊数据范围（期间外的就诊）时不计
+    known = pay_patients < first.size
+    pay_cohorts = cohorts[pay_patients[known]]
+    paid = pay_cohorts >= 0
+    revenue = np.bincount(pay_cohorts[paid], weights=amounts[known][paid], minlength=len(months))
+    paying = np.bincount(cohorts[np.unique(pay_patients[known][paid])], minlength=len(months))
+    return _cohort_report(
+        months,
+        np.bincount(cohorts[seen], minlength=len(months)).tolist(),
+        paying.tolist(),
+        [int(value) for value in np.rint(revenue)],
+    )
+
+
+def insurance_trend(start, end):
+    """每月缴费金额中医保支付的占比"""
+    days, totals, insurance = load_columns(
+        _payments(start, end),
+        [(_date('pay_date'), DAYS), (_cents('total_amount'), np.int64), (_cents('medical_insurance'), np.int64)]
+    )
+    months = month_starts(start, end)
+    month_index = _month_index(months, days)
+    # 带权 bincount 结果是 float64，金额以分为单位、远小于 2**53，取整后精确
+    return _insurance_report(
+        months,
+        np.bincount(month_index, minlength=len(months)).tolist(),
+        [int(value) for value in np.rint(np.bincount(month_index, weights=totals, minlength=len(months)))],
+        [int(value) for value in np.rint(np.bincount(month_index, weights=insurance, minlength=len(months)))],
+    )
+
+
+# ==================== 逐行 ORM 实现（基准对比和结果校验用） ====================
+
+def _month_of(months, value):
+    return (value.year - months[0].year) * 12 + value.month - months[0].month
+
+
+def _orm_first_visits(end, since=None):
+    """逐条读取就诊记录：返回 ({患者ID: 最早就诊日}, since 及以后的 [(患者ID, 就诊日)])"""
+    first, recent = {}, []
+    for record in _records(end).iterator():
+        patient_id, visit_date = record.patient_id, record.visit_date
+        if patient_id not in first or visit_date < first[patient_id]:
+            first[patient_id] = visit_date
+        if since is not None and visit_date >= since:
+            recent.append((patient_id, visit_date))
+    return first, recent
+
+
+def orm_age_distribution(start, end):
+    counts = [[0] * len(GENDERS) for _ in AGE_GROUPS]
+    age_sum = 0
+    for patient in Patient.objects.filter(birth_date__lte=end).iterator():
+        birth = patient.birth_date
+        age = end.year - birth.year - ((end.month, end.day) < (birth.month, birth.day))
+        gender = GENDERS.index(patient.gender) if patient.gender in GENDERS else len(GENDERS) - 1
+        counts[bisect_right(AGE_GROUPS, age) - 1][gender] += 1
+        age_sum += age
+    return _age_report(counts, age_sum)
+
+
+def orm_repeat_visits(start, end):
+    months = month_starts(start, end)
+    first, recent = _orm_first_visits(end, since=start)
+    visits = [0] * len(months)
+    visitors = [set() for _ in months]
+    per_patient = {}
+    for patient_id, visit_date in recent:
+        i = _month_of(months, visit_date)
+        visits[i] += 1
+        visitors[i].add(patient_id)
+        per_patient[patient_id] = per_patient.get(patient_id, 0) + 1
+    distribution = [0] * VISIT_COUNT_BUCKETS
+    for count in per_patient.values():
+        distribution[min(count, VISIT_COUNT_BUCKETS) - 1] += 1
+    returning = [
+        sum(1 for patient_id in patients if first[patient_id] < months[i])
+        for i, patients in enumerate(visitors)
+    ]
+    return _repeat_report(
+        months, visits, [len(patients) for patients in visitors], returning, distribution, len(per_patient)
+    )
+
+
+def orm_cohort_revenue(start, end):
+    first, _ = _orm_first_visits(end)
+    if not first:
+        return _cohort_report([], [], [], [])
+    months = month_starts(min(first.values()), end)
+    patients = [0] * len(months)
+    for visit_date in first.values():
+        patients[_month_of(months, visit_date)] += 1
+    revenue = [0] * len(months)
+    paying = [set() for _ in months]
+    for payment in _payments(start, end).iterator():
+        visit_date = first.get(payment.patient_id)
+        if visit_date is None:
+            continue
+        i = _month_of(months, visit_date)
+        revenue[i] += int(payment.total_amount * 100)
+        paying[i].add(payment.patient_id)
+    return _cohort_report(months, patients, [len(ids) for ids in paying], revenue)
+
+
+def orm_insurance_trend(start, end):
+    months = month_starts(start, end)
+    counts, totals, insurance = [0] * len(months), [0] * len(months), [0] * len(months)
+    for payment in _payments(start, end).iterator():
+        i = _month_of(months, payment.pay_date)
+        counts[i] += 1
+        totals[i] += int(payment.total_amount * 100)
+        insurance[i] += int(payment.medical_insurance * 100)
+    return _insurance_report(months, counts, totals, insurance)
+
+
+# 报表名 -> (标题, numpy 实现, 逐行 ORM 实现)
+REPORTS = {
+    'ages': ('年龄分布', age_distribution, orm_age_distribution),
+    'repeat': ('复诊率', repeat_visits, orm_repeat_visits),
+    'cohorts': ('患者群收入', cohort_revenue, orm_cohort_revenue),
+    'insurance': ('医保占比趋势', insurance_trend, orm_insurance_trend),
+}
+
+
+def report(name, start, end):
+    """按名称计算报表（numpy 实现），结果缓存 ANALYTICS_TTL 秒"""
+    key = f'clinic:analytics:{name}:{start}:{end}'
+    result = cache.get(key)
+    if result is None:
+        result = REPORTS[name][1](start, end)
+        cache.set(key, result, ANALYTICS_TTL)
+    return result
+
+
+def benchmark(start, end, names=None, repeat=1, log=None):
+    """
+    同一日期范围分别用 numpy 实现和逐行 ORM 实现计算各报表（不走缓存），
+    返回每个报表两种实现的最短耗时、加速比，以及结果是否一致。
+    """
+    _require_numpy()
+    results = []
+    for name in names or REPORTS:
+        title, vectorised, loop = REPORTS[name]
+        timings, outputs = {}, {}
+        for label, func in (('numpy', vectorised), ('orm', loop)):
+            for _ in range(repeat):
+                began = time.perf_counter()
+                outputs[label] = func(start, end)
+                elapsed = time.perf_counter() - began
+                timings[label] = min(timings.get(label, elapsed), elapsed)
+        result = {
+            'report': name,
+            'title': title,
+            'numpy_ms': round(timings['numpy'] * 1000, 1),
+            'orm_ms': round(timings['orm'] * 1000, 1),
+            'speedup': round(timings['orm'] / timings['numpy'], 1) if timings['numpy'] else None,
+            'same': outputs['numpy'] == outputs['orm'],
+        }
+        if log:
+            log(f"{title}：numpy {result['numpy_ms']}ms，逐行 ORM {result['orm_ms']}ms，"
+                f"快 {result['speedup']} 倍，结果{'一致' if result['same'] else '不一致'}")
+        results.append(result)
+    return results
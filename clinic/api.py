@@ -0,0 +1,389 @@
+import json
+from functools import wraps
+
+from django.http import JsonResponse
+
+from . import availability, rota
+from .assignment import AssignmentError
+from .booking import BookingError, book_appointment, cancel_appointment
+from .exports import parse_date
+from .forms import AppointmentForm, PaymentForm, ScheduleForm
+from .frontdesk import check_in, settle
+from .models import Appointment, Department, MedicalRecord, Patient, Payment, Schedule
+from .pagination import KeysetPaginator
+from .replica import replica_reads
+from .roles import is_admin_user, is_reception_user
+from .transactions import write_transaction
+
+# 每页默认条数和上限（?limit=）
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+# 按ID批量查询预约（?ids=）一次最多的ID数
+API_MAX_IDS = 200
+
+# 紧凑输出：中文不转义成 \uXXXX，分隔符不带空格
+JSON_PARAMS = {'ensure_ascii': False, 'separators': (',', ':')}
+
+
+class ApiError(Exception):
+    """请求有误或无权访问，message 和状态码原样返回给调用方"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Resource:
+    """
+    一类资源的对外字段：对外字段名 -> ORM 路径，跨表的字段在同一条查询里 JOIN 取出。
+    不带 ?fields= 时只返回 default_fields；keys 为游标分页的排序键，最后一个须唯一。
+    filters：查询参数 -> (ORM 查询条件, 类型转换)。
+    """
+
+    def __init__(self, model, fields, default_fields, keys, descending=True, date_field=None, filters=None):
+        self.model = model
+        self.fields = fields
+        self.default_fields = default_fields
+        self.keys = keys
+        self.descending = descending
+        self.date_field = date_field
+        self.filters = filters or {}
+
+    def columns(self, requested=None):
+        """把 ?fields= 解析成 [(对外字段名, ORM 路径)]，有未知字段时抛出 ApiError"""
+        if not requested:
+            return [(name, self.fields[name]) for name in self.default_fields]
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError(f'未知字段：{", ".join(unknown)}')
+        return [(name, self.fields[name]) for name in dict.fromkeys(names)]
+
+    def values(self, queryset, columns):
+        # 只查请求的列，外加游标需要的排序键
+        return queryset.values(*dict.fromkeys([path for _, path in columns] + list(self.keys)))
+
+    def filter(self, queryset, params):
+        if self.date_field and params.get('date'):
+            day = parse_date(params['date'])
+            if not day:
+                raise ApiError('日期格式错误，应为 YYYY-MM-DD')
+            queryset = queryset.filter(**{self.date_field: day})
+        for param, (lookup, convert) in self.filters.items():
+            value = params.get(param)
+            if not value:
+                continue
+            try:
+                queryset = queryset.filter(**{lookup: convert(value)})
+            except ValueError:
+                raise ApiError(f'参数 {param} 格式错误')
+        return queryset
+
+    @staticmethod
+    def serialize(rows, columns):
+        return [{name: row[path] for name, path in columns} for row in rows]
+
+
+DEPARTMENTS = Resource(
+    Department,
+    fields={'id': 'dept_id', 'name': 'dept_name', 'desc': 'dept_desc'},
+    default_fields=('id', 'name'),
+    keys=('dept_id',), descending=False,
+)
+
+SCHEDULES = Resource(
+    Schedule,
+    fields={
+        'id': 'schedule_id', 'doctor_id': 'doctor_id', 'doctor_name': 'doctor__name', 'dept_id': 'doctor__dept_id',
+        'room_id': 'room_id', 'date': 'schedule_date', 'time_slot': 'time_slot', 'status': 'status',
+        'capacity': 'capacity', 'booked_count': 'booked_count',
+    },
+    default_fields=('id', 'doctor_id', 'doctor_name', 'room_id', 'date', 'time_slot', 'capacity', 'booked_count'),
+    keys=('schedule_date', 'schedule_id'),
+    date_field='schedule_date',
+    filters={'dept': ('doctor__dept_id', int), 'doctor': ('doctor_id', int), 'status': ('status', int)},
+)
+
+APPOINTMENTS = Resource(
+    Appointment,
+    fields={
+        'id': 'appt_id', 'patient_id': 'patient_id', 'patient_name': 'patient__name',
+        'dept_id': 'dept_id', 'dept_name': 'dept__dept_name', 'appt_time': 'appt_time',
+        'arrival_time': 'arrival_time', 'status': 'status', 'schedule_id': 'schedule_id',
+    },
+    default_fields=('id', 'dept_name', 'arrival_time', 'status'),
+    # 主键顺序即预约先后；按患者过滤时外键索引本身就按主键有序，不必排序
+    keys=('appt_id',),
+    date_field='arrival_date',
+    filters={'status': ('status', int), 'dept': ('dept_id', int), 'patient': ('patient_id', int)},
+)
+
+RECORDS = Resource(
+    MedicalRecord,
+    fields={
+        'id': 'record_id', 'patient_id': 'patient_id', 'patient_name': 'patient__name',
+        'doctor_id': 'doctor_id', 'doctor_name': 'doctor__name', 'room_id': 'room_id',
+        'visit_time': 'visit_time', 'visit_status': 'visit_status', 'symptom': 'symptom',
+        'prescription': 'prescription', 'appointment_id': 'appointment_id',
+    },
+    default_fields=('id', 'patient_name', 'doctor_name', 'room_id', 'visit_time', 'visit_status'),
+    # 与就诊记录列表页一致，走 (visit_time, record_id) 索引
+    keys=('visit_time', 'record_id'),
+    date_field='visit_date',
+    filters={'doctor': ('doctor_id', int), 'patient': ('patient_id', int), 'status': ('visit_status', int)},
+)
+
+PAYMENTS = Resource(
+    Payment,
+    fields={
+        'id': 'pay_id', 'record_id': 'record_id', 'patient_name': 'record__patient__name',
+        'total_amount': 'total_amount', 'medical_insurance': 'medical_insurance', 'self_pay': 'self_pay',
+        'pay_method': 'pay_method', 'pay_time': 'pay_time',
+    },
+    default_fields=('id', 'record_id', 'patient_name', 'total_amount', 'self_pay', 'pay_method', 'pay_time'),
+    keys=('pay_id',),
+    date_field='pay_date',
+    filters={'method': ('pay_method', str)},
+)
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params=JSON_PARAMS)
+
+
+def _error(message, status):
+    return _json({'error': message}, status)
+
+
+def api_view(*methods):
+    """
+    JSON API 视图：未登录返回401（不跳转登录页），不支持的方法返回405，
+    ApiError 转成对应状态码的 {"error": ...}。
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return _error('请先登录', 401)
+            if request.method not in methods:
+                response = _error('不支持的请求方法', 405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            try:
+                return view_func(request, *args, **kwargs)
+            except ApiError as e:
+                return _error(str(e), e.status)
+        return wrapper
+    return decorator
+
+
+def _require(allowed):
+    if not allowed:
+        raise ApiError('无权访问', 403)
+
+
+def _patient_id(request):
+    """当前患者的ID；与 patient_required 一致，未完善信息的患者不能访问"""
+    _require(request.role.is_patient)
+    if request.role.patient_id is None:
+        raise ApiError('请先完善个人信息', 403)
+    return request.role.patient_id
+
+
+def _payload(request):
+    """请求体：JSON 或表单"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            raise ApiError('请求体不是合法的JSON')
+        if not isinstance(data, dict):
+            raise ApiError('请求体须为JSON对象')
+        return data
+    return request.POST
+
+
+def _form_error(form):
+    return '；'.join(message for errors in form.errors.values() for message in errors)
+
+
+def _page_size(request):
+    value = request.GET.get('limit')
+    if not value:
+        return API_PAGE_SIZE
+    if not value.isdigit() or not 0 < int(value) <= API_MAX_PAGE_SIZE:
+        raise ApiError(f'limit 须为 1-{API_MAX_PAGE_SIZE} 的整数')
+    return int(value)
+
+
+def list_response(request, resource, queryset):
+    """按 ?fields= 投影、按筛选参数过滤，游标分页（?after= / ?before=）返回一页，只查一次库"""
+    columns = resource.columns(request.GET.get('fields'))
+    queryset = resource.filter(queryset, request.GET)
+    paginator = KeysetPaginator(
+        resource.values(queryset, columns), resource.keys, per_page=_page_size(request), descending=resource.descending
+    )
+    page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    return _json({
+        'results': resource.serialize(page, columns),
+        'next': page.next_cursor,
+        'previous': page.prev_cursor,
+    })
+
+
+def _detail_response(request, resource, queryset, status=200):
+    columns = resource.columns(request.GET.get('fields'))
+    row = resource.values(queryset, columns).first()
+    if row is None:
+        raise ApiError('不存在', 404)
+    return _json(resource.serialize([row], columns)[0], status)
+
+
+def _bulk_response(request, resource, queryset, ids):
+    """按ID列表一次取出，按请求的顺序返回；不存在或无权查看的ID列在 missing 里"""
+    try:
+        ids = list(dict.fromkeys(int(value) for value in ids.split(',') if value.strip()))
+    except ValueError:
+        raise ApiError('ids 须为逗号分隔的整数')
+    if len(ids) > API_MAX_IDS:
+        raise ApiError(f'一次最多查询 {API_MAX_IDS} 个ID')
+    columns = resource.columns(request.GET.get('fields'))
+    pk = resource.model._meta.pk.name
+    rows = {row[pk]: row for row in resource.values(queryset.filter(pk__in=ids), columns)}
+    return _json({
+        'results': resource.serialize([rows[i] for i in ids if i in rows], columns),
+        'missing': [i for i in ids if i not in rows],
+    })
+
+
+def _appointment_scope(request):
+    """前台看全部预约，患者只看自己的（同 reception_required / patient_required）"""
+    if is_reception_user(request.user):
+        return Appointment.objects.all()
+    return Appointment.objects.filter(patient_id=_patient_id(request))
+
+
+@api_view('GET')
+def api_departments(request):
+    return list_response(request, DEPARTMENTS, Department.objects.all())
+
+
+@api_view('GET')
+def api_availability(request):
+    """
+    未来 BOOKING_DAYS 天各科室的余号（?dept= 只看一个科室），读缓存的余号表，不查库。
+    mask 的第 i 位为 1 表示第 i 个 slot_minutes 分钟的时段有号，open 为合并后的时间段。
+    """
+    dept = request.GET.get('dept')
+    if dept and not dept.isdigit():
+        raise ApiError('参数 dept 格式错误')
+    departments = availability.get_map().summary(dept_id=int(dept) if dept else None)
+    for department in departments:
+        for day in department['days']:
+            day['date'] = day['date'].isoformat()
+    return _json({'slot_minutes': availability.SLOT_MINUTES, 'departments': departments})
+
+
+@api_view('GET', 'POST')
+def api_schedules(request):
+    """GET：登录用户都可查看排班（预约时选号源）；POST：管理员新增一条排班，与页面一样检查时间冲突"""
+    if request.method == 'GET':
+        return list_response(request, SCHEDULES, Schedule.objects.all())
+
+    _require(is_admin_user(request.user))
+    form = ScheduleForm(_payload(request))
+    if not form.is_valid():
+        raise ApiError(_form_error(form))
+    data = form.cleaned_data
+    published, clashes = rota.publish([rota.Shift(
+        None, data['doctor'].pk, data['room'].pk, data['schedule_date'],
+        data['time_slot'], data['capacity'], data['status']
+    )])
+    if not published:
+        raise ApiError(rota.describe_clash(clashes[0]), 409)
+    # 批量写入不回传主键，按唯一键 (医生, 日期, 时间段) 取回
+    return _detail_response(request, SCHEDULES, Schedule.objects.filter(
+        doctor_id=data['doctor'].pk, schedule_date=data['schedule_date'], time_slot=data['time_slot']
+    ), status=201)
+
+
+@api_view('GET', 'POST')
+def api_appointments(request):
+    """
+    GET：预约列表，?ids=1,2,3 按ID批量查询；
+    POST：患者预约（dept、arrival_time 格式 YYYY-MM-DD HH:MM），占号规则与预约页面相同。
+    """
+    if request.method == 'GET':
+        ids = request.GET.get('ids')
+        if ids:
+            return _bulk_response(request, APPOINTMENTS, _appointment_scope(request), ids)
+        return list_response(request, APPOINTMENTS, _appointment_scope(request))
+
+    patient_id = _patient_id(request)
+    form = AppointmentForm(_payload(request))
+    if not form.is_valid():
+        raise ApiError(_form_error(form))
+    try:
+        # 只用到主键，不必查出整条患者记录
+        appointment = book_appointment(
+            Patient(pk=patient_id), form.cleaned_data['dept'], form.cleaned_data['arrival_time']
+        )
+    except BookingError as e:
+        raise ApiError(str(e), 409)
+    return _detail_response(request, APPOINTMENTS, Appointment.objects.filter(pk=appointment.pk), status=201)
+
+
+@api_view('POST')
+def api_appointment_cancel(request, appt_id):
+    """患者取消自己未就诊的预约，释放号源"""
+    patient_id = _patient_id(request)
+    if not cancel_appointment(appt_id, patient_id):
+        raise ApiError('预约不存在或已无法取消', 404)
+    return _detail_response(request, APPOINTMENTS, Appointment.objects.filter(pk=appt_id))
+
+
+@api_view('GET', 'POST')
+@write_transaction
+@replica_reads
+def api_records(request):
+    """
+    GET：就诊记录，前台和医生可查看（同 reception_required）；
+    POST：前台核验预约（appt_id），分配医生和诊室后生成就诊记录，与核验页面相同。
+    """
+    _require(is_reception_user(request.user))
+    if request.method == 'GET':
+        return list_response(request, RECORDS, MedicalRecord.objects.all())
+
+    try:
+        record = check_in(_payload(request).get('appt_id'))
+    except (Appointment.DoesNotExist, ValueError):
+        raise ApiError('预约ID不存在或已完成/取消', 404)
+    except AssignmentError as e:
+        raise ApiError(str(e), 409)
+    return _detail_response(request, RECORDS, MedicalRecord.objects.filter(pk=record.pk), status=201)
+
+
+@api_view('GET', 'POST')
+@write_transaction
+@replica_reads
+def api_payments(request):
+    """
+    GET：缴费记录；POST：前台为就诊中的记录缴费结算（record_id、total_amount、medical_insurance、pay_method），
+    金额按缴费表单校验，结算后记录标为已离院。
+    """
+    _require(is_reception_user(request.user))
+    if request.method == 'GET':
+        return list_response(request, PAYMENTS, Payment.objects.all())
+
+    data = _payload(request)
+    form = PaymentForm(data)
+    if not form.is_valid():
+        raise ApiError(_form_error(form))
+    try:
+        payment = settle(
+            data.get('record_id'), form.cleaned_data['total_amount'],
+            form.cleaned_data['medical_insurance'], form.cleaned_data['pay_method']
+        )
+    except (MedicalRecord.DoesNotExist, ValueError):
+        raise ApiError('就诊记录不存在或已缴费', 404)
+    return _detail_response(request, PAYMENTS, Payment.objects.filter(pk=payment.pk), status=201)
@@ -3,4 +3,8 @@ from django.apps import AppConfig
 class ClinicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'clinic'
-    verbose_name = '门诊管理'  # 后台显示的应用名称
\ No newline at end of file
+    verbose_name = '门诊管理'  # 后台显示的应用名称
+
+    def ready(self):
+        # 注册模型信号（统计汇总表等）
+        from . import signals  # noqa: F401
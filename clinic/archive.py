@@ -0,0 +1,123 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Appointment, MedicalRecord, Payment
+from .page_versions import bump_all_patients
+from .transactions import retry_locked
+
+# 每个事务搬移的就诊记录/预约数：事务越小，占用写锁的时间越短，前台写入等待越少
+ARCHIVE_CHUNK_SIZE = 2000
+
+RECORD_COLUMNS = (
+    'record_id, patient_id, doctor_id, room_id, visit_time, visit_status, '
+    'symptom, prescription, appointment_id, visit_date'
+)
+PAYMENT_COLUMNS = 'pay_id, record_id, total_amount, medical_insurance, self_pay, pay_time, pay_method, pay_date'
+APPOINTMENT_COLUMNS = 'appt_id, patient_id, dept_id, appt_time, arrival_time, status, arrival_date, schedule_id'
+
+
+def archive_cutoff(days=None, today=None):
+    """
+    早于该日期的数据可以归档。最晚不超过本月1日：
+    首页的当天/当月计数器（clinic/counters.py）只查热表，归档不能让它们变少。
+    """
+    if days is None:
+        days = settings.CLINIC_ARCHIVE_AFTER_DAYS
+    today = today or timezone.localdate()
+    return min(today - timedelta(days=days), today.replace(day=1))
+
+
+def _placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def _move_records(ids):
+    marks = _placeholders(ids)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO clinic_archivedmedicalrecord ({RECORD_COLUMNS}) '
+            f'SELECT {RECORD_COLUMNS} FROM clinic_medicalrecord WHERE record_id IN ({marks})', ids
+        )
+        cursor.execute(
+            f'INSERT INTO clinic_archivedpayment ({PAYMENT_COLUMNS}) '
+            f'SELECT {PAYMENT_COLUMNS} FROM clinic_payment WHERE record_id IN ({marks})', ids
+        )
+        # 直接删除，不经过模型的 delete：不触发信号，统计汇总、全文索引保持原样
+        cursor.execute(f'DELETE FROM clinic_payment WHERE record_id IN ({marks})', ids)
+        cursor.execute(f'DELETE FROM clinic_medicalrecord WHERE record_id IN ({marks})', ids)
+
+
+def _move_appointments(ids):
+    marks = _placeholders(ids)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO clinic_archivedappointment ({APPOINTMENT_COLUMNS}) '
+            f'SELECT {APPOINTMENT_COLUMNS} FROM clinic_appointment WHERE appt_id IN ({marks})', ids
+        )
+        cursor.execute(f'DELETE FROM clinic_appointment WHERE appt_id IN ({marks})', ids)
+
+
+def _chunks(queryset, chunk_size):
+    """按主键游标逐块取出待归档的ID；每块搬走后从上一块的末尾继续，不必重扫已处理的部分"""
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def archivable_records(cutoff):
+    """已离院、已缴费且就诊日期早于 cutoff 的就诊记录"""
+    return MedicalRecord.objects.filter(visit_date__lt=cutoff, visit_status=1, payment__isnull=False)
+
+
+def archivable_appointments(cutoff, with_records=False):
+    """
+    已完成或已取消、到达日期早于 cutoff，且热表里没有就诊记录还关联着的预约。
+    with_records 时把关联记录都会在本次归档的预约也算上（dry_run 统计用）。
+    """
+    appointments = Appointment.objects.filter(arrival_date__lt=cutoff, status__in=(1, 2))
+    if not with_records:
+        return appointments.filter(medicalrecord__isnull=True)
+    remaining = MedicalRecord.objects.filter(appointment=OuterRef('pk')).exclude(
+        pk__in=archivable_records(cutoff).values('pk')
+    )
+    return appointments.filter(~Exists(remaining))
+
+
+def archive(days=None, chunk_size=ARCHIVE_CHUNK_SIZE, dry_run=False, log=None):
+    """
+    把超过保留期的就诊记录（连同缴费）和预约从热表搬到归档表，每块一个事务，锁冲突时整块重试。
+    先搬就诊记录，预约的关联记录都搬走后才能搬预约。返回 (截止日期, 记录数, 预约数)；
+    dry_run 只统计不搬移。
+    """
+    cutoff = archive_cutoff(days)
+    if dry_run:
+        return cutoff, archivable_records(cutoff).count(), archivable_appointments(cutoff, with_records=True).count()
+
+    counts = []
+    for label, queryset, move in (
+        ('就诊记录', archivable_records(cutoff), _move_records),
+        ('预约', archivable_appointments(cutoff), _move_appointments),
+    ):
+        moved = 0
+        for ids in _chunks(queryset, chunk_size):
+            retry_locked(move, ids)
+            moved += len(ids)
+            if log:
+                log(f'{label}：已归档 {moved} 条')
+        counts.append(moved)
+    if any(counts):
+        # 患者的预约列表等页面少了已归档的数据
+        bump_all_patients()
+        # 热表行数变化很大，更新统计信息：查询规划和后台列表页的估算行数都依赖它
+        with connection.cursor() as cursor:
+            for model in (Appointment, MedicalRecord, Payment):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+    return (cutoff, *counts)
@@ -0,0 +1,170 @@
+import heapq
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import ClinicRoom, Doctor, MedicalRecord, Schedule, parse_time_slot
+
+# 索引有效期（秒）：到期后从数据库重建，纠正其他进程分诊造成的偏差
+INDEX_TTL = 60
+
+
+class AssignmentError(Exception):
+    """分诊失败，message 直接展示给前台"""
+
+
+class _Pool:
+    """
+    某科室当天一个接诊时间段内排班的医生，按 (在诊人数, 医生ID) 建小顶堆。
+    负载变化时压入新条目，旧条目留在堆里，取堆顶时发现与当前负载不符再丢弃（惰性删除）。
+    """
+
+    def __init__(self, time_slot, loads):
+        self.slot = parse_time_slot(time_slot)
+        self._loads = loads  # 索引里的 医生ID -> 在诊人数
+        self.rooms = {}  # 医生ID -> 排班诊室ID
+        self.heap = []
+
+    def covers(self, minute):
+        # 与 Schedule.covers 一致：时间段无法解析时视为全天
+        return self.slot is None or self.slot[0] <= minute < self.slot[1]
+
+    def push(self, doctor_id, load):
+        heapq.heappush(self.heap, (load, doctor_id))
+        # 过期条目太多时整体重建，堆大小保持在医生数的常数倍
+        if len(self.heap) > 4 * len(self.rooms) + 16:
+            self.heap = [entry for entry in self.heap if entry[0] == self._loads.get(entry[1], 0)]
+            heapq.heapify(self.heap)
+
+    def top(self):
+        while self.heap:
+            load, doctor_id = self.heap[0]
+            if load == self._loads.get(doctor_id, 0):
+                return self.heap[0]
+            heapq.heappop(self.heap)
+        return None
+
+
+class AssignmentIndex:
+    """
+    进程内的分诊索引：当天各医生、各诊室在诊（visit_status=0）的就诊记录数，
+    以及按科室和接诊时间段分组的医生堆。挑选负载最低的医生是 O(log n)。
+    首次使用时用一条 GROUP BY 查询建立（走 record_date_status_idx），之后随就诊开始/结束增量更新。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.day = None
+        self.built_at = 0
+        self.doctor_load = Counter()
+        self.room_load = Counter()
+        self.pools = {}  # 科室ID -> [_Pool]
+        self.doctor_pools = defaultdict(list)
+
+    def invalidate(self):
+        # 下次使用时整体重建
+        with self._lock:
+            self.built_at = 0
+
+    def _ensure(self, day):
+        if day == self.day and time.monotonic() - self.built_at < INDEX_TTL:
+            return
+        self.reset()
+        rows = MedicalRecord.objects.filter(visit_date=day, visit_status=0).values_list(
+            'doctor_id', 'room_id'
+        ).annotate(n=Count('pk')).order_by()
+        for doctor_id, room_id, n in rows:
+            self.doctor_load[doctor_id] += n
+            self.room_load[room_id] += n
+        self.day = day
+        self.built_at = time.monotonic()
+
+    def _dept_pools(self, dept_id):
+        pools = self.pools.get(dept_id)
+        if pools is not None:
+            return pools
+        by_slot = {}
+        schedules = Schedule.objects.filter(
+            doctor__dept_id=dept_id, doctor__work_status='在职', schedule_date=self.day, status=1
+        ).values_list('doctor_id', 'room_id', 'time_slot')
+        for doctor_id, room_id, time_slot in schedules:
+            pool = by_slot.get(time_slot)
+            if pool is None:
+                pool = by_slot[time_slot] = _Pool(time_slot, self.doctor_load)
+            pool.rooms[doctor_id] = room_id
+            pool.push(doctor_id, self.doctor_load[doctor_id])
+            self.doctor_pools[doctor_id].append(pool)
+        pools = self.pools[dept_id] = list(by_slot.values())
+        return pools
+
+    def pick(self, dept_id, when=None):
+        """当前时段排班中在诊人数最少的 (医生ID, 诊室ID)；没有排班覆盖当前时刻时返回None"""
+        when = timezone.localtime(when)
+        minute = when.hour * 60 + when.minute
+        with self._lock:
+            self._ensure(when.date())
+            best = None
+            for pool in self._dept_pools(dept_id):
+                if not pool.covers(minute):
+                    continue
+                top = pool.top()
+                if top is not None and (best is None or top < best[0]):
+                    best = (top, pool)
+            if best is None:
+                return None
+            (_, doctor_id), pool = best
+            return doctor_id, pool.rooms[doctor_id]
+
+    def least_loaded(self, day, doctor_ids, room_ids):
+        """在给定的医生和诊室中各挑在诊人数最少的（没有排班时的兜底）"""
+        with self._lock:
+            self._ensure(day)
+            doctor_id = min(doctor_ids, key=lambda pk: (self.doctor_load[pk], pk), default=None)
+            room_id = min(room_ids, key=lambda pk: (self.room_load[pk], pk), default=None)
+            return doctor_id, room_id
+
+    def apply(self, day, doctor_id, room_id, delta):
+        with self._lock:
+            if day != self.day:
+                return
+            self.doctor_load[doctor_id] += delta
+            self.room_load[room_id] += delta
+            for pool in self.doctor_pools.get(doctor_id, ()):
+                pool.push(doctor_id, self.doctor_load[doctor_id])
+
+
+index = AssignmentIndex()
+
+
+def visit_changed(day, doctor_id, room_id, delta):
+    """就诊开始（+1）或结束（-1）；事务提交后才计入索引"""
+    transaction.on_commit(lambda: index.apply(day, doctor_id, room_id, delta))
+
+
+def schedules_changed():
+    """排班变动后丢弃已建好的医生堆，下次分诊时按新排班重建"""
+    transaction.on_commit(index.invalidate)
+
+
+def assign(dept_id, when=None):
+    """
+    为 dept_id 科室的到诊患者分配医生和诊室，返回 (医生ID, 诊室ID)。
+    优先在当天覆盖当前时刻的排班中挑在诊人数最少的医生（诊室用其排班诊室）；
+    当前时段无人排班时，在科室在职医生和科室诊室中各挑负载最低的。
+    """
+    picked = index.pick(dept_id, when)
+    if picked:
+        return picked
+    doctor_ids = Doctor.objects.filter(dept_id=dept_id, work_status='在职').values_list('pk', flat=True)
+    room_ids = ClinicRoom.objects.filter(dept_id=dept_id).values_list('pk', flat=True)
+    doctor_id, room_id = index.least_loaded(timezone.localdate(when), list(doctor_ids), list(room_ids))
+    if doctor_id is None or room_id is None:
+        raise AssignmentError('该科室当前没有可接诊的医生或诊室')
+    return doctor_id, room_id
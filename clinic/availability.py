@@ -0,0 +1,180 @@
+import time
+from array import array
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Department, Schedule, parse_time_slot
+
+# 最多预约未来几天（AppointmentForm.clean_arrival_time 按这个校验）：今天起到第7天的同一时刻
+BOOKING_DAYS = 7
+# 余号表的粒度：一天按半小时分成48格
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+# 余号表有效期（秒）：到期后从数据库重建，纠正多进程同时增量更新时可能丢失的改动
+AVAILABILITY_TTL = 300
+
+
+def _slot_range(time_slot):
+    """排班覆盖的格子 [first, last)：格子的开始时刻落在接诊时间段内；时间段无法解析时视为全天"""
+    slot = parse_time_slot(time_slot)
+    if slot is None:
+        return 0, SLOTS_PER_DAY
+    start, end = slot
+    return -(-start // SLOT_MINUTES), min(-(-end // SLOT_MINUTES), SLOTS_PER_DAY)
+
+
+def _clock(minute):
+    return f'{minute // 60:02d}:{minute % 60:02d}'
+
+
+class AvailabilityMap:
+    """
+    今天起 BOOKING_DAYS+1 天内各科室的余号表，建好后放在缓存里，预约页和 API 直接读，不查库。
+    cells[(科室ID, 第几天)] 是每半小时一格的 array('L')（至少32位，排班余号之和超过 65535 也不溢出）：覆盖该格开始时刻、仍可接诊的排班的余号之和
+    （预约时按到达时刻所在的排班占号，与 booking.available_schedules 一致）。
+    schedules 记每个排班所在的格子和余号，预约、取消时只改动它覆盖的格子。
+    """
+
+    def __init__(self, day):
+        self.day = day
+        self.depts = {}  # 科室ID -> 科室名称
+        self.schedules = {}  # 排班ID -> [科室ID, 第几天, 起始格, 结束格, 余号]
+        self.cells = {}
+
+    @classmethod
+    def build(cls, day):
+        availability = cls(day)
+        availability.depts = dict(Department.objects.order_by('dept_id').values_list('dept_id', 'dept_name'))
+        rows = Schedule.objects.filter(
+            schedule_date__gte=day, schedule_date__lte=day + timedelta(days=BOOKING_DAYS), status=1
+        ).values_list('schedule_id', 'doctor__dept_id', 'schedule_date', 'time_slot', 'capacity', 'booked_count')
+        for schedule_id, dept_id, schedule_date, time_slot, capacity, booked_count in rows:
+            first, last = _slot_range(time_slot)
+            availability.schedules[schedule_id] = [
+                dept_id, (schedule_date - day).days, first, last, max(capacity - booked_count, 0)
+            ]
+            availability._add(schedule_id, availability.schedules[schedule_id][4])
+        return availability
+
+    def _add(self, schedule_id, delta):
+        dept_id, offset, first, last, _ = self.schedules[schedule_id]
+        key = (dept_id, offset)
+        cells = self.cells.get(key)
+        if cells is None:
+            cells = self.cells[key] = array('L', [0]) * SLOTS_PER_DAY
+        for i in range(first, last):
+            cells[i] += delta
+
+    def adjust(self, schedule_id, delta):
+        """排班余号变化 delta（预约 -1，取消 +1）；不在表里的排班返回False"""
+        entry = self.schedules.get(schedule_id)
+        if entry is None:
+            return False
+        left = max(entry[4] + delta, 0)
+        self._add(schedule_id, left - entry[4])
+        entry[4] = left
+        return True
+
+    def summary(self, now=None, dept_id=None):
+        """
+        各科室每天的余号：seats 为还能约到的排班余号合计，mask 的第 i 位表示第 i 个半小时有号，
+        open 为有号的时间段。已经过去的格子和超出 BOOKING_DAYS 的格子不算。
+        """
+        now = timezone.localtime(now)
+        now_minute = (now.date() - self.day).days * 24 * 60 + now.hour * 60 + now.minute
+        latest = now_minute + BOOKING_DAYS * 24 * 60
+        schedules_by_day = {}
+        for schedule_id, (dept, offset, first, last, left) in self.schedules.items():
+            schedules_by_day.setdefault((dept, offset), []).append((first, last, left))
+
+        # 每天还能约的格子：格子里还有没过去的时刻，且开始时刻不晚于最晚可约时间
+        windows = []
+        for offset in range(BOOKING_DAYS + 1):
+            window = 0
+            for i in range(SLOTS_PER_DAY):
+                start = offset * 24 * 60 + i * SLOT_MINUTES
+                if start + SLOT_MINUTES > now_minute and start <= latest:
+                    window |= 1 << i
+            windows.append(window)
+
+        result = []
+        for dept, name in self.depts.items():
+            if dept_id is not None and dept != dept_id:
+                continue
+            days = []
+            for offset, window in enumerate(windows):
+                cells = self.cells.get((dept, offset), ())
+                mask = sum(1 << i for i, seats in enumerate(cells) if seats) & window
+                # 排班覆盖的格子里还有能约的，它的余号才算
+                seats = sum(
+                    left for first, last, left in schedules_by_day.get((dept, offset), ())
+                    if mask & ((1 << last) - (1 << first))
+                )
+                days.append({
+                    'date': self.day + timedelta(days=offset),
+                    'seats': seats,
+                    'mask': mask,
+                    'open': _ranges(mask),
+                })
+            result.append({'id': dept, 'name': name, 'days': days})
+        return result
+
+
+def _ranges(mask):
+    """把 mask 中连续的有号格子合并成 ['08:00-12:00', ...]"""
+    ranges = []
+    i = 0
+    while i < SLOTS_PER_DAY:
+        if mask >> i & 1:
+            j = i
+            while j < SLOTS_PER_DAY and mask >> j & 1:
+                j += 1
+            ranges.append(f'{_clock(i * SLOT_MINUTES)}-{_clock(j * SLOT_MINUTES)}')
+            i = j
+        else:
+            i += 1
+    return ranges
+
+
+def _key(day):
+    # 同计数器：键里带上日期和时间分桶，跨天、到期都自动换新键重建
+    epoch = int(time.time() // AVAILABILITY_TTL)
+    return f'clinic:availability:{day}:{epoch}'
+
+
+def get_map(now=None):
+    """当天的余号表；缓存未命中时查库建一次（一条走 schedule_date_status_idx 的查询）"""
+    day = timezone.localdate(now)
+    key = _key(day)
+    availability = cache.get(key)
+    if availability is None:
+        availability = AvailabilityMap.build(day)
+        # add 不覆盖：建表期间若已有其他进程写入（可能已累加了预约），以缓存中的为准
+        if not cache.add(key, availability, AVAILABILITY_TTL):
+            availability = cache.get(key, availability)
+    return availability
+
+
+def _apply(schedule_id, delta):
+    key = _key(timezone.localdate())
+    availability = cache.get(key)
+    if availability is not None and availability.adjust(schedule_id, delta):
+        cache.set(key, availability, AVAILABILITY_TTL)
+
+
+def booked(schedule_id):
+    """预约占号成功；事务提交后才从余号表扣掉"""
+    transaction.on_commit(lambda: _apply(schedule_id, -1))
+
+
+def released(schedule_id):
+    """取消预约释放号源"""
+    transaction.on_commit(lambda: _apply(schedule_id, 1))
+
+
+def schedules_changed():
+    """排班增删改后丢弃余号表，下次读取时按新排班重建"""
+    transaction.on_commit(lambda: cache.delete(_key(timezone.localdate())))
@@ -0,0 +1,40 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    生产环境用的 SQLite 后端，在 OPTIONS 中额外支持：
+      pragmas：每个新连接执行的 PRAGMA，如 {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+      transaction_mode：事务开始方式，IMMEDIATE 表示 BEGIN 时就拿写锁，
+        避免两个事务都先读后写、升级写锁时互相等待而直接报 "database is locked"
+    其余 OPTIONS 原样传给 sqlite3.connect。
+    """
+
+    @property
+    def pragmas(self):
+        return self.settings_dict['OPTIONS'].get('pragmas', {})
+
+    @property
+    def transaction_mode(self):
+        mode = (self.settings_dict['OPTIONS'].get('transaction_mode') or 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f'transaction_mode 只能是 {", ".join(TRANSACTION_MODES)}')
+        return mode
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
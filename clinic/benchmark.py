@@ -0,0 +1,335 @@
+import json
+import math
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from .instrumentation import collect_queries
+from .models import Appointment, ClinicRoom, Department, Doctor, MedicalRecord, Patient, Payment
+from .roles import DOCTOR_GROUP, ROLE_ADMIN, ROLE_DOCTOR, ROLE_PATIENT, ROLE_RECEPTION
+from .urls import urlpatterns
+
+ROLE_ANONYMOUS = 'anonymous'
+# 路由前缀 -> 访问该路由的角色；其余路由（首页等）按患者访问
+ROLE_PREFIXES = [
+    ('patient/', ROLE_PATIENT),
+    ('reception/', ROLE_RECEPTION),
+    ('admin/', ROLE_ADMIN),
+    ('doctor/', ROLE_DOCTOR),
+]
+ANONYMOUS_ROUTES = {'login'}
+# 会改变数据或会话的路由不压测
+SKIP_ROUTES = {
+    'logout': '会注销会话',
+    'appointment_cancel': '会修改预约状态',
+}
+# 回归判定：p95 增幅超过阈值且绝对值超过该毫秒数才算，避免噪声误报
+MIN_DELTA_MS = 2.0
+
+
+def _recent_week():
+    today = timezone.localdate()
+    return {'start': (today - timedelta(days=6)).isoformat(), 'end': today.isoformat()}
+
+
+# 路由的查询参数：导出默认是全表，压测只导出最近一周
+ROUTE_QUERY = {
+    'reception_payment_export': _recent_week,
+    'reception_visit_export': _recent_week,
+}
+
+
+def _latest_appointment(users):
+    patient = users.get(ROLE_PATIENT)
+    if patient is None:
+        return None
+    return Appointment.objects.filter(patient__user=patient).order_by('-appt_id').values_list('pk', flat=True).first()
+
+
+# URL 参数名 -> 取值函数（参数为各角色用户）
+URL_KWARGS = {
+    'appt_id': _latest_appointment,
+    # 统计子页面压测年龄分布（预热请求算完后读缓存）
+    'report': lambda users: 'ages',
+}
+
+
+def find_users(overrides=None):
+    """
+    每个角色挑一个已有账号：管理员取超级用户，医生取医生组里有医生档案的员工，
+    前台取其余员工，患者取最近有预约的患者。overrides 为 {角色: 用户名}。
+    """
+    users = {
+        ROLE_ADMIN: User.objects.filter(is_superuser=True, is_active=True).order_by('pk').first(),
+        ROLE_RECEPTION: User.objects.filter(is_staff=True, is_superuser=False, is_active=True)
+        .exclude(groups__name=DOCTOR_GROUP).order_by('pk').first(),
+        ROLE_DOCTOR: User.objects.filter(
+            pk__in=Doctor.objects.filter(user__groups__name=DOCTOR_GROUP, user__is_staff=True).values('user_id')[:1]
+        ).first(),
+        ROLE_PATIENT: User.objects.filter(
+            pk__in=Patient.objects.filter(
+                patient_id=Appointment.objects.order_by('-appt_id').values('patient_id')[:1]
+            ).values('user_id')
+        ).first(),
+    }
+    for role, username in (overrides or {}).items():
+        users[role] = User.objects.get(username=username)
+    return {role: user for role, user in users.items() if user is not None}
+
+
+@contextmanager
+def use_dataset(path):
+    """
+    with 块内默认库换成 path 指向的 SQLite 文件（压测用的数据集），结束后恢复原配置。
+    改的是连接配置本身，并发写入压测各线程新建的连接也连到这个文件。
+    """
+    connection.close()
+    original = connection.settings_dict['NAME']
+    connection.settings_dict['NAME'] = path
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = original
+
+
+def route_role(pattern):
+    if pattern.name in ANONYMOUS_ROUTES:
+        return ROLE_ANONYMOUS
+    route = str(pattern.pattern)
+    for prefix, role in ROLE_PREFIXES:
+        if route.startswith(prefix):
+            return role
+    return ROLE_PATIENT
+
+
+def discover_routes(users, names=None):
+    """
+    遍历 clinic/urls.py 中的路由，返回 ([(路由名, 角色, URL, 查询参数)], {跳过的路由名: 原因})
+    """
+    routes, skipped = [], {}
+    for pattern in urlpatterns:
+        if not isinstance(pattern, URLPattern) or not pattern.name:
+            continue
+        name = pattern.name
+        if names and name not in names:
+            continue
+        if name in SKIP_ROUTES:
+            skipped[name] = SKIP_ROUTES[name]
+            continue
+        role = route_role(pattern)
+        if role != ROLE_ANONYMOUS and role not in users:
+            skipped[name] = f'没有可用的{role}账号'
+            continue
+        kwargs = {}
+        for param in pattern.pattern.converters:
+            value = URL_KWARGS[param](users) if param in URL_KWARGS else None
+            if value is None:
+                break
+            kwargs[param] = value
+        else:
+            url = reverse(name, kwargs=kwargs)
+            routes.append((name, role, url, ROUTE_QUERY.get(name, dict)()))
+            continue
+        skipped[name] = 'URL 参数无可用取值'
+    return routes, skipped
+
+
+def percentile(values, pct):
+    """最近秩法百分位"""
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def measure(client, url, query, requests, warmup):
+    """请求 url warmup+requests 次，只统计后 requests 次"""
+    samples = []
+    status = None
+    for i in range(warmup + requests):
+        started = time.perf_counter()
+        with collect_queries() as timer:
+            response = client.get(url, query)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        elapsed = time.perf_counter() - started
+        status = response.status_code
+        if i >= warmup:
+            samples.append((elapsed * 1000, timer.count, timer.seconds * 1000))
+    wall = [s[0] for s in samples]
+    return {
+        'status': status,
+        'p50_ms': round(percentile(wall, 50), 3),
+        'p95_ms': round(percentile(wall, 95), 3),
+        'p99_ms': round(percentile(wall, 99), 3),
+        'queries': max(s[1] for s in samples),
+        'sql_ms': round(percentile([s[2] for s in samples], 50), 3),
+    }
+
+
+def run(requests=20, warmup=2, names=None, users=None, log=None):
+    """按角色登录后逐个压测路由，返回可直接写成 JSON 的结果"""
+    log = log or (lambda message: None)
+    users = find_users() if users is None else users
+    routes, skipped = discover_routes(users, names)
+    clients = {}
+    results = {}
+    for name, role, url, query in routes:
+        if role not in clients:
+            clients[role] = Client(HTTP_HOST=_host(), raise_request_exception=False)
+            if role != ROLE_ANONYMOUS:
+                clients[role].force_login(users[role])
+        result = measure(clients[role], url, query, requests, warmup)
+        results[name] = {'role': role, 'url': url, **result}
+        log(f"{name:<28} {result['status']:>3}  p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  "
+            f"p99 {result['p99_ms']:>8.2f} ms  SQL {result['queries']:>3} 条 / {result['sql_ms']:.2f} ms")
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'requests': requests,
+            'warmup': warmup,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': str(connection.settings_dict['NAME']),
+            'dataset': {
+                model._meta.model_name: model.objects.count()
+                for model in (Patient, Appointment, MedicalRecord, Payment)
+            },
+            'users': {role: user.username for role, user in users.items()},
+        },
+        'views': results,
+        'skipped': skipped,
+    }
+
+
+def compare(results, baseline, threshold=0.2, min_delta_ms=MIN_DELTA_MS):
+    """
+    与基线对比，返回回归列表：p95 变慢超过 threshold（比例）且超过 min_delta_ms，
+    或 SQL 查询数变多，或原本正常的页面出错。
+    """
+    regressions = []
+    for name, current in results['views'].items():
+        base = baseline.get('views', {}).get(name)
+        if base is None:
+            continue
+        if current['status'] >= 500 > base['status']:
+            regressions.append(f"{name}: 状态码 {base['status']} -> {current['status']}")
+        delta = current['p95_ms'] - base['p95_ms']
+        if current['p95_ms'] > base['p95_ms'] * (1 + threshold) and delta > min_delta_ms:
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms")
+        if current['queries'] > base['queries']:
+            regressions.append(f"{name}: SQL 查询数 {base['queries']} -> {current['queries']}")
+    return regressions
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _create_pending_appointments(count):
+    """给写入压测准备 count 个今天的未就诊预约（科室需有在职医生和诊室）"""
+    dept = Department.objects.filter(
+        pk__in=Doctor.objects.filter(work_status='在职').values('dept_id')
+    ).filter(pk__in=ClinicRoom.objects.values('dept_id')).first()
+    patients = list(Patient.objects.order_by('pk').values_list('pk', flat=True)[:count])
+    if dept is None or not patients:
+        return []
+    base = timezone.now().replace(microsecond=0)
+    with transaction.atomic():
+        return [
+            Appointment.objects.create(
+                patient_id=patients[i % len(patients)], dept=dept,
+                arrival_time=base + timedelta(seconds=i), status=0
+            ).pk
+            for i in range(count)
+        ]
+
+
+def _cleanup(appt_ids):
+    with transaction.atomic():
+        # 逐条删除以触发信号，统计汇总和计数器随之回退
+        for payment in Payment.objects.filter(record__appointment_id__in=appt_ids):
+            payment.delete()
+        for record in MedicalRecord.objects.filter(appointment_id__in=appt_ids):
+            record.delete()
+        Appointment.objects.filter(pk__in=appt_ids).delete()
+
+
+def run_writers(threads=8, ops=200, user=None):
+    """
+    并发写入压测：threads 个前台会话同时核验预约并缴费（每个操作两个写请求）。
+    会在当前数据库里临时创建预约，结束后删除。返回吞吐量和失败数。
+    """
+    user = user or find_users().get(ROLE_RECEPTION)
+    if user is None:
+        raise ValueError('没有可用的前台账号')
+    appt_ids = _create_pending_appointments(ops)
+    if not appt_ids:
+        raise ValueError('没有同时具备在职医生和诊室的科室，或者没有患者')
+
+    results = {'ok': 0, 'failed': 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(batch):
+        try:
+            client = Client(HTTP_HOST=_host(), raise_request_exception=False)
+            client.force_login(user)
+            barrier.wait()
+            for appt_id in batch:
+                ok = client.post(reverse('verify_appointment'), {'appt_id': appt_id}).status_code == 302
+                if ok:
+                    record_id = MedicalRecord.objects.filter(appointment_id=appt_id).values_list('pk', flat=True).first()
+                    ok = client.post(reverse('payment'), {
+                        'record_id': record_id, 'total_amount': '100', 'medical_insurance': '40', 'pay_method': '微信'
+                    }).status_code == 302
+                with lock:
+                    results['ok' if ok else 'failed'] += 1
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=worker, args=(appt_ids[i::threads],)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    try:
+        barrier.wait()
+        started = time.perf_counter()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        _cleanup(appt_ids)
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+    return {
+        'engine': connection.settings_dict['ENGINE'],
+        'journal_mode': journal_mode,
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'threads': threads,
+        'ops': len(appt_ids),
+        'ok': results['ok'],
+        'failed': results['failed'],
+        'seconds': round(elapsed, 3),
+        'ops_per_sec': round(results['ok'] / elapsed, 1) if elapsed else 0,
+    }
@@ -0,0 +1,91 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import availability, metrics
+from .models import Appointment, Schedule, local_date
+from .page_versions import bump_patient
+from .transactions import retry_locked
+
+
+class BookingError(Exception):
+    """预约失败，message 直接展示给患者"""
+
+
+def available_schedules(dept, arrival_time):
+    """到达时间所在时段、该科室仍有余号的排班ID，余号多的排前面（分散到各医生）"""
+    arrival_time = timezone.localtime(arrival_time)
+    minute = arrival_time.hour * 60 + arrival_time.minute
+    schedules = Schedule.objects.filter(
+        doctor__dept=dept,
+        schedule_date=arrival_time.date(),
+        status=1,
+        booked_count__lt=F('capacity')
+    ).only('schedule_id', 'time_slot', 'capacity', 'booked_count')
+    candidates = [s for s in schedules if s.covers(minute)]
+    candidates.sort(key=lambda s: -s.remaining)
+    return [s.schedule_id for s in candidates]
+
+
+def _reserve(patient, dept, arrival_time, candidates):
+    with transaction.atomic():
+        # 条件UPDATE占号：只有 booked_count < capacity 时才 +1，不存在先读后写的竞争
+        for schedule_id in candidates:
+            reserved = Schedule.objects.filter(
+                pk=schedule_id, status=1, booked_count__lt=F('capacity')
+            ).update(booked_count=F('booked_count') + 1)
+            if reserved:
+                break
+        else:
+            raise BookingError('该时段号源已约满，请选择其他时间')
+
+        # 已经拿到写锁，此时再查同日冲突不会和并发的预约交错；冲突时抛异常整体回滚，号源自动释放
+        if Appointment.objects.filter(patient=patient, status=0, arrival_date=local_date(arrival_time)).exists():
+            raise BookingError('您当天已有未完成的预约，请先处理后再新增')
+        try:
+            with transaction.atomic():
+                appointment = Appointment.objects.create(
+                    patient=patient,
+                    dept=dept,
+                    appt_time=timezone.now(),
+                    arrival_time=arrival_time,
+                    status=0,  # 0=未就诊
+                    schedule_id=schedule_id
+                )
+        except IntegrityError:
+            raise BookingError('该时间已有您的预约记录，请选择其他时间')
+        # 条件UPDATE占号不触发排班的信号，手动扣减余号表
+        availability.booked(schedule_id)
+        return appointment
+
+
+def book_appointment(patient, dept, arrival_time):
+    """
+    为患者预约 dept 科室 arrival_time 的号源，成功返回 Appointment，失败抛 BookingError。
+    占号与创建预约在同一事务内完成，任一步失败都不会多占号。
+    """
+    candidates = available_schedules(dept, arrival_time)
+    if not candidates:
+        raise BookingError('所选时段暂无可预约号源，请选择其他时间')
+    return retry_locked(_reserve, patient, dept, arrival_time, candidates)
+
+
+def _release(appt_id, patient):
+    with transaction.atomic():
+        # 状态从“未就诊”改为“已取消”也用条件UPDATE，重复提交只会成功一次
+        cancelled = Appointment.objects.filter(pk=appt_id, patient=patient, status=0).update(status=2)
+        if not cancelled:
+            return False
+        schedule_id, patient_id = Appointment.objects.filter(pk=appt_id).values_list('schedule_id', 'patient_id').get()
+        if schedule_id:
+            Schedule.objects.filter(pk=schedule_id, booked_count__gt=0).update(booked_count=F('booked_count') - 1)
+            availability.released(schedule_id)
+        # 条件UPDATE不触发模型信号，手动更新患者页面版本号和取消计数
+        bump_patient(patient_id)
+        metrics.CANCELLATIONS.inc_on_commit()
+        return True
+
+
+def cancel_appointment(appt_id, patient):
+    """取消未就诊的预约并释放号源；预约不存在或已不是未就诊状态时返回False"""
+    return retry_locked(_release, appt_id, patient)
@@ -0,0 +1,63 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import Department, Doctor, MedicalRecord, Patient, Payment
+
+# 计数器有效期（秒）：到期后重新从数据库统计一次，兜底失效前读到的旧值
+COUNTER_TTL = 600
+
+
+def _month_range(month_start):
+    if month_start.month == 12:
+        return month_start, month_start.replace(year=month_start.year + 1, month=1)
+    return month_start, month_start.replace(month=month_start.month + 1)
+
+
+def _payment_total(**filters):
+    return Payment.objects.filter(**filters).aggregate(total=Sum('total_amount'))['total'] or 0
+
+
+# 计数器名 -> 从数据库计算的函数（参数为日期/月份等，可为None）
+COUNTERS = {
+    'patients': lambda arg: Patient.objects.count(),
+    'doctors': lambda arg: Doctor.objects.count(),
+    'depts': lambda arg: Department.objects.count(),
+    'day_visits': lambda day: MedicalRecord.objects.filter(visit_date=day).count(),
+    'day_payments': lambda day: _payment_total(pay_date=day),
+    'month_payments': lambda month_start: _payment_total(
+        pay_date__gte=_month_range(month_start)[0], pay_date__lt=_month_range(month_start)[1]
+    ),
+}
+
+
+def _key(name, arg):
+    # 键里带上时间分桶，TTL到期自动换新键重新统计，不依赖缓存后端的过期实现
+    epoch = int(time.time() // COUNTER_TTL)
+    return f'clinic:counter:{name}:{arg or ""}:{epoch}'
+
+
+def get(name, arg=None):
+    """读取计数器；缓存未命中时查库计算一次并写入缓存"""
+    key = _key(name, arg)
+    value = cache.get(key)
+    if value is None:
+        value = COUNTERS[name](arg)
+        # add 不覆盖：计算期间若已有其他进程写入，以缓存中的为准
+        if not cache.add(key, value, COUNTER_TTL):
+            value = cache.get(key, value)
+    return value
+
+
+def invalidate(name, arg=None):
+    """
+    事务提交后删除计数器，下次读取时重新统计；事务回滚则不动缓存。
+    不用 cache.incr 累加：文件缓存的 incr 是先读后写，多个进程同时累加会丢失更新。
+    """
+    transaction.on_commit(lambda: cache.delete(_key(name, arg)))
+
+
+def month_of(day):
+    return day.replace(day=1)
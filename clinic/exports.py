@@ -0,0 +1,125 @@
+import csv
+import json
+from datetime import datetime
+
+from django.utils import timezone
+
+from .models import MedicalRecord, MedicalRecordHistory, Payment, PaymentHistory
+
+# 每次从数据库游标取出的行数
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# 导出列定义：(表头, values_list 字段)
+PAYMENT_COLUMNS = (
+    ('pay_id', 'pay_id'),
+    ('record_id', 'record_id'),
+    ('patient_name', 'record__patient__name'),
+    ('doctor_name', 'record__doctor__name'),
+    ('dept_name', 'record__doctor__dept__dept_name'),
+    ('total_amount', 'total_amount'),
+    ('medical_insurance', 'medical_insurance'),
+    ('self_pay', 'self_pay'),
+    ('pay_method', 'pay_method'),
+    ('pay_time', 'pay_time'),
+)
+
+VISIT_COLUMNS = (
+    ('record_id', 'record_id'),
+    ('patient_name', 'patient__name'),
+    ('doctor_name', 'doctor__name'),
+    ('dept_name', 'doctor__dept__dept_name'),
+    ('room_id', 'room_id'),
+    ('visit_time', 'visit_time'),
+    ('visit_status', 'visit_status'),
+    ('symptom', 'symptom'),
+    ('prescription', 'prescription'),
+    ('appointment_id', 'appointment_id'),
+)
+
+# 含归档数据时读历史视图：缴费视图直接带出患者和医生，不经过就诊记录视图关联；末尾加一列 archived
+PAYMENT_HISTORY_COLUMNS = (
+    ('pay_id', 'pay_id'),
+    ('record_id', 'record_id'),
+    ('patient_name', 'patient__name'),
+    ('doctor_name', 'doctor__name'),
+    ('dept_name', 'doctor__dept__dept_name'),
+) + PAYMENT_COLUMNS[5:] + (('archived', 'archived'),)
+
+VISIT_HISTORY_COLUMNS = VISIT_COLUMNS + (('archived', 'archived'),)
+
+# 导出类型 -> (模型, 列定义, 时间字段, 本地日期字段)：按日期过滤走日期列上的索引，时间列没有索引
+EXPORTS = {
+    'payments': (Payment, PAYMENT_COLUMNS, 'pay_time', 'pay_date'),
+    'visits': (MedicalRecord, VISIT_COLUMNS, 'visit_time', 'visit_date'),
+}
+HISTORY_EXPORTS = {
+    'payments': (PaymentHistory, PAYMENT_HISTORY_COLUMNS, 'pay_time', 'pay_date'),
+    'visits': (MedicalRecordHistory, VISIT_HISTORY_COLUMNS, 'visit_time', 'visit_date'),
+}
+
+
+def parse_date(value):
+    """解析 YYYY-MM-DD，空值或格式错误返回None"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def export_rows(kind, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE, include_archive=False):
+    """
+    按主键顺序逐块读取导出数据，返回 (表头, 行迭代器)。
+    start/end 为本地日期（含首尾），按本地日期列过滤；include_archive 时连同归档数据一起导出。
+    """
+    model, columns, time_field, date_field = (HISTORY_EXPORTS if include_archive else EXPORTS)[kind]
+    qs = model.objects.all()
+    if start:
+        qs = qs.filter(**{f'{date_field}__gte': start})
+    if end:
+        qs = qs.filter(**{f'{date_field}__lte': end})
+
+    headers = [header for header, _ in columns]
+    fields = [field for _, field in columns]
+    time_index = fields.index(time_field)
+    rows = qs.order_by('pk').values_list(*fields).iterator(chunk_size=chunk_size)
+
+    def localize(rows):
+        for row in rows:
+            row = list(row)
+            if row[time_index] is not None:
+                row[time_index] = timezone.localtime(row[time_index]).strftime('%Y-%m-%d %H:%M:%S')
+            yield row
+
+    return headers, localize(rows)
+
+
+class Echo:
+    """csv.writer 需要一个有 write 方法的对象，直接把写入的内容原样返回"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(headers, rows):
+    writer = csv.writer(Echo())
+    # 带BOM，Excel打开中文不乱码
+    yield '\ufeff' + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(headers, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(headers, row)), ensure_ascii=False, default=str) + '\n'
+
+
+def iter_export(kind, fmt, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE, include_archive=False):
+    """生成导出文件的文本片段，供 StreamingHttpResponse 或命令行逐段写出"""
+    headers, rows = export_rows(kind, start=start, end=end, chunk_size=chunk_size, include_archive=include_archive)
+    if fmt == 'jsonl':
+        return iter_jsonl(headers, rows)
+    return iter_csv(headers, rows)
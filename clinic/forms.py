@@ -4,6 +4,9 @@ from django.core.exceptions import ValidationError
 from datetime import datetime, timedelta
 from django.utils import timezone  # 新增：引入时区工具
 
+from .availability import BOOKING_DAYS
+from .rota import MAX_ROLLOUT_DAYS, RotaError, parse_template
+
 # 患者预约表单
 class AppointmentForm(forms.ModelForm):
     class Meta:
@@ -39,8 +42,8 @@ class AppointmentForm(forms.ModelForm):
         if arrival_time < now:
             raise ValidationError(f"预约时间不能早于当前时间（当前时间：{now.strftime('%Y-%m-%d %H:%M')}）")
         
-        if arrival_time > now + timedelta(days=7):
-            raise ValidationError(f"最多只能预约未来7天的号源（最晚：{(now + timedelta(days=7)).strftime('%Y-%m-%d %H:%M')}）")
+        if arrival_time > now + timedelta(days=BOOKING_DAYS):
+            raise ValidationError(f"最多只能预约未来{BOOKING_DAYS}天的号源（最晚：{(now + timedelta(days=BOOKING_DAYS)).strftime('%Y-%m-%d %H:%M')}）")
         
         return arrival_time
 
@@ -80,7 +83,7 @@ class PaymentForm(forms.ModelForm):
 class ScheduleForm(forms.ModelForm):
     class Meta:
         model = Schedule
-        fields = ['doctor', 'room', 'schedule_date', 'time_slot', 'status']
+        fields = ['doctor', 'room', 'schedule_date', 'time_slot', 'status', 'capacity']
         widgets = {
             # 为医生选择框添加form-select类
             'doctor': forms.Select(attrs={'class': 'form-select'}),
@@ -97,4 +100,39 @@ class ScheduleForm(forms.ModelForm):
             'time_slot': forms.Select(attrs={'class': 'form-select'}),
             # 为状态选择框添加form-select类
             'status': forms.Select(attrs={'class': 'form-select'}),
-        }
\ No newline at end of file
+            # 号源数量
+            'capacity': forms.NumberInput(attrs={'class': 'form-control', 'min': 1}),
+        }
+
+
+# 按周模板批量排班表单
+class RotaForm(forms.Form):
+    start = forms.DateField(label='开始日期', widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    end = forms.DateField(label='结束日期', widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    template = forms.CharField(
+        label='周模板',
+        widget=forms.Textarea(attrs={
+            'class': 'form-control font-monospace',
+            'rows': 10,
+            'placeholder': '每行：医生ID 诊室编号 星期(1-7) 时间段 [号源数量]\n例如：3 101 1 08:00-12:00 30',
+        })
+    )
+    preview = forms.BooleanField(
+        label='仅预览冲突，不写入', required=False, widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+
+    def clean_template(self):
+        try:
+            return parse_template(self.cleaned_data['template'])
+        except RotaError as e:
+            raise ValidationError(str(e))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise ValidationError('开始日期不能晚于结束日期')
+        if start and end and (end - start).days >= MAX_ROLLOUT_DAYS:
+            raise ValidationError(f'一次最多发布 {MAX_ROLLOUT_DAYS} 天的排班')
+        return cleaned_data
+
@@ -0,0 +1,45 @@
+from django.utils import timezone
+
+from .assignment import assign
+from .models import Appointment, MedicalRecord, Payment
+
+
+def check_in(appt_id):
+    """
+    核验未就诊的预约：按当前时段排班分配在诊人数最少的医生和诊室，生成就诊记录并把预约标为已完成。
+    返回就诊记录；预约不存在或已完成/取消时抛 Appointment.DoesNotExist，没有可接诊的医生时抛 AssignmentError。
+    先读后写，调用方须放在 write_transaction 的事务里。
+    """
+    appointment = Appointment.objects.get(pk=appt_id, status=0)
+    doctor_id, room_id = assign(appointment.dept_id)
+    record = MedicalRecord.objects.create(
+        patient_id=appointment.patient_id,
+        doctor_id=doctor_id,
+        room_id=room_id,
+        visit_time=timezone.now(),
+        visit_status=0,  # 0=就诊中
+        appointment=appointment
+    )
+    # 更新预约状态为已完成
+    appointment.status = 1
+    appointment.save()
+    return record
+
+
+def settle(record_id, total_amount, medical_insurance, pay_method):
+    """
+    就诊中的记录缴费结算（自费金额由 Payment.save 计算）并标为已离院，返回缴费记录；
+    就诊记录不存在或已缴费时抛 MedicalRecord.DoesNotExist。同样须在事务里调用。
+    """
+    record = MedicalRecord.objects.get(pk=record_id, visit_status=0)
+    payment = Payment.objects.create(
+        record=record,
+        total_amount=total_amount,
+        medical_insurance=medical_insurance,
+        pay_method=pay_method,
+        pay_time=timezone.now()
+    )
+    # 更新就诊状态为已离院
+    record.visit_status = 1
+    record.save()
+    return payment
@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+# 记录到慢请求日志的单条SQL最大长度
+SQL_MAX_LENGTH = 1000
+
+_log_lock = threading.Lock()
+
+
+class QueryCollector:
+    """
+    数据库执行包装器：统计查询次数、总耗时，并按SQL文本（参数未代入的模板）分组，
+    同一模板反复执行就是典型的 N+1。
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # SQL模板 -> [执行次数, 累计秒数]
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            stat = self.statements.get(sql)
+            if stat is None:
+                self.statements[sql] = [1, elapsed]
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+
+    def repeated(self, threshold):
+        """执行次数达到 threshold 的SQL模板，按次数从多到少"""
+        rows = [(sql, n, s) for sql, (n, s) in self.statements.items() if n >= threshold]
+        return sorted(rows, key=lambda row: -row[1])
+
+    def slowest(self, limit):
+        """累计耗时最多的 limit 条SQL模板"""
+        rows = [(sql, n, s) for sql, (n, s) in self.statements.items()]
+        return sorted(rows, key=lambda row: -row[2])[:limit]
+
+
+class QueryCounter:
+    """只计数的执行包装器，每个请求都要用时比 QueryCollector 省事"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def collect_queries(collector=None):
+    """在 with 块内统计所有数据库连接上执行的SQL"""
+    collector = collector or QueryCollector()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(collector))
+        yield collector
+
+
+def route_name(request):
+    """请求匹配到的路由名（带命名空间），未匹配到路由（404等）时为 unresolved"""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+def statement_summary(rows):
+    return [
+        {'sql': sql[:SQL_MAX_LENGTH], 'count': count, 'ms': round(seconds * 1000, 3)}
+        for sql, count, seconds in rows
+    ]
+
+
+def append_jsonl(path, entry):
+    """追加一行JSON；多线程写同一文件时加锁，避免行交错"""
+    line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+    with _log_lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
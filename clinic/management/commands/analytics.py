@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic import analytics
+from clinic.exports import parse_date
+
+
+class Command(BaseCommand):
+    help = '计算患者与就诊统计报表（年龄分布、复诊率、患者群收入、医保占比趋势），可与逐行 ORM 实现对比耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('reports', nargs='*', metavar='REPORT',
+                            help=f"报表名：{'/'.join(analytics.REPORTS)}，不填表示全部")
+        parser.add_argument('--start', help='开始日期 YYYY-MM-DD（含），默认为最近12个月的第一天')
+        parser.add_argument('--end', help='结束日期 YYYY-MM-DD（含），默认为今天')
+        parser.add_argument('--json', action='store_true', help='以 JSON 输出')
+        parser.add_argument('--benchmark', action='store_true', help='对比 numpy 实现与逐行 ORM 实现的耗时和结果')
+        parser.add_argument('--repeat', type=int, default=1, help='基准对比时每种实现运行的次数（取最短耗时）')
+
+    def handle(self, *args, **options):
+        names = options['reports'] or list(analytics.REPORTS)
+        unknown = [name for name in names if name not in analytics.REPORTS]
+        if unknown:
+            raise CommandError(f"未知的报表：{', '.join(unknown)}，可选 {'/'.join(analytics.REPORTS)}")
+        end = parse_date(options['end'])
+        start = parse_date(options['start'])
+        if options['start'] and not start or options['end'] and not end:
+            raise CommandError('日期格式错误，应为 YYYY-MM-DD')
+        default_start, end = analytics.default_range(end)
+        start = start or default_start
+        if start > end:
+            raise CommandError('开始日期不能晚于结束日期')
+        if options['repeat'] <= 0:
+            raise CommandError('运行次数必须大于0')
+
+        try:
+            if options['benchmark']:
+                results = analytics.benchmark(start, end, names, repeat=options['repeat'], log=self.stderr.write)
+                if options['json']:
+                    self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+                if not all(result['same'] for result in results):
+                    raise CommandError('numpy 实现与逐行 ORM 实现的结果不一致')
+                return
+            results = {name: analytics.REPORTS[name][1](start, end) for name in names}
+        except analytics.AnalyticsUnavailable as exc:
+            raise CommandError(str(exc))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2, default=str))
+            return
+        for name, result in results.items():
+            self.stdout.write(self.style.SUCCESS(f'{analytics.REPORTS[name][0]}（{start} ~ {end}）'))
+            for label, value in result['summary']:
+                self.stdout.write(f'  {label}：{value}')
+            self.stdout.write('\t'.join(result['headers']))
+            for row in result['rows']:
+                self.stdout.write('\t'.join(str(value) for value in row))
+            self.stdout.write('')
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic.archive import ARCHIVE_CHUNK_SIZE, archive
+
+
+class Command(BaseCommand):
+    help = '把超过保留期、已离院且已缴费的就诊记录（连同缴费、预约）移到归档表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='保留天数，默认取 settings.CLINIC_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--chunk-size', type=int, default=ARCHIVE_CHUNK_SIZE, help='每个事务搬移的条数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计可归档的条数，不搬移')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('保留天数不能为负数')
+        if options['chunk_size'] <= 0:
+            raise CommandError('每批条数必须为正整数')
+
+        started = time.perf_counter()
+        log = None if options['dry_run'] else self.stdout.write
+        cutoff, records, appointments = archive(
+            days=options['days'], chunk_size=options['chunk_size'], dry_run=options['dry_run'], log=log
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{cutoff} 之前可归档：就诊记录 {records} 条，预约 {appointments} 条')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ 归档完成（{cutoff} 之前）：就诊记录 {records} 条，预约 {appointments} 条'
+            f'（{time.perf_counter() - started:.1f} 秒）'
+        ))
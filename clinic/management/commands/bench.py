@@ -0,0 +1,95 @@
+import json
+import os
+import sys
+from contextlib import nullcontext
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic import benchmark
+from clinic.roles import ROLE_ADMIN, ROLE_DOCTOR, ROLE_PATIENT, ROLE_RECEPTION
+
+
+class Command(BaseCommand):
+    help = '以各角色登录，逐个压测 clinic 路由，输出延迟分位数与SQL统计（JSON），可与基线对比'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='每个路由统计的请求次数')
+        parser.add_argument('--warmup', type=int, default=2, help='每个路由预热请求次数（不计入统计）')
+        parser.add_argument('--view', action='append', dest='views', help='只压测指定路由名，可重复')
+        parser.add_argument(
+            '--user', action='append', default=[], metavar='ROLE=USERNAME',
+            help=f'指定角色使用的账号，角色为 {ROLE_ADMIN}/{ROLE_RECEPTION}/{ROLE_DOCTOR}/{ROLE_PATIENT}'
+        )
+        parser.add_argument('--dataset', help='压测用的 SQLite 数据库文件，不填则压测当前配置的数据库')
+        parser.add_argument('--patients', type=int,
+                            help='压测前先在 --dataset 文件中迁移并用 populate_db 生成该规模的数据（会清空该文件中的数据）')
+        parser.add_argument('--days', type=int, default=30, help='配合 --patients：生成最近多少天的历史数据')
+        parser.add_argument('--seed', type=int, default=2024, help='配合 --patients：随机种子，相同种子生成相同数据集')
+        parser.add_argument('--output', '-o', help='结果JSON写入的文件，不填则写到标准输出')
+        parser.add_argument('--baseline', help='基线结果JSON，有路由回归时命令失败')
+        parser.add_argument('--threshold', type=float, default=0.2, help='p95 允许的增幅比例')
+        parser.add_argument('--min-delta-ms', type=float, default=benchmark.MIN_DELTA_MS,
+                            help='p95 增加不超过该毫秒数时不算回归')
+
+    def handle(self, *args, **options):
+        if options['requests'] <= 0 or options['warmup'] < 0:
+            raise CommandError('请求次数必须大于0，预热次数不能为负数')
+        overrides = {}
+        for item in options['user']:
+            role, sep, username = item.partition('=')
+            if not sep or role not in (ROLE_ADMIN, ROLE_RECEPTION, ROLE_DOCTOR, ROLE_PATIENT):
+                raise CommandError(f'--user 格式错误：{item}')
+            overrides[role] = username
+        dataset = options['dataset']
+        if options['patients'] is not None:
+            if not dataset:
+                raise CommandError('--patients 需要配合 --dataset 使用，避免清空当前数据库')
+            if options['patients'] <= 0:
+                raise CommandError('--patients 必须大于0')
+        elif dataset and not os.path.exists(dataset):
+            raise CommandError(f'数据集文件不存在：{dataset}')
+        baseline = benchmark.load(options['baseline']) if options['baseline'] else None
+
+        with benchmark.use_dataset(dataset) if dataset else nullcontext():
+            if options['patients'] is not None:
+                self.stderr.write(f'正在生成数据集 {dataset}（{options["patients"]} 名患者）...')
+                call_command('migrate', interactive=False, verbosity=0)
+                call_command(
+                    'populate_db', patients=options['patients'], days=options['days'], seed=options['seed'],
+                    stdout=self.stderr
+                )
+            self._bench(options, overrides, baseline)
+
+    def _bench(self, options, overrides, baseline):
+        try:
+            users = benchmark.find_users(overrides)
+        except benchmark.User.DoesNotExist as exc:
+            raise CommandError(f'--user 指定的账号不存在：{exc}')
+        # 进度与汇总写到标准错误，标准输出留给 JSON
+        results = benchmark.run(
+            requests=options['requests'],
+            warmup=options['warmup'],
+            names=options['views'],
+            users=users,
+            log=self.stderr.write
+        )
+        for name, reason in results['skipped'].items():
+            self.stderr.write(f'跳过 {name}：{reason}')
+
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            sys.stdout.write(output + '\n')
+
+        if baseline is not None:
+            if baseline.get('meta', {}).get('dataset') != results['meta']['dataset']:
+                self.stderr.write(self.style.WARNING('基线与本次压测的数据量不同，对比结果仅供参考'))
+            regressions = benchmark.compare(
+                results, baseline, threshold=options['threshold'], min_delta_ms=options['min_delta_ms']
+            )
+            if regressions:
+                raise CommandError('性能回归：\n' + '\n'.join(regressions))
+            self.stderr.write(self.style.SUCCESS('✅ 与基线相比没有回归'))
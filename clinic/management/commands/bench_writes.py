@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic import benchmark
+
+# 对比的数据库配置，对应 settings 里的 CLINIC_DB_PROFILE
+PROFILES = ('default', 'production')
+
+
+class Command(BaseCommand):
+    help = ('前台并发写入压测（核验预约 + 缴费），对比默认与生产数据库配置的吞吐量。'
+            '会在当前数据库里临时创建并删除预约；生产配置会把数据库切换为 WAL 模式')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='并发的前台会话数')
+        parser.add_argument('--ops', type=int, default=200, help='核验+缴费操作总数')
+        parser.add_argument('--profile', choices=PROFILES + ('both',), default='both', help='压测哪个数据库配置')
+        parser.add_argument('--worker', action='store_true', help='（内部）在当前配置下压测一次并输出JSON')
+
+    def handle(self, *args, **options):
+        if options['threads'] <= 0 or options['ops'] <= 0:
+            raise CommandError('并发数和操作数必须大于0')
+        if options['worker']:
+            try:
+                result = benchmark.run_writers(options['threads'], options['ops'])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            sys.stdout.write(json.dumps(result) + '\n')
+            return
+
+        # 数据库配置在进程启动时就确定了，每种配置各起一个子进程；先跑默认配置，生产配置会留下 WAL 模式
+        profiles = PROFILES if options['profile'] == 'both' else (options['profile'],)
+        results = {}
+        for profile in profiles:
+            env = {**os.environ, 'CLINIC_DB_PROFILE': profile}
+            proc = subprocess.run(
+                [sys.executable, '-m', 'django', 'bench_writes', '--worker',
+                 '--threads', str(options['threads']), '--ops', str(options['ops'])],
+                cwd=settings.BASE_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            )
+            if proc.returncode:
+                raise CommandError(f'{profile} 配置压测失败：\n{proc.stderr[-2000:]}')
+            results[profile] = json.loads(proc.stdout.strip().splitlines()[-1])
+            r = results[profile]
+            self.stdout.write(
+                f"{profile:<11} {r['journal_mode']:<7} {r['ok']:>5} 成功 {r['failed']:>5} 失败  "
+                f"{r['seconds']:>7.2f} 秒  {r['ops_per_sec']:>7.1f} 次/秒"
+            )
+        if len(results) == 2 and results['default']['ops_per_sec']:
+            gain = results['production']['ops_per_sec'] / results['default']['ops_per_sec']
+            self.stdout.write(self.style.SUCCESS(f'生产配置吞吐量为默认配置的 {gain:.2f} 倍'))
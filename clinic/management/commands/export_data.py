@@ -0,0 +1,55 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic.exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORTS, iter_export, parse_date
+from clinic.replica import use_replica
+
+
+class Command(BaseCommand):
+    help = '流式导出缴费/就诊记录为CSV或JSONL（含患者、医生、科室名称）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help='导出类型：payments 或 visits')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help='导出格式')
+        parser.add_argument('--output', '-o', help='输出文件路径，不填则写到标准输出')
+        parser.add_argument('--start', help='开始日期 YYYY-MM-DD（含）')
+        parser.add_argument('--end', help='结束日期 YYYY-MM-DD（含）')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='每次从数据库读取的行数')
+        parser.add_argument('--include-archive', action='store_true', help='连同已归档的记录一起导出')
+        parser.add_argument('--primary', action='store_true', help='从主库导出（默认在只读副本可用时读副本）')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start'])
+        end = parse_date(options['end'])
+        if options['start'] and not start or options['end'] and not end:
+            raise CommandError('日期格式错误，应为 YYYY-MM-DD')
+
+        if options['primary']:
+            self._export(options, start, end)
+        else:
+            with use_replica():
+                self._export(options, start, end)
+
+    def _export(self, options, start, end):
+        chunks = iter_export(
+            options['kind'], options['format'],
+            start=start, end=end, chunk_size=options['chunk_size'], include_archive=options['include_archive']
+        )
+        if options['output']:
+            # newline='' 交给csv模块控制换行
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                count = self._write(f, chunks)
+            # CSV第一段是表头
+            if options['format'] == 'csv':
+                count -= 1
+            self.stderr.write(self.style.SUCCESS(f'已导出 {count} 行到 {options["output"]}'))
+        else:
+            self._write(sys.stdout, chunks)
+
+    def _write(self, f, chunks):
+        count = 0
+        for chunk in chunks:
+            f.write(chunk)
+            count += 1
+        return count
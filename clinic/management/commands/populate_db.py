@@ -1,4 +1,6 @@
-from django.core.management.base import BaseCommand
+import time
+
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
 from datetime import datetime, timedelta
 from decimal import Decimal  # 适配DecimalField
@@ -6,11 +8,51 @@ from clinic.models import (
     Department, ClinicRoom, Doctor, Patient,
     Schedule, Appointment, MedicalRecord, Payment
 )
+from clinic.synthetic import SYNTHETIC_PASSWORD, SYNTHETIC_PREFIX, Generator, clear_all
 
 class Command(BaseCommand):
-    help = '一次性填充门诊管理系统的测试数据（匹配最终版models.py）'
+    help = '一次性填充门诊管理系统的测试数据（匹配最终版models.py）；指定 --patients 时批量生成压测规模的数据'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=0, help='批量生成的患者数，不填则只创建少量演示数据')
+        parser.add_argument('--days', type=int, default=365, help='生成最近多少天的历史排班/预约/就诊/缴费')
+        parser.add_argument('--ahead', type=int, default=7, help='生成未来多少天的排班和待就诊预约')
+        parser.add_argument('--doctors-per-dept', type=int, default=10, help='每个科室的医生数')
+        parser.add_argument('--batch-size', type=int, default=5000, help='每个事务批量写入的行数')
+        parser.add_argument('--seed', type=int, default=2024, help='随机种子，相同种子生成相同数据')
 
     def handle(self, *args, **options):
+        patients = options['patients']
+        if patients < 0 or options['days'] < 0 or options['ahead'] < 0:
+            raise CommandError('数量和天数不能为负数')
+        if options['batch_size'] <= 0 or options['doctors_per_dept'] <= 0:
+            raise CommandError('批量大小和医生数必须大于0')
+
+        if patients:
+            # 上次批量生成的数据量可能很大，先用直接 DELETE 清空
+            self.stdout.write('正在清空旧数据...')
+            clear_all()
+        self.populate_demo()
+        if not patients:
+            return
+
+        started = time.perf_counter()
+        generator = Generator(
+            patients=patients,
+            days=options['days'],
+            ahead=options['ahead'],
+            doctors_per_dept=options['doctors_per_dept'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            log=self.stdout.write
+        )
+        counts = generator.run()
+        elapsed = time.perf_counter() - started
+        summary = '，'.join(f'{name} {count}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'✅ 批量数据生成完成（{elapsed:.0f} 秒）：{summary}'))
+        self.stdout.write(f'  批量账号：{SYNTHETIC_PREFIX}doc0、{SYNTHETIC_PREFIX}doc1… / {SYNTHETIC_PREFIX}p0、{SYNTHETIC_PREFIX}p1…，密码均为 {SYNTHETIC_PASSWORD}')
+
+    def populate_demo(self):
         # 1. 清空现有数据（避免重复/冲突）
         self.stdout.write('正在清空旧数据...')
         # 按外键依赖顺序删除（从子表到父表）
@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic.profiling import HOT_FUNCTIONS, collapsed_stacks, merge_profiles, profiled_views, top_functions, write_collapsed
+
+
+class Command(BaseCommand):
+    help = '按视图合并请求剖析结果（.prof），列出累计耗时最多的函数；可输出合并后的折叠栈用于画火焰图'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='剖析结果目录，默认 CLINIC_PROFILE_DIR')
+        parser.add_argument('--view', action='append', dest='views', help='只看指定视图名，可重复')
+        parser.add_argument('--limit', type=int, default=HOT_FUNCTIONS, help='每个视图列出的函数数')
+        parser.add_argument('--sort', choices=('cumulative', 'self'), default='cumulative', help='按累计时间或自身时间排序')
+        parser.add_argument('--collapsed', metavar='DIR', help='把每个视图合并后的折叠栈写到该目录（<视图名>.collapsed）')
+
+    def handle(self, *args, **options):
+        if options['limit'] <= 0:
+            raise CommandError('--limit 必须大于0')
+        directory = options['dir'] or settings.CLINIC_PROFILE_DIR
+        views = options['views'] or profiled_views(directory)
+        if not views:
+            raise CommandError(f'{directory} 下没有剖析结果')
+        if options['collapsed']:
+            os.makedirs(options['collapsed'], exist_ok=True)
+
+        for name in views:
+            stats, count = merge_profiles(name, directory)
+            if stats is None:
+                self.stderr.write(self.style.WARNING(f'{name}：没有剖析结果'))
+                continue
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'== {name}（{count} 份，合计 {stats.total_tt * 1000:.1f} ms，平均 {stats.total_tt * 1000 / count:.1f} ms）'
+            ))
+            self.stdout.write(f'{"调用次数":>10} {"自身ms":>10} {"累计ms":>10}  函数')
+            for row in top_functions(stats, options['limit'], key=options['sort']):
+                self.stdout.write(
+                    f'{row["calls"]:>10} {row["self_ms"]:>10.1f} {row["cumulative_ms"]:>10.1f}  {row["function"]}'
+                )
+            if options['collapsed']:
+                path = os.path.join(options['collapsed'], f'{name}.collapsed')
+                write_collapsed(collapsed_stacks(stats), path)
+                self.stdout.write(f'折叠栈：{path}')
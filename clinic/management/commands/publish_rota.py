@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic.exports import parse_date
+from clinic.rota import RotaError, describe_clash, expand, parse_template, publish
+
+
+class Command(BaseCommand):
+    help = '按周模板文件批量发布排班，医生或诊室时间冲突的排班不写入并逐条列出'
+
+    def add_arguments(self, parser):
+        parser.add_argument('template', help='周模板文件，每行：医生ID 诊室编号 星期(1-7) 时间段 [号源数量]')
+        parser.add_argument('--start', required=True, help='开始日期 YYYY-MM-DD（含）')
+        parser.add_argument('--end', required=True, help='结束日期 YYYY-MM-DD（含）')
+        parser.add_argument('--dry-run', action='store_true', help='只检查冲突，不写入')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start'])
+        end = parse_date(options['end'])
+        if not start or not end:
+            raise CommandError('日期格式错误，应为 YYYY-MM-DD')
+        try:
+            with open(options['template'], encoding='utf-8') as f:
+                template = parse_template(f.read())
+            schedules = expand(template, start, end)
+        except (OSError, RotaError) as e:
+            raise CommandError(str(e))
+
+        started = time.perf_counter()
+        published, clashes = publish(schedules, dry_run=options['dry_run'])
+        elapsed = time.perf_counter() - started
+        for clash in clashes:
+            self.stdout.write(self.style.WARNING(describe_clash(clash)))
+        action = '可发布' if options['dry_run'] else '已发布'
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {action} {len(published)} 条排班，冲突 {len(clashes)} 条（{elapsed:.2f} 秒）'
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from clinic.search import INDEXES, REBUILD_BATCH_SIZE, rebuild
+
+
+class Command(BaseCommand):
+    help = '从患者、就诊记录原表全量重建 FTS5 全文索引（批量导入或数据修复后使用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', choices=sorted(INDEXES), action='append', help='只重建指定索引，可重复；不填重建全部')
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH_SIZE, help='每批写入的行数')
+
+    def handle(self, *args, **options):
+        self.stdout.write('正在重建全文索引...')
+        started = time.perf_counter()
+        counts = rebuild(kinds=options['index'], batch_size=options['batch_size'])
+        summary = '，'.join(f'{kind} {count} 行' for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'✅ 重建完成：{summary}（{time.perf_counter() - started:.1f} 秒）'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic.exports import parse_date
+from clinic.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = '按就诊/缴费原始记录重算每日统计汇总表（历史数据回填或修正）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='开始日期 YYYY-MM-DD（含），不填表示从最早开始')
+        parser.add_argument('--end', help='结束日期 YYYY-MM-DD（含），不填表示到最新为止')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start'])
+        end = parse_date(options['end'])
+        if options['start'] and not start or options['end'] and not end:
+            raise CommandError('日期格式错误，应为 YYYY-MM-DD')
+        if start and end and start > end:
+            raise CommandError('开始日期不能晚于结束日期')
+
+        self.stdout.write('正在重算统计汇总...')
+        dept_count, doctor_count = rebuild(start=start, end=end)
+        self.stdout.write(self.style.SUCCESS(f'✅ 重算完成：科室日统计 {dept_count} 行，医生日统计 {doctor_count} 行'))
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from clinic import metrics
+
+
+class Command(BaseCommand):
+    help = '清空各 worker 进程的指标文件；部署重启时在启动 worker 之前执行'
+
+    def handle(self, *args, **options):
+        metrics.reset()
+        self.stdout.write(self.style.SUCCESS(f'✅ 已清空 {settings.CLINIC_METRICS_DIR} 下的指标文件'))
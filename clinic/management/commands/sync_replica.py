@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from clinic.replica import sync
+
+
+class Command(BaseCommand):
+    help = '用 SQLite 在线备份接口把主库同步到只读副本（CLINIC_REPLICA_PATH）；指定 --interval 时按间隔持续同步'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='副本文件路径，默认取 CLINIC_REPLICA_PATH')
+        parser.add_argument('--interval', type=float, default=0, help='同步间隔（秒），不填只同步一次')
+
+    def handle(self, *args, **options):
+        target = options['output'] or settings.CLINIC_REPLICA_PATH
+        if not target:
+            raise CommandError('未配置副本路径：设置环境变量 CLINIC_REPLICA_PATH 或使用 --output')
+        source = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        if options['interval'] and options['interval'] >= settings.CLINIC_REPLICA_MAX_LAG:
+            self.stderr.write(self.style.WARNING(
+                f'同步间隔不小于 CLINIC_REPLICA_MAX_LAG（{settings.CLINIC_REPLICA_MAX_LAG} 秒），副本会时常被判定过期而退回主库'
+            ))
+
+        while True:
+            started = time.perf_counter()
+            sync(source, target)
+            self.stdout.write(f'已同步到 {target}（{time.perf_counter() - started:.2f} 秒）')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,254 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import transaction
+
+# 每个进程一个内存映射文件：开头8字节记已用长度，之后逐条追加
+# [键长度 uint32][键 UTF-8][补齐到8字节][值 double]。
+# 进程只写自己的文件，热路径上没有跨进程的锁；/metrics 读取全部文件后按键求和。
+_HEADER = struct.Struct('i')
+_KEY_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+_INITIAL_SIZE = 64 * 1024
+
+# 请求耗时（秒）和每个请求SQL条数的直方图分桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _padded(length):
+    return length + (-length % 8)
+
+
+class MmapValues:
+    """单个进程的指标文件：键 -> 值（double），新键追加在末尾，文件满了翻倍扩容"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(_INITIAL_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or 8
+        self._offsets = {key: offset for key, value, offset in _entries(self._map, self._used)}
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _append(self, key):
+        encoded = key.encode()
+        value_offset = _padded(self._used + _KEY_LENGTH.size + len(encoded))
+        end = value_offset + _VALUE.size
+        if end > len(self._map):
+            self._grow(end)
+        _KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _KEY_LENGTH.size:self._used + _KEY_LENGTH.size + len(encoded)] = encoded
+        _VALUE.pack_into(self._map, value_offset, 0.0)
+        # 整条写完再更新已用长度，读取方不会读到写了一半的条目
+        self._used = end
+        _HEADER.pack_into(self._map, 0, end)
+        self._offsets[key] = value_offset
+        return value_offset
+
+    def add(self, key, amount):
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        _VALUE.pack_into(self._map, offset, _VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _entries(buffer, used):
+    position = 8
+    while position < used:
+        length = _KEY_LENGTH.unpack_from(buffer, position)[0]
+        key_start = position + _KEY_LENGTH.size
+        value_offset = _padded(key_start + length)
+        key = bytes(buffer[key_start:key_start + length]).decode()
+        yield key, _VALUE.unpack_from(buffer, value_offset)[0], value_offset
+        position = value_offset + _VALUE.size
+
+
+def read_file(path):
+    """读取一个进程的指标文件，返回 [(键, 值)]"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 8:
+        return []
+    return [(key, value) for key, value, offset in _entries(data, _HEADER.unpack_from(data, 0)[0])]
+
+
+_store = None
+_store_owner = None  # (进程号, 目录)
+# 同一进程内多线程累加同一个值需要互斥；只是进程内的锁，几乎不会争用
+_lock = threading.Lock()
+
+
+def _values():
+    """本进程的指标文件；fork 出的子进程第一次写入时换成自己的文件"""
+    global _store, _store_owner
+    owner = (os.getpid(), settings.CLINIC_METRICS_DIR)
+    if _store_owner != owner:
+        if _store is not None and _store_owner[0] == owner[0]:
+            _store.close()
+        os.makedirs(owner[1], exist_ok=True)
+        _store = MmapValues(os.path.join(owner[1], f'metrics-{owner[0]}.db'))
+        _store_owner = owner
+    return _store
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+# 指标族名 -> 指标对象，导出时按注册顺序输出
+REGISTRY = {}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}
+        REGISTRY[name] = self
+
+    def _labels(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def _key(self, sample):
+        # 键里带上指标族名，合并后按族分组输出
+        return json.dumps([self.name, sample], ensure_ascii=False)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not settings.CLINIC_METRICS:
+            return
+        label_values = self._labels(labels)
+        key = self._keys.get(label_values)
+        if key is None:
+            key = self._keys[label_values] = self._key(_sample(self.name, label_values))
+        with _lock:
+            _values().add(key, amount)
+
+    def inc_on_commit(self, amount=1, **labels):
+        """事务提交后才计数，回滚的写入不算"""
+        if settings.CLINIC_METRICS:
+            transaction.on_commit(lambda: self.inc(amount, **labels))
+
+
+class Histogram(Metric):
+    """分桶直接存累计值（le 及以下的观测数），合并时各进程逐键相加即可"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _sample_keys(self, label_values):
+        keys = [
+            self._key(_sample(f'{self.name}_bucket', label_values + (('le', repr(float(bound))),)))
+            for bound in self.buckets
+        ]
+        keys.append(self._key(_sample(f'{self.name}_bucket', label_values + (('le', '+Inf'),))))
+        keys.append(self._key(_sample(f'{self.name}_sum', label_values)))
+        keys.append(self._key(_sample(f'{self.name}_count', label_values)))
+        return keys
+
+    def observe(self, value, **labels):
+        if not settings.CLINIC_METRICS:
+            return
+        label_values = self._labels(labels)
+        keys = self._keys.get(label_values)
+        if keys is None:
+            keys = self._keys[label_values] = self._sample_keys(label_values)
+        first = bisect_left(self.buckets, value)
+        with _lock:
+            values = _values()
+            # 值落在第 first 个桶，它和更大的桶（含 +Inf）都加一；更小的桶也要写出（加零），导出时分桶才完整
+            for key in keys[:first]:
+                values.add(key, 0)
+            for key in keys[first:len(self.buckets) + 1]:
+                values.add(key, 1)
+            values.add(keys[-2], value)
+            values.add(keys[-1], 1)
+
+
+REQUESTS = Counter('clinic_requests_total', '请求数', ('view', 'method'))
+REQUEST_ERRORS = Counter('clinic_request_errors_total', '返回5xx的请求数', ('view',))
+REQUEST_LATENCY = Histogram('clinic_request_duration_seconds', '请求耗时（秒）', ('view',))
+REQUEST_QUERIES = Histogram('clinic_request_queries', '每个请求执行的SQL条数', ('view',), buckets=QUERY_BUCKETS)
+BOOKINGS = Counter('clinic_bookings_total', '新增预约数')
+CANCELLATIONS = Counter('clinic_cancellations_total', '取消预约数')
+CHECKINS = Counter('clinic_checkins_total', '前台核验后开始就诊的人次')
+PAYMENTS = Counter('clinic_payments_total', '缴费笔数', ('method',))
+PAYMENT_AMOUNT = Counter('clinic_payment_amount_yuan_total', '缴费金额（元）', ('method',))
+
+
+def collect(directory=None):
+    """合并目录下所有进程的指标文件，返回 {指标族名: {样本: 值}}，样本保持写入时的顺序"""
+    directory = directory or settings.CLINIC_METRICS_DIR
+    families = {}
+    for path in sorted(glob.glob(os.path.join(directory, 'metrics-*.db'))):
+        try:
+            entries = read_file(path)
+        except OSError:  # 进程退出时文件可能正被清理
+            continue
+        for key, value in entries:
+            family, sample = json.loads(key)
+            samples = families.setdefault(family, {})
+            samples[sample] = samples.get(sample, 0) + value
+    return families
+
+
+def _number(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render(directory=None):
+    """Prometheus 文本格式"""
+    families = collect(directory)
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for sample, value in families.get(name, {}).items():
+            lines.append(f'{sample} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset(directory=None):
+    """删除所有进程的指标文件；在启动全部 worker 之前调用，重启后计数从零开始"""
+    global _store, _store_owner
+    if _store is not None:
+        _store.close()
+        _store = _store_owner = None
+    for path in glob.glob(os.path.join(directory or settings.CLINIC_METRICS_DIR, 'metrics-*.db')):
+        os.remove(path)
@@ -0,0 +1,139 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from . import metrics
+from .instrumentation import QueryCounter, append_jsonl, collect_queries, route_name, statement_summary
+from .profiling import profile_reason, profile_request
+from .replica import LAST_WRITE_SESSION_KEY, SAFE_METHODS, replica_configured
+from .roles import get_role
+
+# 慢请求日志里列出的最耗时SQL条数
+SLOW_LOG_TOP_STATEMENTS = 5
+
+
+class RoleMiddleware:
+    """
+    给每个请求挂上 request.role（角色及患者/医生ID）。
+    懒加载：视图用到时才解析，且解析结果缓存在 session 里，大多数请求不查库。
+    需放在 AuthenticationMiddleware 之后。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.role = SimpleLazyObject(lambda: get_role(request))
+        return self.get_response(request)
+
+
+class SQLInstrumentationMiddleware:
+    """
+    统计每个请求的SQL次数与耗时，写入 Server-Timing 响应头；
+    同一SQL模板重复执行（N+1）会单独标出，超过阈值的慢请求追加到 JSONL 日志。
+    由 CLINIC_SQL_INSTRUMENTATION 开启，关闭时不参与请求处理。放在 MIDDLEWARE 最前面。
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CLINIC_SQL_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = settings.CLINIC_SLOW_REQUEST_MS
+        self.log_path = settings.CLINIC_SLOW_REQUEST_LOG
+        self.repeat_threshold = settings.CLINIC_REPEATED_SQL_THRESHOLD
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with collect_queries() as queries:
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = queries.seconds * 1000
+        repeated = queries.repeated(self.repeat_threshold)
+
+        timings = [
+            f'db;dur={db_ms:.1f};desc="SQL x{queries.count}"',
+            f'app;dur={total_ms - db_ms:.1f}',
+        ]
+        if repeated:
+            timings.append(f'dup;desc="repeated SQL x{sum(row[1] for row in repeated)}"')
+        timings.append(f'total;dur={total_ms:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+
+        if total_ms >= self.slow_ms:
+            user = getattr(request, 'user', None)
+            append_jsonl(self.log_path, {
+                'time': timezone.now().isoformat(),
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'user_id': user.pk if user is not None and user.is_authenticated else None,
+                'total_ms': round(total_ms, 3),
+                'db_ms': round(db_ms, 3),
+                'queries': queries.count,
+                'repeated': statement_summary(repeated),
+                'top': statement_summary(queries.slowest(SLOW_LOG_TOP_STATEMENTS)),
+            })
+        return response
+
+
+class MetricsMiddleware:
+    """
+    按路由名记录请求数、耗时和SQL条数直方图、5xx 错误数，写入本进程的指标文件（clinic/metrics.py）。
+    由 CLINIC_METRICS 开启，关闭时不参与请求处理。放在 MIDDLEWARE 靠前的位置，耗时才覆盖整个请求。
+    """
+
+    def __init__(self, get_response):
+        if not settings.CLINIC_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with collect_queries(QueryCounter()) as queries:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+        view = route_name(request)
+        metrics.REQUESTS.inc(view=view, method=request.method)
+        metrics.REQUEST_LATENCY.observe(elapsed, view=view)
+        metrics.REQUEST_QUERIES.observe(queries.count, view=view)
+        if response.status_code >= 500:
+            metrics.REQUEST_ERRORS.inc(view=view)
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    开启只读副本时，把用户最近一次写请求的时间记在 session 里；
+    副本同步到这个时间之后才给该用户读副本，刚提交的数据不会“消失”。需放在 SessionMiddleware 之后。
+    """
+
+    def __init__(self, get_response):
+        if not replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and hasattr(request, 'session'):
+            request.session[LAST_WRITE_SESSION_KEY] = time.time()
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    按需在 cProfile 下处理请求：CLINIC_PROFILE 开启时每个请求都剖析，CLINIC_PROFILE_SAMPLE_RATE 按比例抽样，
+    超级管理员带 X-Clinic-Profile: 1 头时剖析该请求。结果按视图名保存，见 clinic/profiling.py。
+    不剖析的请求只多一次判断。需放在 AuthenticationMiddleware 之后。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = profile_reason(request)
+        if reason is None:
+            return self.get_response(request)
+        return profile_request(self.get_response, request, reason)
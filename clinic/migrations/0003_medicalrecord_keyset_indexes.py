@@ -0,0 +1,21 @@
+# Generated by Django 3.0.5 on 2026-10-17 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0002_auto_20251226_1917'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['visit_time', 'record_id'], name='record_visit_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['doctor', 'visit_time', 'record_id'], name='record_doctor_keyset_idx'),
+        ),
+    ]
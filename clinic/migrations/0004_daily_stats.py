@@ -0,0 +1,46 @@
+# Generated by Django 3.0.5 on 2026-10-17 04:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0003_medicalrecord_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDailyStat',
+            fields=[
+                ('stat_id', models.AutoField(primary_key=True, serialize=False, verbose_name='统计ID')),
+                ('stat_date', models.DateField(verbose_name='统计日期')),
+                ('visit_count', models.IntegerField(default=0, verbose_name='就诊人次')),
+                ('payment_count', models.IntegerField(default=0, verbose_name='缴费笔数')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='总金额')),
+                ('medical_insurance', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='医保金额')),
+                ('self_pay', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='自费金额')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clinic.Doctor', verbose_name='医生')),
+            ],
+            options={
+                'verbose_name': '医生日统计',
+                'verbose_name_plural': '医生日统计',
+                'unique_together': {('stat_date', 'doctor')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DeptDailyStat',
+            fields=[
+                ('stat_id', models.AutoField(primary_key=True, serialize=False, verbose_name='统计ID')),
+                ('stat_date', models.DateField(verbose_name='统计日期')),
+                ('visit_count', models.IntegerField(default=0, verbose_name='就诊人次')),
+                ('dept', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clinic.Department', verbose_name='科室')),
+            ],
+            options={
+                'verbose_name': '科室日统计',
+                'verbose_name_plural': '科室日统计',
+                'unique_together': {('stat_date', 'dept')},
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.0.5 on 2026-10-17 04:29
+
+import clinic.models
+from django.db import migrations, models
+
+
+def backfill_dates(apps, schema_editor):
+    """按本地时区回填已有数据的冗余日期字段"""
+    for model_name, time_field, date_field in (
+        ('Appointment', 'arrival_time', 'arrival_date'),
+        ('MedicalRecord', 'visit_time', 'visit_date'),
+        ('Payment', 'pay_time', 'pay_date'),
+    ):
+        model = apps.get_model('clinic', model_name)
+        batch = []
+        for obj in model.objects.only('pk', time_field).iterator(chunk_size=2000):
+            setattr(obj, date_field, clinic.models.local_date(getattr(obj, time_field)))
+            batch.append(obj)
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, [date_field])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [date_field])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0004_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='arrival_date',
+            field=clinic.models.LocalDateField(null=True, source='arrival_time', verbose_name='到达日期'),
+        ),
+        migrations.AddField(
+            model_name='medicalrecord',
+            name='visit_date',
+            field=clinic.models.LocalDateField(null=True, source='visit_time', verbose_name='就诊日期'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='pay_date',
+            field=clinic.models.LocalDateField(null=True, source='pay_time', verbose_name='缴费日期'),
+        ),
+        migrations.RunPython(backfill_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(status=0), fields=['patient', 'arrival_date', 'arrival_time'], name='appt_pending_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['arrival_date', 'status'], name='appt_date_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['visit_date', 'visit_status'], name='record_date_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['pay_date'], name='payment_date_idx'),
+        ),
+    ]
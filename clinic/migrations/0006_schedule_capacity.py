@@ -0,0 +1,95 @@
+# Generated by Django 3.0.5 on 2026-10-17 04:31
+
+import re
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+import django.db.models.expressions
+
+# 迁移时的时间段格式，固定在这里，不随 clinic.models 变化
+TIME_SLOT_RE = re.compile(r'(\d{1,2})[:：](\d{2})\s*[-~—－至到]\s*(\d{1,2})[:：](\d{2})')
+BATCH_SIZE = 500
+
+
+def _covers(time_slot, minute):
+    match = TIME_SLOT_RE.search(time_slot or '')
+    if not match:
+        return True  # 解析不出的时间段（如“全天”）视为全天接诊
+    h1, m1, h2, m2 = (int(x) for x in match.groups())
+    start, end = h1 * 60 + m1, h2 * 60 + m2
+    return start >= end or start <= minute < end
+
+
+def link_pending_appointments(apps, schema_editor):
+    """
+    升级前已有的未就诊预约挂到所在时段的排班上，并按挂上的数量回填 booked_count；
+    号源数量至少等于已预约数，否则加上的 CheckConstraint 不成立。
+    按日期逐天处理，同一时段有多个排班时挂到余号最多的一个（与预约时的分配一致）。
+    """
+    Appointment = apps.get_model('clinic', 'Appointment')
+    Schedule = apps.get_model('clinic', 'Schedule')
+    pending = Appointment.objects.filter(status=0, schedule__isnull=True)
+    dates = pending.exclude(arrival_date=None).order_by('arrival_date').values_list('arrival_date', flat=True).distinct()
+    for day in dates.iterator():
+        schedules = list(Schedule.objects.filter(schedule_date=day).select_related('doctor').order_by('pk'))
+        if not schedules:
+            continue
+        for schedule in schedules:
+            schedule.booked_count = 0
+        linked = []
+        for appointment in pending.filter(arrival_date=day).order_by('pk'):
+            arrival = timezone.localtime(appointment.arrival_time) if timezone.is_aware(appointment.arrival_time) \
+                else appointment.arrival_time
+            minute = arrival.hour * 60 + arrival.minute
+            candidates = [
+                schedule for schedule in schedules
+                if schedule.doctor.dept_id == appointment.dept_id and _covers(schedule.time_slot, minute)
+            ]
+            if not candidates:
+                continue
+            # 可接诊的优先，其次余号多的
+            schedule = max(candidates, key=lambda s: (s.status == 1, s.capacity - s.booked_count))
+            schedule.booked_count += 1
+            appointment.schedule_id = schedule.pk
+            linked.append(appointment)
+        for schedule in schedules:
+            schedule.capacity = max(schedule.capacity, schedule.booked_count)
+        Appointment.objects.bulk_update(linked, ['schedule'], batch_size=BATCH_SIZE)
+        Schedule.objects.bulk_update(
+            [s for s in schedules if s.booked_count], ['booked_count', 'capacity'], batch_size=BATCH_SIZE
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0005_stored_dates_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='schedule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='clinic.Schedule', verbose_name='预约号源'),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='booked_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='已预约数'),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='capacity',
+            field=models.PositiveIntegerField(default=30, verbose_name='号源数量'),
+        ),
+        migrations.RunPython(link_pending_appointments, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['schedule_date', 'status'], name='schedule_date_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='schedule',
+            constraint=models.CheckConstraint(check=models.Q(booked_count__lte=django.db.models.expressions.F('capacity')), name='schedule_not_overbooked'),
+        ),
+    ]
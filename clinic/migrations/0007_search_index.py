@@ -0,0 +1,67 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# 以下是建索引时的表结构和分词规则的固定副本，不引用 clinic.search：
+# 之后修改 search.py 不会改变这个迁移的结果（分词规则变化后用 rebuild_search_index 重建）。
+
+# 索引名 -> (FTS5 表名, 模型名, 索引字段)
+INDEXES = {
+    'patient': ('clinic_patient_fts', 'Patient', ('name', 'mobile', 'id_card')),
+    'record': ('clinic_record_fts', 'MedicalRecord', ('symptom', 'prescription')),
+}
+BATCH_SIZE = 5000
+ASCII_GRAM = 8
+_SEGMENT_RE = re.compile(r'[0-9a-z]+|[^\W_0-9a-z]+')
+
+
+def _tokens(segment):
+    if segment.isascii():
+        return [segment[i:i + ASCII_GRAM] for i in range(len(segment))]
+    return [segment[i:i + 2] for i in range(len(segment) - 1)] + [segment[-1]]
+
+
+def grams(text):
+    segments = _SEGMENT_RE.findall(unicodedata.normalize('NFKC', text or '').lower())
+    return ' '.join(token for segment in segments for token in _tokens(segment))
+
+
+def create_search_index(apps, schema_editor):
+    """建 FTS5 全文索引表并从已有数据回填"""
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for table, model_name, fields in INDEXES.values():
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5('
+                f'{", ".join(fields)}, tokenize="unicode61 remove_diacritics 0")'
+            )
+            sql = f'INSERT INTO {table} (rowid, {", ".join(fields)}) VALUES ({", ".join(["%s"] * (len(fields) + 1))})'
+            model = apps.get_model('clinic', model_name)
+            rows = model._default_manager.using(connection.alias).values_list('pk', *fields).order_by('pk')
+            batch = []
+            for pk, *values in rows.iterator(chunk_size=BATCH_SIZE):
+                batch.append([pk] + [grams(value) for value in values])
+                if len(batch) >= BATCH_SIZE:
+                    cursor.executemany(sql, batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+            cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+
+
+def drop_search_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, model_name, fields in INDEXES.values():
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0006_schedule_capacity'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,182 @@
+# Generated by Django 3.0.5 on 2026-10-17 05:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# 热表 + 归档表的只读视图，对应 AppointmentHistory / MedicalRecordHistory / PaymentHistory
+APPOINTMENT_COLUMNS = 'appt_id, patient_id, dept_id, appt_time, arrival_time, status, arrival_date, schedule_id'
+RECORD_COLUMNS = (
+    'record_id, patient_id, doctor_id, room_id, visit_time, visit_status, '
+    'symptom, prescription, appointment_id, visit_date'
+)
+PAYMENT_COLUMNS = (
+    'p.pay_id, p.record_id, r.patient_id, r.doctor_id, p.total_amount, p.medical_insurance, '
+    'p.self_pay, p.pay_time, p.pay_method, p.pay_date'
+)
+
+CREATE_VIEWS = [
+    f"""CREATE VIEW clinic_appointment_history AS
+        SELECT {APPOINTMENT_COLUMNS}, 0 AS archived FROM clinic_appointment
+        UNION ALL
+        SELECT {APPOINTMENT_COLUMNS}, 1 AS archived FROM clinic_archivedappointment""",
+    f"""CREATE VIEW clinic_medicalrecord_history AS
+        SELECT {RECORD_COLUMNS}, 0 AS archived FROM clinic_medicalrecord
+        UNION ALL
+        SELECT {RECORD_COLUMNS}, 1 AS archived FROM clinic_archivedmedicalrecord""",
+    f"""CREATE VIEW clinic_payment_history AS
+        SELECT {PAYMENT_COLUMNS}, 0 AS archived
+        FROM clinic_payment p JOIN clinic_medicalrecord r ON r.record_id = p.record_id
+        UNION ALL
+        SELECT {PAYMENT_COLUMNS}, 1 AS archived
+        FROM clinic_archivedpayment p JOIN clinic_archivedmedicalrecord r ON r.record_id = p.record_id""",
+]
+
+DROP_VIEWS = [
+    'DROP VIEW IF EXISTS clinic_payment_history',
+    'DROP VIEW IF EXISTS clinic_medicalrecord_history',
+    'DROP VIEW IF EXISTS clinic_appointment_history',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentHistory',
+            fields=[
+                ('appt_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='预约ID')),
+                ('appt_time', models.DateTimeField(verbose_name='预约时间')),
+                ('arrival_time', models.DateTimeField(verbose_name='预计到达时间')),
+                ('status', models.IntegerField(choices=[(0, '未就诊'), (1, '已完成'), (2, '已取消')], verbose_name='预约状态')),
+                ('arrival_date', models.DateField(null=True, verbose_name='到达日期')),
+                ('archived', models.BooleanField(verbose_name='已归档')),
+            ],
+            options={
+                'verbose_name': '预约（含归档）',
+                'verbose_name_plural': '预约（含归档）',
+                'db_table': 'clinic_appointment_history',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MedicalRecordHistory',
+            fields=[
+                ('record_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='就诊ID')),
+                ('visit_time', models.DateTimeField(verbose_name='就诊时间')),
+                ('visit_status', models.IntegerField(choices=[(0, '就诊中'), (1, '已离院')], verbose_name='就诊状态')),
+                ('symptom', models.CharField(max_length=500, null=True, verbose_name='病情描述')),
+                ('prescription', models.CharField(max_length=500, null=True, verbose_name='处方信息')),
+                ('appointment_id', models.IntegerField(null=True, verbose_name='关联预约ID')),
+                ('visit_date', models.DateField(null=True, verbose_name='就诊日期')),
+                ('archived', models.BooleanField(verbose_name='已归档')),
+            ],
+            options={
+                'verbose_name': '就诊记录（含归档）',
+                'verbose_name_plural': '就诊记录（含归档）',
+                'db_table': 'clinic_medicalrecord_history',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentHistory',
+            fields=[
+                ('pay_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='缴费ID')),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='总金额')),
+                ('medical_insurance', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='医保金额')),
+                ('self_pay', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='自费金额')),
+                ('pay_time', models.DateTimeField(verbose_name='缴费时间')),
+                ('pay_method', models.CharField(max_length=10, verbose_name='缴费方式')),
+                ('pay_date', models.DateField(null=True, verbose_name='缴费日期')),
+                ('archived', models.BooleanField(verbose_name='已归档')),
+            ],
+            options={
+                'verbose_name': '缴费记录（含归档）',
+                'verbose_name_plural': '缴费记录（含归档）',
+                'db_table': 'clinic_payment_history',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedMedicalRecord',
+            fields=[
+                ('record_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='就诊ID')),
+                ('visit_time', models.DateTimeField(verbose_name='就诊时间')),
+                ('visit_status', models.IntegerField(choices=[(0, '就诊中'), (1, '已离院')], verbose_name='就诊状态')),
+                ('symptom', models.CharField(blank=True, max_length=500, null=True, verbose_name='病情描述')),
+                ('prescription', models.CharField(blank=True, max_length=500, null=True, verbose_name='处方信息')),
+                ('appointment_id', models.IntegerField(blank=True, null=True, verbose_name='关联预约ID')),
+                ('visit_date', models.DateField(null=True, verbose_name='就诊日期')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clinic.Doctor', verbose_name='接诊医生')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clinic.Patient', verbose_name='患者')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clinic.ClinicRoom', verbose_name='就诊诊室')),
+            ],
+            options={
+                'verbose_name': '归档就诊记录',
+                'verbose_name_plural': '归档就诊记录',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('pay_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='缴费ID')),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='总金额')),
+                ('medical_insurance', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='医保金额')),
+                ('self_pay', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='自费金额')),
+                ('pay_time', models.DateTimeField(verbose_name='缴费时间')),
+                ('pay_method', models.CharField(max_length=10, verbose_name='缴费方式')),
+                ('pay_date', models.DateField(null=True, verbose_name='缴费日期')),
+                ('record', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='clinic.ArchivedMedicalRecord', verbose_name='关联就诊记录')),
+            ],
+            options={
+                'verbose_name': '归档缴费记录',
+                'verbose_name_plural': '归档缴费记录',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedAppointment',
+            fields=[
+                ('appt_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='预约ID')),
+                ('appt_time', models.DateTimeField(verbose_name='预约时间')),
+                ('arrival_time', models.DateTimeField(verbose_name='预计到达时间')),
+                ('status', models.IntegerField(choices=[(0, '未就诊'), (1, '已完成'), (2, '已取消')], verbose_name='预约状态')),
+                ('arrival_date', models.DateField(null=True, verbose_name='到达日期')),
+                ('dept', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clinic.Department', verbose_name='预约科室')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clinic.Patient', verbose_name='患者')),
+                ('schedule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='clinic.Schedule', verbose_name='预约号源')),
+            ],
+            options={
+                'verbose_name': '归档预约',
+                'verbose_name_plural': '归档预约',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedpayment',
+            index=models.Index(fields=['pay_time'], name='archived_payment_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedpayment',
+            index=models.Index(fields=['pay_date'], name='archived_payment_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmedicalrecord',
+            index=models.Index(fields=['visit_time', 'record_id'], name='archived_record_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmedicalrecord',
+            index=models.Index(fields=['doctor', 'visit_time', 'record_id'], name='archived_record_doctor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmedicalrecord',
+            index=models.Index(fields=['visit_date'], name='archived_record_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['patient', 'arrival_time'], name='archived_appt_patient_idx'),
+        ),
+        migrations.RunSQL(CREATE_VIEWS, DROP_VIEWS),
+    ]
@@ -1,6 +1,39 @@
+import re
+
 from django.db import models
+from django.db.models import F, Q
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, RegexValidator
+from django.utils import timezone
+
+
+def local_date(value):
+    """把时间换算成本地日期（兼容未带时区的时间）"""
+    if timezone.is_naive(value):
+        return value.date()
+    return timezone.localtime(value).date()
+
+
+# 冗余日期字段：保存时从 source 指定的时间字段换算出本地日期
+# 按日期过滤时直接命中索引，不必对时间列套 date() 函数
+class LocalDateField(models.DateField):
+    def __init__(self, *args, source=None, **kwargs):
+        self.source = source
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        kwargs.pop('editable', None)
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        # 字段按定义顺序 pre_save，source 在前面，auto_now_add 的值此时已经生成
+        value = getattr(model_instance, self.source)
+        date = local_date(value) if value else None
+        setattr(model_instance, self.attname, date)
+        return date
 
 # 科室模型
 class Department(models.Model):
@@ -63,6 +96,22 @@ class Patient(models.Model):
         verbose_name = "患者"
         verbose_name_plural = "患者"
 
+# 时间段文本（如“上午（8:00-12:00）”“08:00-12:00”）中的起止时间
+TIME_SLOT_RE = re.compile(r'(\d{1,2})[:：](\d{2})\s*[-~—－至到]\s*(\d{1,2})[:：](\d{2})')
+
+
+def parse_time_slot(time_slot):
+    """把时间段解析成当天的 (开始分钟, 结束分钟)，解析不出返回None"""
+    match = TIME_SLOT_RE.search(time_slot or '')
+    if not match:
+        return None
+    h1, m1, h2, m2 = (int(x) for x in match.groups())
+    start, end = h1 * 60 + m1, h2 * 60 + m2
+    if start >= end:
+        return None
+    return start, end
+
+
 # 排班模型
 class Schedule(models.Model):
     schedule_id = models.AutoField(primary_key=True, verbose_name="排班ID")
@@ -71,15 +120,33 @@ class Schedule(models.Model):
     schedule_date = models.DateField(verbose_name="排班日期")
     time_slot = models.CharField(max_length=20, verbose_name="接诊时间段")
     status = models.IntegerField(choices=[(0, '不可接诊'), (1, '可接诊')], default=1, verbose_name="排班状态")
+    capacity = models.PositiveIntegerField(default=30, verbose_name="号源数量")
+    booked_count = models.PositiveIntegerField(default=0, verbose_name="已预约数")
 
     class Meta:
         verbose_name = "排班"
         verbose_name_plural = "排班"
         unique_together = ('doctor', 'schedule_date', 'time_slot')  # 避免重复排班
+        constraints = [
+            # 数据库兜底：已预约数永远不超过号源数量
+            models.CheckConstraint(check=Q(booked_count__lte=F('capacity')), name='schedule_not_overbooked'),
+        ]
+        indexes = [
+            models.Index(fields=['schedule_date', 'status'], name='schedule_date_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.doctor.name}-{self.schedule_date}-{self.time_slot}"
 
+    @property
+    def remaining(self):
+        return max(self.capacity - self.booked_count, 0)
+
+    def covers(self, minute):
+        """minute（当天第几分钟）是否落在本排班时间段内；时间段无法解析时视为全天"""
+        slot = parse_time_slot(self.time_slot)
+        return slot is None or slot[0] <= minute < slot[1]
+
 # 预约模型（增加医生关联）
 class Appointment(models.Model):
     appt_id = models.AutoField(primary_key=True, verbose_name="预约ID")
@@ -90,6 +157,8 @@ class Appointment(models.Model):
     appt_time = models.DateTimeField(auto_now_add=True, verbose_name="预约时间")
     arrival_time = models.DateTimeField(verbose_name="预计到达时间")
     status = models.IntegerField(choices=[(0, '未就诊'), (1, '已完成'), (2, '已取消')], default=0, verbose_name="预约状态")
+    arrival_date = LocalDateField(source='arrival_time', null=True, verbose_name="到达日期")
+    schedule = models.ForeignKey(Schedule, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="预约号源")
 
     class Meta:
         verbose_name = "预约"
@@ -97,6 +166,15 @@ class Appointment(models.Model):
         # 移除和doctor相关的唯一约束 ↓
         # unique_together = ('patient', 'arrival_time', 'doctor')
         unique_together = ('patient', 'arrival_time')  # 恢复原始约束
+        indexes = [
+            # 患者当天未就诊预约（冲突检查、首页待就诊列表）
+            models.Index(
+                fields=['patient', 'arrival_date', 'arrival_time'],
+                condition=Q(status=0),
+                name='appt_pending_patient_idx'
+            ),
+            models.Index(fields=['arrival_date', 'status'], name='appt_date_status_idx'),
+        ]
 
     def __str__(self):
         # 移除doctor相关显示 ↓
@@ -115,10 +193,17 @@ class MedicalRecord(models.Model):
     symptom = models.CharField(max_length=500, blank=True, null=True, verbose_name="病情描述")
     prescription = models.CharField(max_length=500, blank=True, null=True, verbose_name="处方信息")
     appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="关联预约")
+    visit_date = LocalDateField(source='visit_time', null=True, verbose_name="就诊日期")
 
     class Meta:
         verbose_name = "就诊记录"
         verbose_name_plural = "就诊记录"
+        # 就诊记录列表按 (visit_time, record_id) 游标分页，可按医生筛选
+        indexes = [
+            models.Index(fields=['visit_time', 'record_id'], name='record_visit_keyset_idx'),
+            models.Index(fields=['doctor', 'visit_time', 'record_id'], name='record_doctor_keyset_idx'),
+            models.Index(fields=['visit_date', 'visit_status'], name='record_date_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient.name}-{self.visit_time.strftime('%Y-%m-%d %H:%M')}"
@@ -132,10 +217,14 @@ class Payment(models.Model):
     self_pay = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name="自费金额")
     pay_time = models.DateTimeField(auto_now_add=True, verbose_name="缴费时间")
     pay_method = models.CharField(max_length=10, choices=[('现金', '现金'), ('微信', '微信'), ('支付宝', '支付宝'), ('医保', '医保')], verbose_name="缴费方式")
+    pay_date = LocalDateField(source='pay_time', null=True, verbose_name="缴费日期")
 
     class Meta:
         verbose_name = "缴费记录"
         verbose_name_plural = "缴费记录"
+        indexes = [
+            models.Index(fields=['pay_date'], name='payment_date_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         # 自动计算自费金额
@@ -143,4 +232,171 @@ class Payment(models.Model):
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.record.patient.name}-{self.total_amount}元"
\ No newline at end of file
+        return f"{self.record.patient.name}-{self.total_amount}元"
+
+# 科室每日就诊统计（随就诊记录增删实时累加，供数据统计页直接读取）
+class DeptDailyStat(models.Model):
+    stat_id = models.AutoField(primary_key=True, verbose_name="统计ID")
+    stat_date = models.DateField(verbose_name="统计日期")
+    dept = models.ForeignKey(Department, on_delete=models.CASCADE, verbose_name="科室")
+    visit_count = models.IntegerField(default=0, verbose_name="就诊人次")
+
+    class Meta:
+        verbose_name = "科室日统计"
+        verbose_name_plural = "科室日统计"
+        unique_together = ('stat_date', 'dept')
+
+    def __str__(self):
+        return f"{self.stat_date}-{self.dept_id}"
+
+# 医生每日就诊/缴费统计
+class DoctorDailyStat(models.Model):
+    stat_id = models.AutoField(primary_key=True, verbose_name="统计ID")
+    stat_date = models.DateField(verbose_name="统计日期")
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, verbose_name="医生")
+    visit_count = models.IntegerField(default=0, verbose_name="就诊人次")
+    payment_count = models.IntegerField(default=0, verbose_name="缴费笔数")
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="总金额")
+    medical_insurance = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="医保金额")
+    self_pay = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="自费金额")
+
+    class Meta:
+        verbose_name = "医生日统计"
+        verbose_name_plural = "医生日统计"
+        unique_together = ('stat_date', 'doctor')
+
+    def __str__(self):
+        return f"{self.stat_date}-{self.doctor_id}"
+
+
+# ==================== 归档（冷数据） ====================
+# 已离院且已缴费、超过保留期的就诊记录连同缴费、预约一起移到归档表（见 clinic/archive.py），
+# 热表和热表索引只保留近期数据。归档表的列名与热表一致，主键沿用原值。
+
+APPOINTMENT_STATUS_CHOICES = [(0, '未就诊'), (1, '已完成'), (2, '已取消')]
+VISIT_STATUS_CHOICES = [(0, '就诊中'), (1, '已离院')]
+
+
+class ArchivedAppointment(models.Model):
+    appt_id = models.IntegerField(primary_key=True, verbose_name="预约ID")
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, verbose_name="患者")
+    dept = models.ForeignKey(Department, on_delete=models.CASCADE, verbose_name="预约科室")
+    appt_time = models.DateTimeField(verbose_name="预约时间")
+    arrival_time = models.DateTimeField(verbose_name="预计到达时间")
+    status = models.IntegerField(choices=APPOINTMENT_STATUS_CHOICES, verbose_name="预约状态")
+    arrival_date = models.DateField(null=True, verbose_name="到达日期")
+    schedule = models.ForeignKey(Schedule, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="预约号源")
+
+    class Meta:
+        verbose_name = "归档预约"
+        verbose_name_plural = "归档预约"
+        indexes = [
+            models.Index(fields=['patient', 'arrival_time'], name='archived_appt_patient_idx'),
+        ]
+
+
+class ArchivedMedicalRecord(models.Model):
+    record_id = models.IntegerField(primary_key=True, verbose_name="就诊ID")
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, verbose_name="患者")
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, verbose_name="接诊医生")
+    room = models.ForeignKey(ClinicRoom, on_delete=models.CASCADE, verbose_name="就诊诊室")
+    visit_time = models.DateTimeField(verbose_name="就诊时间")
+    visit_status = models.IntegerField(choices=VISIT_STATUS_CHOICES, verbose_name="就诊状态")
+    symptom = models.CharField(max_length=500, blank=True, null=True, verbose_name="病情描述")
+    prescription = models.CharField(max_length=500, blank=True, null=True, verbose_name="处方信息")
+    # 关联的预约可能还在热表（同一预约有未归档的就诊记录时），所以只存ID
+    appointment_id = models.IntegerField(null=True, blank=True, verbose_name="关联预约ID")
+    visit_date = models.DateField(null=True, verbose_name="就诊日期")
+
+    class Meta:
+        verbose_name = "归档就诊记录"
+        verbose_name_plural = "归档就诊记录"
+        indexes = [
+            models.Index(fields=['visit_time', 'record_id'], name='archived_record_keyset_idx'),
+            models.Index(fields=['doctor', 'visit_time', 'record_id'], name='archived_record_doctor_idx'),
+            models.Index(fields=['visit_date'], name='archived_record_date_idx'),
+        ]
+
+
+class ArchivedPayment(models.Model):
+    pay_id = models.IntegerField(primary_key=True, verbose_name="缴费ID")
+    record = models.OneToOneField(ArchivedMedicalRecord, on_delete=models.CASCADE, verbose_name="关联就诊记录")
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="总金额")
+    medical_insurance = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="医保金额")
+    self_pay = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="自费金额")
+    pay_time = models.DateTimeField(verbose_name="缴费时间")
+    pay_method = models.CharField(max_length=10, verbose_name="缴费方式")
+    pay_date = models.DateField(null=True, verbose_name="缴费日期")
+
+    class Meta:
+        verbose_name = "归档缴费记录"
+        verbose_name_plural = "归档缴费记录"
+        indexes = [
+            models.Index(fields=['pay_time'], name='archived_payment_time_idx'),
+            models.Index(fields=['pay_date'], name='archived_payment_date_idx'),
+        ]
+
+
+# 热表 + 归档表的只读视图（UNION ALL，见迁移 0008），供需要查看全部历史的页面和统计重算使用；
+# 默认的 Appointment/MedicalRecord/Payment 只查热表。archived 标记该行来自归档表。
+
+class AppointmentHistory(models.Model):
+    appt_id = models.IntegerField(primary_key=True, verbose_name="预约ID")
+    patient = models.ForeignKey(Patient, on_delete=models.DO_NOTHING, verbose_name="患者")
+    dept = models.ForeignKey(Department, on_delete=models.DO_NOTHING, verbose_name="预约科室")
+    appt_time = models.DateTimeField(verbose_name="预约时间")
+    arrival_time = models.DateTimeField(verbose_name="预计到达时间")
+    status = models.IntegerField(choices=APPOINTMENT_STATUS_CHOICES, verbose_name="预约状态")
+    arrival_date = models.DateField(null=True, verbose_name="到达日期")
+    schedule = models.ForeignKey(Schedule, on_delete=models.DO_NOTHING, null=True, verbose_name="预约号源")
+    archived = models.BooleanField(verbose_name="已归档")
+
+    class Meta:
+        managed = False
+        db_table = 'clinic_appointment_history'
+        verbose_name = "预约（含归档）"
+        verbose_name_plural = "预约（含归档）"
+
+
+class MedicalRecordHistory(models.Model):
+    record_id = models.IntegerField(primary_key=True, verbose_name="就诊ID")
+    patient = models.ForeignKey(Patient, on_delete=models.DO_NOTHING, verbose_name="患者")
+    doctor = models.ForeignKey(Doctor, on_delete=models.DO_NOTHING, verbose_name="接诊医生")
+    room = models.ForeignKey(ClinicRoom, on_delete=models.DO_NOTHING, verbose_name="就诊诊室")
+    visit_time = models.DateTimeField(verbose_name="就诊时间")
+    visit_status = models.IntegerField(choices=VISIT_STATUS_CHOICES, verbose_name="就诊状态")
+    symptom = models.CharField(max_length=500, null=True, verbose_name="病情描述")
+    prescription = models.CharField(max_length=500, null=True, verbose_name="处方信息")
+    appointment_id = models.IntegerField(null=True, verbose_name="关联预约ID")
+    visit_date = models.DateField(null=True, verbose_name="就诊日期")
+    archived = models.BooleanField(verbose_name="已归档")
+
+    class Meta:
+        managed = False
+        db_table = 'clinic_medicalrecord_history'
+        verbose_name = "就诊记录（含归档）"
+        verbose_name_plural = "就诊记录（含归档）"
+
+    def __str__(self):
+        return f"{self.patient.name}-{self.visit_time.strftime('%Y-%m-%d %H:%M')}"
+
+
+class PaymentHistory(models.Model):
+    pay_id = models.IntegerField(primary_key=True, verbose_name="缴费ID")
+    record = models.OneToOneField(MedicalRecordHistory, on_delete=models.DO_NOTHING, verbose_name="关联就诊记录")
+    # 视图里直接带出就诊记录的患者和医生：按 record 关联视图需要物化整个 UNION，按这两列关联走主键
+    patient = models.ForeignKey(Patient, on_delete=models.DO_NOTHING, related_name='+', verbose_name="患者")
+    doctor = models.ForeignKey(Doctor, on_delete=models.DO_NOTHING, related_name='+', verbose_name="接诊医生")
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="总金额")
+    medical_insurance = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="医保金额")
+    self_pay = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="自费金额")
+    pay_time = models.DateTimeField(verbose_name="缴费时间")
+    pay_method = models.CharField(max_length=10, verbose_name="缴费方式")
+    pay_date = models.DateField(null=True, verbose_name="缴费日期")
+    archived = models.BooleanField(verbose_name="已归档")
+
+    class Meta:
+        managed = False
+        db_table = 'clinic_payment_history'
+        verbose_name = "缴费记录（含归档）"
+        verbose_name_plural = "缴费记录（含归档）"
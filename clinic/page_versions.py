@@ -0,0 +1,68 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+# 影响所有患者页面的变动（科室改名、冷数据归档）使用的版本号
+ALL_PATIENTS = 'all'
+
+
+def _version_key(scope):
+    return f'clinic:page_version:{scope}'
+
+
+def _stamp(scope):
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def page_version(patient_id):
+    """患者页面的版本号 (全局, 该患者)，任一变化都说明页面内容可能变了"""
+    return _stamp(ALL_PATIENTS), _stamp(patient_id)
+
+
+def _bump(scope):
+    # 提交后才换版本：提交前换的话，并发请求可能读到旧数据却按新版本缓存下来
+    transaction.on_commit(lambda: cache.set(_version_key(scope), time.time_ns(), None))
+
+
+def bump_patient(patient_id):
+    """患者的预约、就诊记录或个人信息变化时调用"""
+    if patient_id is not None:
+        _bump(patient_id)
+
+
+def bump_all_patients():
+    _bump(ALL_PATIENTS)
+
+
+def patient_conditional(view_func):
+    """
+    患者页面的条件GET：ETag/Last-Modified 取自页面版本号，浏览器带着上次的值来时直接返回304，
+    不查库也不渲染。版本号放在 request.page_version，模板片段缓存用它做键。
+    须放在 patient_required 之后（需要 request.patient_id）。
+    """
+    def etag(request, *args, **kwargs):
+        return '"{}-{}-{}"'.format(request.patient_id, *request.page_version)
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(max(request.page_version) / 1e9, tz=dt_timezone.utc)
+
+    conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view_func)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        request.page_version = page_version(request.patient_id)
+        response = conditional_view(request, *args, **kwargs)
+        # 浏览器可以保存，但每次使用前都要带着 ETag 回来确认
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    return wrapper
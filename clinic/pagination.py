@@ -0,0 +1,177 @@
+import base64
+import datetime
+import json
+from math import ceil
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder 会把时间截断到毫秒，游标需要保留完整的微秒精度"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+# 游标（keyset）分页：按排序键定位下一页，不使用OFFSET，翻到第几页代价都一样
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    按 keys 组合键倒序（descending=True）或正序分页。
+    keys 的最后一个字段必须唯一（一般是主键），保证游标位置确定。
+    """
+
+    def __init__(self, queryset, keys, per_page=50, descending=True):
+        self.queryset = queryset
+        self.keys = tuple(keys)
+        self.per_page = per_page
+        self.descending = descending
+
+    def encode_cursor(self, obj):
+        # obj 可以是模型实例，也可以是 .values() 的字典（须包含全部排序键）
+        if isinstance(obj, dict):
+            values = [obj[key] for key in self.keys]
+        else:
+            values = [getattr(obj, key) for key in self.keys]
+        raw = json.dumps(values, cls=CursorEncoder)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """非法游标返回None（按第一页处理）"""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            if len(values) != len(self.keys):
+                return None
+            opts = self.queryset.model._meta
+            return [opts.get_field(key).to_python(value) for key, value in zip(self.keys, values)]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def _seek_filter(self, values, forward):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)，逐个字段展开
+        lookup = 'lt' if forward == self.descending else 'gt'
+        condition = Q()
+        for i, key in enumerate(self.keys):
+            clause = Q(**{f'{key}__{lookup}': values[i]})
+            for prev_key, prev_value in zip(self.keys[:i], values[:i]):
+                clause &= Q(**{prev_key: prev_value})
+            condition |= clause
+        return condition
+
+    def _ordering(self, forward):
+        desc = self.descending == forward
+        return [f'-{key}' if desc else key for key in self.keys]
+
+    def page(self, after=None, before=None):
+        """after：下一页游标；before：上一页游标；都为空时返回第一页"""
+        after_values = self.decode_cursor(after)
+        before_values = self.decode_cursor(before) if after_values is None else None
+
+        forward = before_values is None
+        qs = self.queryset.order_by(*self._ordering(forward))
+        if after_values is not None:
+            qs = qs.filter(self._seek_filter(after_values, True))
+        elif before_values is not None:
+            qs = qs.filter(self._seek_filter(before_values, False))
+
+        # 多取一条用来判断是否还有更多数据
+        rows = list(qs[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows)
+
+        if forward:
+            next_cursor = self.encode_cursor(rows[-1]) if has_more else None
+            prev_cursor = self.encode_cursor(rows[0]) if after_values is not None else None
+        else:
+            next_cursor = self.encode_cursor(rows[-1])
+            prev_cursor = self.encode_cursor(rows[0]) if has_more else None
+        return KeysetPage(rows, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def estimated_count(queryset):
+    """
+    整表的估算行数：读 ANALYZE 写入 sqlite_stat1 的统计（第一个数就是表的行数）；
+    没有统计信息或不是 SQLite 时返回None
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        if cursor.fetchone() is None:
+            return None
+        cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    return int(row[0].split()[0]) if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    大表的后台列表分页，不做没有上限的 COUNT(*)：
+    不带过滤条件时行数取统计信息里的估算值（estimated），带过滤条件时最多数到 CLINIC_ADMIN_COUNT_LIMIT 行（truncated）。
+    数字页码也只覆盖前 CLINIC_ADMIN_COUNT_LIMIT 行，OFFSET 有上限；再往后用游标翻页。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limit = settings.CLINIC_ADMIN_COUNT_LIMIT
+        self.estimated = False
+        self.truncated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > self.limit:
+                self.estimated = True
+                return estimate
+        # 多数一行用来判断是否超出上限；切片后的 count() 是 SELECT COUNT(*) FROM (... LIMIT n)
+        count = queryset[:self.limit + 1].count()
+        if count > self.limit:
+            self.truncated = True
+            return self.limit
+        return count
+
+    @cached_property
+    def num_pages(self):
+        if self.count == 0 and not self.allow_empty_first_page:
+            return 0
+        hits = max(1, min(self.count, self.limit) - self.orphans)
+        return ceil(hits / self.per_page)
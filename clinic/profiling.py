@@ -0,0 +1,201 @@
+import cProfile
+import glob
+import itertools
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .instrumentation import route_name
+
+# 超级管理员请求带上 X-Clinic-Profile: 1 时剖析该请求
+PROFILE_HEADER = 'HTTP_X_CLINIC_PROFILE'
+# 响应头：本次剖析结果的文件名（不含扩展名），便于找到对应的 .prof
+PROFILE_RESPONSE_HEADER = 'X-Clinic-Profile'
+# 每次剖析记入热点摘要的函数数
+HOT_FUNCTIONS = 20
+# 折叠栈最大深度，以及低于该微秒数的分支不再展开
+COLLAPSED_MAX_DEPTH = 64
+COLLAPSED_MIN_US = 1
+
+_counter = itertools.count()
+_lock = threading.Lock()
+_NAME_RE = re.compile(r'[^\w.-]+')
+_ADDRESS_RE = re.compile(r' at 0x[0-9a-f]+')
+
+
+def profile_reason(request):
+    """该请求是否要剖析，返回触发方式（setting/header/sample），不剖析时返回None"""
+    if settings.CLINIC_PROFILE:
+        return 'setting'
+    if request.META.get(PROFILE_HEADER) == '1' and getattr(request, 'user', None) and request.user.is_superuser:
+        return 'header'
+    rate = settings.CLINIC_PROFILE_SAMPLE_RATE
+    if rate > 0 and random.random() < rate:
+        return 'sample'
+    return None
+
+
+def view_name(request):
+    """按路由名归类，用作目录名"""
+    return _NAME_RE.sub('_', route_name(request)) or 'unresolved'
+
+
+def function_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        # 内置函数：('~', 0, '<built-in method time.sleep>')；去掉对象地址，不同进程的结果才能合并
+        return _ADDRESS_RE.sub('', name).replace(';', ',')
+    return f'{name} ({os.path.basename(filename)}:{lineno})'.replace(';', ',')
+
+
+def collapsed_stacks(stats, max_depth=COLLAPSED_MAX_DEPTH):
+    """
+    把剖析结果展开成 flamegraph.pl 的折叠栈：{“外层;内层;...”: 自身耗时微秒}。
+    cProfile 只记录“调用方 -> 被调用方”一层关系，同一函数有多个调用方时，
+    按各调用方的累计时间比例分摊它的子调用，结果是近似的调用栈。
+    """
+    raw = stats.stats  # 函数 -> (原生调用数, 总调用数, 自身时间, 累计时间, {调用方: (..., 累计时间)})
+    children = defaultdict(list)
+    for func, (cc, nc, tt, ct, callers) in raw.items():
+        for caller, edge in callers.items():
+            children[caller].append((func, edge[3]))
+    stacks = Counter()
+
+    def walk(func, path, seconds, on_path):
+        tt, ct = raw[func][2], raw[func][3]
+        ratio = seconds / ct if ct else 0
+        path = f'{path};{function_label(func)}' if path else function_label(func)
+        if tt * ratio * 1e6 >= COLLAPSED_MIN_US:
+            stacks[path] += tt * ratio * 1e6
+        if len(on_path) >= max_depth:
+            return
+        on_path.add(func)
+        for child, child_ct in children.get(func, ()):
+            # 递归调用不展开，避免死循环
+            if child not in on_path and child_ct * ratio * 1e6 >= COLLAPSED_MIN_US:
+                walk(child, path, child_ct * ratio, on_path)
+        on_path.discard(func)
+
+    # 最外层：没有调用方，或只被自己递归调用
+    for func, (cc, nc, tt, ct, callers) in raw.items():
+        if not set(callers) - {func}:
+            walk(func, '', ct, set())
+    return {stack: round(us) for stack, us in stacks.items() if round(us) > 0}
+
+
+def write_collapsed(stacks, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, us in sorted(stacks.items()):
+            f.write(f'{stack} {us}\n')
+
+
+def top_functions(stats, limit=HOT_FUNCTIONS, key='cumulative'):
+    """累计时间（key=cumulative）或自身时间（key=self）最多的函数"""
+    index = 3 if key == 'cumulative' else 2
+    rows = sorted(stats.stats.items(), key=lambda item: -item[1][index])[:limit]
+    return [
+        {
+            'function': function_label(func),
+            'calls': nc,
+            'self_ms': round(tt * 1000, 3),
+            'cumulative_ms': round(ct * 1000, 3),
+        }
+        for func, (cc, nc, tt, ct, callers) in rows
+    ]
+
+
+def _trim_jsonl(path, keep):
+    """滚动保留最近 keep 行；超过两倍时才重写，平时只是追加"""
+    with open(path, encoding='utf-8') as f:
+        lines = f.readlines()
+    if len(lines) > keep * 2:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(lines[-keep:])
+
+
+def _prune(directory, keep):
+    profiles = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    for path in profiles[:-keep]:
+        for stale in (path, path[:-len('.prof')] + '.collapsed'):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:  # 其他线程或进程已经删了
+                pass
+
+
+def save_profile(profiler, name, meta):
+    """
+    保存一次剖析：<目录>/<视图名>/<时间>-<进程>-<序号>.prof 与同名 .collapsed，
+    并把本次的热点函数追加到该视图的 hot.jsonl。每个视图只保留最近 CLINIC_PROFILE_KEEP 份。
+    返回相对于剖析目录的文件名（不含扩展名）。
+    """
+    directory = os.path.join(settings.CLINIC_PROFILE_DIR, name)
+    os.makedirs(directory, exist_ok=True)
+    base = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{next(_counter):06d}'
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(os.path.join(directory, base + '.prof'))
+    write_collapsed(collapsed_stacks(stats), os.path.join(directory, base + '.collapsed'))
+
+    entry = dict(meta, profile=base, total_ms=round(stats.total_tt * 1000, 3), hot=top_functions(stats, key='self'))
+    keep = settings.CLINIC_PROFILE_KEEP
+    hot_path = os.path.join(directory, 'hot.jsonl')
+    with _lock:
+        with open(hot_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        _trim_jsonl(hot_path, keep)
+        _prune(directory, keep)
+    return f'{name}/{base}'
+
+
+def _handle(get_response, request):
+    # 折叠栈的根：中间件链里 inner 与 __call__ 互相调用，没有哪个是“无调用方”的
+    return get_response(request)
+
+
+def profile_request(get_response, request, reason):
+    """在 cProfile 下处理请求并保存结果，返回响应"""
+    profiler = cProfile.Profile()
+    response = profiler.runcall(_handle, get_response, request)
+    name = view_name(request)
+    saved = save_profile(profiler, name, {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'reason': reason,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+    })
+    response[PROFILE_RESPONSE_HEADER] = saved
+    return response
+
+
+def profiled_views(directory=None):
+    directory = directory or settings.CLINIC_PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name for name in os.listdir(directory)
+        if glob.glob(os.path.join(directory, name, '*.prof'))
+    )
+
+
+def merge_profiles(name, directory=None):
+    """合并一个视图保存的全部剖析结果，返回 (pstats.Stats, 份数)；没有时返回 (None, 0)"""
+    directory = directory or settings.CLINIC_PROFILE_DIR
+    stats, count = None, 0
+    for path in sorted(glob.glob(os.path.join(directory, name, '*.prof'))):
+        try:
+            if stats is None:
+                stats = pstats.Stats(path)
+            else:
+                stats.add(path)
+        except (OSError, EOFError, TypeError):  # 正在被清理或写了一半的文件
+            continue
+        count += 1
+    return stats, count
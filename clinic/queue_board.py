@@ -0,0 +1,222 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections, transaction
+from django.http.cookie import parse_cookie
+from django.utils import timezone
+
+from .models import MedicalRecord
+
+# 内存中保留的最近事件数：断线重连时据此补发，超出范围的改发快照
+HISTORY_SIZE = 1000
+# 没有事件时多久发一次注释行保活（秒），防止代理断开空闲连接
+HEARTBEAT_SECONDS = 15
+# 建议浏览器断线后多久重连（毫秒）；WSGI 部署下也是轮询间隔
+RETRY_MS = 3000
+
+OPENED, CLOSED, PAID = 'opened', 'closed', 'paid'
+
+
+class QueueHub:
+    """
+    进程内的发布/订阅中心：所有事件按自增ID存进一个环形缓冲区，订阅者只记住自己读到的ID。
+    模型信号在任意线程里 publish；同一个事件循环上的订阅者共用一个唤醒标记，
+    每个事件只唤醒一次，不论有多少块屏幕在看。
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=size)
+        self._last_id = 0
+        self._wakeups = {}  # 事件循环 -> asyncio.Event
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, event_type, dept_id, data):
+        with self._lock:
+            self._last_id += 1
+            self._events.append((self._last_id, dept_id, event_type, data))
+            loops = list(self._wakeups)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake, loop)
+            except RuntimeError:  # 事件循环已关闭
+                with self._lock:
+                    self._wakeups.pop(loop, None)
+
+    def _wake(self, loop):
+        with self._lock:
+            wakeup = self._wakeups.pop(loop, None)
+        if wakeup is not None:
+            wakeup.set()
+
+    def since(self, last_id, dept_id=None):
+        """
+        返回 (ID 大于 last_id 的事件, 当前最新ID, 是否完整)。
+        last_id 已滚出缓冲区（或来自重启前的进程）时不完整，调用方应改发快照。
+        """
+        with self._lock:
+            oldest = self._events[0][0] if self._events else self._last_id + 1
+            complete = oldest - 1 <= last_id <= self._last_id
+            events = []
+            # 新事件都在右端，从右往左取到 last_id 为止
+            for event in reversed(self._events):
+                if event[0] <= last_id:
+                    break
+                if dept_id is None or event[1] == dept_id:
+                    events.append(event)
+            events.reverse()
+            return events, self._last_id, complete
+
+    async def wait(self, last_id, timeout):
+        """等到有比 last_id 新的事件或超时"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._last_id > last_id:
+                return
+            wakeup = self._wakeups.get(loop)
+            if wakeup is None:
+                wakeup = self._wakeups[loop] = asyncio.Event()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+hub = QueueHub()
+
+
+def _mask(name):
+    # 候诊屏公开展示，只显示姓
+    return name[:1] + '*' * (len(name) - 1) if name else ''
+
+
+_VISIT_FIELDS = ('record_id', 'doctor__dept_id', 'doctor__name', 'room_id', 'patient__name', 'visit_time')
+
+
+def _visit_data(row):
+    return {
+        'record_id': row['record_id'],
+        'doctor': row['doctor__name'],
+        'room': row['room_id'],
+        'patient': _mask(row['patient__name']),
+        'visit_time': timezone.localtime(row['visit_time']).strftime('%H:%M'),
+    }
+
+
+def _publish_visit(event_type, record_id):
+    row = MedicalRecord.objects.filter(pk=record_id).values(*_VISIT_FIELDS).first()
+    if row is not None:
+        hub.publish(event_type, row['doctor__dept_id'], _visit_data(row))
+
+
+def visit_event(event_type, record_id):
+    """就诊开始/结束/缴费；事务提交后查一次展示所需字段再发布"""
+    transaction.on_commit(lambda: _publish_visit(event_type, record_id))
+
+
+def snapshot(dept_id=None):
+    """当天在诊的就诊记录（走 record_date_status_idx），新连接先收到这份完整列表"""
+    records = MedicalRecord.objects.filter(visit_date=timezone.localdate(), visit_status=0)
+    if dept_id is not None:
+        records = records.filter(doctor__dept_id=dept_id)
+    return [_visit_data(row) for row in records.values(*_VISIT_FIELDS).order_by('visit_time', 'record_id')]
+
+
+def format_event(event_id, event_type, data):
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'.encode()
+
+
+def snapshot_event(event_id, dept_id):
+    return format_event(event_id, 'snapshot', {'visits': snapshot(dept_id)})
+
+
+def parse_id(value):
+    """科室ID、Last-Event-ID 等查询参数，非数字视为未填"""
+    return int(value) if value and value.isdigit() else None
+
+
+# ==================== ASGI 推送端点 ====================
+# Django 3.0 的 ASGI 处理器在事件循环里同步迭代流式响应，长连接会卡住整个进程，
+# 所以推送端点是独立的 ASGI 应用，由 hospital_management/asgi.py 按路径分派。
+# 事件来自本进程的模型信号：部署时前台写入和推送要在同一个 ASGI 进程里。
+
+def _sync(func):
+    def wrapper(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper)
+
+
+def _is_reception(cookie_header):
+    # 与 views.reception_required 的判断一致
+    cookies = parse_cookie(cookie_header)
+    session = import_module(settings.SESSION_ENGINE).SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    user = get_user(SimpleNamespace(session=session))
+    return user.is_authenticated and user.is_staff and not user.is_superuser
+
+
+async def _respond(send, status, body=b''):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_app(scope, receive, send):
+    """GET ?dept=科室ID（不填为全部科室），支持 Last-Event-ID 断线续传；仅前台可访问"""
+    if scope['method'] != 'GET':
+        return await _respond(send, 405)
+    headers = dict(scope['headers'])
+    if not await _sync(_is_reception)(headers.get(b'cookie', b'').decode('latin1')):
+        return await _respond(send, 403)
+    dept_id = parse_id(parse_qs(scope['query_string'].decode()).get('dept', [''])[0])
+    cursor = parse_id(headers.get(b'last-event-id', b'').decode())
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),  # nginx 不缓冲
+    ]})
+    await send({'type': 'http.response.body', 'body': f'retry: {RETRY_MS}\n\n'.encode(), 'more_body': True})
+
+    disconnect = asyncio.ensure_future(_disconnected(receive))
+    try:
+        while True:
+            if cursor is None:
+                events, cursor, complete = [], hub.last_id, False
+            else:
+                events, cursor, complete = hub.since(cursor, dept_id)
+            if not complete:
+                # 快照之后的事件可能与快照重复，页面按 record_id 处理，重复无害
+                body = await _sync(snapshot_event)(cursor, dept_id)
+            else:
+                body = b''.join(
+                    format_event(event_id, event_type, data) for event_id, _, event_type, data in events
+                ) or b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+            waiter = asyncio.ensure_future(hub.wait(cursor, HEARTBEAT_SECONDS))
+            await asyncio.wait({waiter, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                waiter.cancel()
+                return
+    finally:
+        disconnect.cancel()
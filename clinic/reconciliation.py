@@ -0,0 +1,245 @@
+import csv
+import json
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from django.utils import timezone
+
+from .models import Payment
+
+# 结算时间与系统缴费时间允许相差的范围：支付渠道记账时间和收费处落库时间有几秒到几分钟的差
+RECONCILE_WINDOW = timedelta(minutes=10)
+
+RECONCILE_FORMATS = ('csv', 'jsonl')
+
+# 结算文件里的渠道写法 -> 缴费方式
+CHANNELS = {
+    '微信': '微信', 'wechat': '微信', 'weixin': '微信',
+    '支付宝': '支付宝', 'alipay': '支付宝',
+    '医保': '医保', 'insurance': '医保',
+}
+
+# 结算文件的列名（CSV表头或JSONL的键），中英文均可
+FIELDS = {
+    'trade_no': ('trade_no', '交易单号'),
+    'trade_time': ('trade_time', '交易时间'),
+    'amount': ('amount', '金额'),
+    'channel': ('channel', '渠道'),
+}
+
+# 对账结果分类：
+# matched 金额、渠道一致且时间在窗口内；mismatched 窗口内只找到同渠道金额不同的缴费；
+# unmatched 结算文件有、系统里没有；missing 系统里有、结算文件里没有；invalid 行格式错误
+BUCKETS = ('matched', 'mismatched', 'unmatched', 'missing', 'invalid')
+
+REPORT_HEADERS = (
+    'bucket', 'channel', 'source', 'trade_no', 'trade_time', 'settled_amount',
+    'pay_id', 'pay_time', 'recorded_amount', 'note',
+)
+
+# 结算文件的一行；source 为“文件名:行号”，便于财务回查原文件
+SettlementLine = namedtuple('SettlementLine', 'source channel trade_no trade_time timestamp amount cents')
+
+# 索引里的一笔待核对金额：同一笔缴费的自费部分和医保部分分属不同渠道，各是一项
+Entry = namedtuple('Entry', 'timestamp pay_id cents amount pay_time pay_date')
+
+
+class SettlementError(ValueError):
+    """结算文件的一行无法解析，message 写入报告的 note 列"""
+
+
+def _cents(amount):
+    return int((amount * 100).to_integral_value())
+
+
+@lru_cache(maxsize=64)
+def _hour_timestamp(hour):
+    return timezone.make_aware(hour).timestamp()
+
+
+def _timestamp(moment):
+    """
+    时间换算成时间戳。不带时区的按本地时间：每个整点只换算一次时区，
+    百万行的文件逐行调用 make_aware 比读文件和匹配加起来还慢。
+    """
+    if timezone.is_aware(moment):
+        return moment.timestamp()
+    hour = moment.replace(minute=0, second=0, microsecond=0)
+    return _hour_timestamp(hour) + (moment - hour).total_seconds()
+
+
+def _field(record, name):
+    for key in FIELDS[name]:
+        value = record.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def parse_line(record, source, default_channel=None):
+    """把结算文件的一行（dict）转成 SettlementLine，格式不对时抛出 SettlementError"""
+    channel = _field(record, 'channel') or default_channel
+    if channel is None:
+        raise SettlementError('缺少渠道')
+    method = CHANNELS.get(str(channel).strip().lower())
+    if method is None:
+        raise SettlementError(f'未知渠道：{channel}')
+
+    trade_time = _field(record, 'trade_time')
+    try:
+        moment = datetime.fromisoformat(str(trade_time).strip())
+    except ValueError:
+        raise SettlementError(f'交易时间格式错误：{trade_time}')
+
+    value = _field(record, 'amount')
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise SettlementError(f'金额格式错误：{value}')
+    if not amount.is_finite() or amount < 0:
+        raise SettlementError(f'金额格式错误：{value}')
+
+    return SettlementLine(
+        source, method, _field(record, 'trade_no') or '', trade_time, _timestamp(moment), amount, _cents(amount)
+    )
+
+
+def read_settlement(f, fmt='csv', name='', channel=None):
+    """
+    逐行读取结算文件，生成 SettlementLine；解析失败的行生成 (来源, 原因)。
+    只持有当前一行，文件再大内存占用也不变。channel 为文件没有渠道列时的默认渠道。
+    """
+    if fmt == 'jsonl':
+        for lineno, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            source = f'{name}:{lineno}'
+            try:
+                record = json.loads(text)
+                if not isinstance(record, dict):
+                    raise SettlementError('不是JSON对象')
+                yield parse_line(record, source, channel)
+            except (ValueError, SettlementError) as e:
+                yield source, str(e)
+        return
+
+    reader = csv.DictReader(f)
+    for record in reader:
+        source = f'{name}:{reader.line_num}'
+        try:
+            yield parse_line(record, source, channel)
+        except SettlementError as e:
+            yield source, str(e)
+
+
+def settlement_format(path, fmt=None):
+    """未指定格式时按扩展名判断：.jsonl/.json 为 JSONL，其余按CSV"""
+    if fmt:
+        return fmt
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+class PaymentIndex:
+    """
+    结算日前后各一天的缴费按渠道建的内存索引，每次对账只查一次库。
+    (渠道, 金额分) 下按时间排序，结算行二分定位时间窗口，金额一致的候选通常只有几笔；
+    渠道下另有一份全量时间序，找不到金额一致的缴费时用来发现金额不符。
+    """
+
+    def __init__(self, day, window=RECONCILE_WINDOW):
+        self.day = day
+        self.window = window.total_seconds()
+        self._by_amount = {}   # (渠道, 金额分) -> ([时间戳], [Entry])
+        self._by_channel = {}  # 渠道 -> ([时间戳], [Entry])
+        self._claimed = set()  # 已被结算行认领的 (渠道, pay_id)
+
+    def add(self, channel, entry):
+        for groups, key in ((self._by_amount, (channel, entry.cents)), (self._by_channel, channel)):
+            timestamps, entries = groups.setdefault(key, ([], []))
+            timestamps.append(entry.timestamp)
+            entries.append(entry)
+
+    def load(self):
+        # pay_date 走索引；前后各带一天，跨零点的结算行也能匹配到
+        rows = Payment.objects.filter(
+            pay_date__gte=self.day - timedelta(days=1), pay_date__lte=self.day + timedelta(days=1)
+        ).order_by('pay_time').values_list('pay_id', 'pay_time', 'pay_method', 'self_pay', 'medical_insurance')
+        for pay_id, pay_time, method, self_pay, insurance in rows.iterator():
+            timestamp = pay_time.timestamp()
+            local = timezone.localtime(pay_time)
+            shown, pay_date = local.strftime('%Y-%m-%d %H:%M:%S'), local.date()
+            # 微信、支付宝结算的是自费部分，医保局结算的是医保部分（不论自费部分怎么付的）
+            if method in ('微信', '支付宝') and self_pay > 0:
+                self.add(method, Entry(timestamp, pay_id, _cents(self_pay), self_pay, shown, pay_date))
+            if insurance > 0:
+                self.add('医保', Entry(timestamp, pay_id, _cents(insurance), insurance, shown, pay_date))
+        return self
+
+    def _nearest(self, group, channel, timestamp):
+        if group is None:
+            return None
+        timestamps, entries = group
+        best = None
+        for i in range(bisect_left(timestamps, timestamp - self.window), bisect_right(timestamps, timestamp + self.window)):
+            entry = entries[i]
+            if (channel, entry.pay_id) in self._claimed:
+                continue
+            if best is None or abs(entry.timestamp - timestamp) < abs(best.timestamp - timestamp):
+                best = entry
+        return best
+
+    def claim(self, line):
+        """
+        为结算行认领一笔缴费：优先时间最近的金额一致者（matched），其次时间最近的同渠道缴费（mismatched）。
+        返回 (分类, Entry)，都没有时返回 ('unmatched', None)。按文件顺序贪心认领，一笔缴费只认领一次。
+        """
+        entry = self._nearest(self._by_amount.get((line.channel, line.cents)), line.channel, line.timestamp)
+        bucket = 'matched'
+        if entry is None:
+            entry = self._nearest(self._by_channel.get(line.channel), line.channel, line.timestamp)
+            bucket = 'mismatched'
+        if entry is None:
+            return 'unmatched', None
+        self._claimed.add((line.channel, entry.pay_id))
+        return bucket, entry
+
+    def unclaimed(self, channel):
+        """结算日当天、该渠道没有被任何结算行认领的缴费"""
+        for entry in self._by_channel.get(channel, ((), ()))[1]:
+            if entry.pay_date == self.day and (channel, entry.pay_id) not in self._claimed:
+                yield entry
+
+
+def reconcile(lines, index, counts=None, channels=()):
+    """
+    逐行核对结算文件，边读边生成报告行（与 REPORT_HEADERS 对应），最后补上文件里缺失的缴费。
+    counts 传入 Counter 时按分类累计行数。channels 为无论文件里是否出现都要核对缺失的渠道。
+    """
+    counts = counts if counts is not None else Counter()
+    seen = set(channels)
+    for line in lines:
+        if not isinstance(line, SettlementLine):
+            source, note = line
+            counts['invalid'] += 1
+            yield ('invalid', '', source, '', '', '', '', '', '', note)
+            continue
+        seen.add(line.channel)
+        bucket, entry = index.claim(line)
+        counts[bucket] += 1
+        if entry is None:
+            yield (bucket, line.channel, line.source, line.trade_no, line.trade_time, line.amount, '', '', '', '')
+            continue
+        note = '' if bucket == 'matched' else f'差额 {line.amount - entry.amount}'
+        yield (
+            bucket, line.channel, line.source, line.trade_no, line.trade_time, line.amount,
+            entry.pay_id, entry.pay_time, entry.amount, note,
+        )
+
+    # 只核对本次文件涉及的渠道：只拿到微信的结算文件时，支付宝的缴费不算缺失
+    for channel in sorted(seen):
+        for entry in index.unclaimed(channel):
+            counts['missing'] += 1
+            yield ('missing', channel, '', '', '', '', entry.pay_id, entry.pay_time, entry.amount, '结算文件中没有')
@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = 'replica'
+# session 中记录用户最近一次写操作的时间，副本同步到这之后才给该用户读副本
+LAST_WRITE_SESSION_KEY = '_clinic_last_write'
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+_use_replica = ContextVar('clinic_use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def marker_path(path):
+    """同步完成标记文件，文件修改时间就是副本的同步时间"""
+    return f'{path}.synced'
+
+
+def replica_synced_at():
+    try:
+        return os.stat(marker_path(settings.CLINIC_REPLICA_PATH)).st_mtime
+    except OSError:
+        return None
+
+
+def replica_available(not_before=None):
+    """
+    副本可用：已配置且同步过、延迟不超过 CLINIC_REPLICA_MAX_LAG 秒，
+    并且同步时间不早于 not_before（用户最近一次写入的时间）。
+    """
+    if not replica_configured():
+        return False
+    synced_at = replica_synced_at()
+    if synced_at is None or time.time() - synced_at > settings.CLINIC_REPLICA_MAX_LAG:
+        return False
+    if not_before and synced_at < not_before:
+        return False
+    # 同步是整个文件替换，已打开的连接还指向旧文件，重新同步后要重连
+    connection = connections[REPLICA_ALIAS]
+    if getattr(connection, 'clinic_synced_at', None) != synced_at:
+        connection.close()
+        connection.clinic_synced_at = synced_at
+    return True
+
+
+@contextmanager
+def use_replica(not_before=None):
+    """with 块内的读查询走副本；副本不可用时仍走主库，写操作始终走主库"""
+    token = _use_replica.set(replica_available(not_before))
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def _iter_on_replica(iterable, enabled):
+    # 流式响应在视图返回后才逐块生成，每取一块都要重新进入副本上下文
+    iterator = iter(iterable)
+    while True:
+        token = _use_replica.set(enabled)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _use_replica.reset(token)
+        yield chunk
+
+
+def call_on_replica(request, func, *args, **kwargs):
+    """在副本上执行只读视图；延迟渲染的模板响应和流式响应也在副本上完成"""
+    last_write = request.session.get(LAST_WRITE_SESSION_KEY) if hasattr(request, 'session') else None
+    with use_replica(not_before=last_write):
+        response = func(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        enabled = _use_replica.get()
+    if response.streaming and enabled:
+        response.streaming_content = _iter_on_replica(response.streaming_content, enabled)
+    return response
+
+
+def replica_reads(view_func):
+    """只读报表视图：GET 请求读副本，其余请求照常"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return view_func(request, *args, **kwargs)
+        return call_on_replica(request, view_func, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """读查询在 use_replica() 内才走副本，其余一律主库"""
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 副本是主库的整库拷贝，两边的对象可以互相关联
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # 副本的表结构随同步从主库拷贝过来
+        return db != REPLICA_ALIAS
+
+
+def sync(source, target):
+    """
+    用 SQLite 在线备份接口把主库拷贝到副本：先写临时文件再整体替换，读副本的请求不会读到半成品。
+    一次性拷贝所有页（一个读事务）：WAL 模式下不阻塞主库写入，也不会因主库有写入而重新开始。
+    标记文件的时间记为开始拷贝的时间：拷贝期间主库的写入不在快照里，这些用户仍读主库。
+    """
+    tmp = f'{target}.tmp'
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(tmp)
+    try:
+        started = time.time()
+        src.backup(dst)
+        # 副本只读，用回滚日志模式，不留 -wal/-shm 文件
+        dst.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp, target)
+    marker = marker_path(target)
+    with open(marker, 'w') as f:
+        f.write(str(started))
+    os.utime(marker, (started, started))
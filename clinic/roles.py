@@ -0,0 +1,131 @@
+import time
+
+from django.core.cache import cache
+
+from .models import Doctor, Patient
+
+ROLE_ADMIN = 'admin'
+ROLE_DOCTOR = 'doctor'
+ROLE_RECEPTION = 'reception'
+ROLE_PATIENT = 'patient'
+
+DOCTOR_GROUP = '医生'
+
+# session 中缓存角色信息的键
+ROLE_SESSION_KEY = '_clinic_role'
+# 角色信息最长缓存时间（秒）：即使漏掉失效通知，过期后也会重新解析
+ROLE_MAX_AGE = 300
+
+
+class Role:
+    """登录用户的角色，以及关联的患者/医生ID"""
+
+    def __init__(self, role=None, patient_id=None, doctor_id=None):
+        self.role = role
+        self.patient_id = patient_id
+        self.doctor_id = doctor_id
+
+    @property
+    def is_admin(self):
+        return self.role == ROLE_ADMIN
+
+    @property
+    def is_doctor(self):
+        return self.role == ROLE_DOCTOR
+
+    @property
+    def is_reception(self):
+        return self.role == ROLE_RECEPTION
+
+    @property
+    def is_patient(self):
+        return self.role == ROLE_PATIENT
+
+    def home_url_name(self):
+        """该角色登录后的首页路由名；患者未完善信息时为信息完善页"""
+        if self.is_admin:
+            return 'admin_dashboard'
+        if self.is_doctor:
+            return 'doctor_dashboard'
+        if self.is_reception:
+            return 'reception_dashboard'
+        if self.patient_id:
+            return 'patient_dashboard'
+        return 'patient_profile'
+
+
+ANONYMOUS = Role()
+
+
+# 页面装饰器和 JSON API 共用的权限判断：前台页面对医生也开放（医生同属员工），不含超级管理员
+def is_reception_user(user):
+    return user.is_authenticated and user.is_staff and not user.is_superuser
+
+
+def is_admin_user(user):
+    return user.is_authenticated and user.is_superuser
+
+
+def _version_key(user_id):
+    return f'clinic:role_version:{user_id}'
+
+
+def role_version(user_id):
+    """用户角色版本号，缓存里没有时生成一个新的"""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_role(user_id):
+    """用户组、超级管理员/员工标记、患者/医生档案变化时调用，让所有会话重新解析角色"""
+    cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def resolve_role(user):
+    """查询数据库确定用户角色（只在缓存失效时调用）"""
+    if user.is_superuser:
+        return Role(ROLE_ADMIN)
+    if user.is_staff:
+        doctor_id = Doctor.objects.filter(user=user).values_list('id', flat=True).first()
+        if user.groups.filter(name=DOCTOR_GROUP).exists():
+            return Role(ROLE_DOCTOR, doctor_id=doctor_id)
+        # 不在医生组的员工（含前台组、未分组）按前台处理
+        return Role(ROLE_RECEPTION, doctor_id=doctor_id)
+    patient_id = Patient.objects.filter(user=user).values_list('patient_id', flat=True).first()
+    return Role(ROLE_PATIENT, patient_id=patient_id)
+
+
+def get_role(request):
+    """
+    当前请求用户的角色：优先读 session 中的缓存，版本号一致且未过期时不查数据库。
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return ANONYMOUS
+
+    version = role_version(user.pk)
+    cached = request.session.get(ROLE_SESSION_KEY)
+    if (
+        cached
+        and cached['user_id'] == user.pk
+        and cached['version'] == version
+        and time.time() - cached['resolved_at'] < ROLE_MAX_AGE
+        # 未完善信息的患者随时可能补全档案，每次都重新确认
+        and not (cached['role'] == ROLE_PATIENT and cached['patient_id'] is None)
+    ):
+        return Role(cached['role'], cached['patient_id'], cached['doctor_id'])
+
+    role = resolve_role(user)
+    request.session[ROLE_SESSION_KEY] = {
+        'user_id': user.pk,
+        'version': version,
+        'resolved_at': time.time(),
+        'role': role.role,
+        'patient_id': role.patient_id,
+        'doctor_id': role.doctor_id,
+    }
+    return role
@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from .models import DeptDailyStat, Doctor, DoctorDailyStat, MedicalRecordHistory, PaymentHistory
+
+ZERO = Decimal('0')
+CENT = Decimal('0.01')
+
+
+def money(value):
+    """金额统一转成两位小数的Decimal（视图里可能传入float）"""
+    return Decimal(str(value)).quantize(CENT)
+
+
+def _bump(model, lookup, create=True, **deltas):
+    """
+    对 lookup 定位的统计行做增量更新（UPDATE ... SET x = x + delta），
+    行不存在且 create=True 时先创建；并发下创建冲突就回退为更新。
+    撤销（减量）时不创建新行：级联删除时统计行可能已被删掉，不能再插回去。
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**updates) or not create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        model.objects.filter(**lookup).update(**updates)
+
+
+def add_visit(visit_date, doctor_id, dept_id, delta=1):
+    """就诊人次计入 (日期, 科室) 与 (日期, 医生)；delta=-1 表示撤销"""
+    create = delta > 0
+    if dept_id is not None:
+        _bump(DeptDailyStat, {'stat_date': visit_date, 'dept_id': dept_id}, create, visit_count=delta)
+    if doctor_id is not None:
+        _bump(DoctorDailyStat, {'stat_date': visit_date, 'doctor_id': doctor_id}, create, visit_count=delta)
+
+
+def add_payment(pay_date, doctor_id, total, insurance, self_pay, count=1):
+    """缴费金额计入 (日期, 医生)；撤销时传负数"""
+    if doctor_id is None:
+        return
+    _bump(
+        DoctorDailyStat, {'stat_date': pay_date, 'doctor_id': doctor_id}, count > 0,
+        payment_count=count,
+        total_amount=money(total),
+        medical_insurance=money(insurance),
+        self_pay=money(self_pay)
+    )
+
+
+def doctor_dept_id(doctor_id):
+    """医生当前所属科室，医生已删除时返回None"""
+    return Doctor.objects.filter(pk=doctor_id).values_list('dept_id', flat=True).first()
+
+
+def rebuild(start=None, end=None):
+    """
+    按原始就诊/缴费记录重算 [start, end] 日期范围内的统计（日期为空表示不限），
+    用于历史数据回填或修正。返回重算的 (科室行数, 医生行数)。
+    读取热表 + 归档表的历史视图，已归档的日期重算后不会变成0。
+    """
+    dept_stats = DeptDailyStat.objects.all()
+    doctor_stats = DoctorDailyStat.objects.all()
+    records = MedicalRecordHistory.objects.all()
+    payments = PaymentHistory.objects.all()
+    if start:
+        dept_stats = dept_stats.filter(stat_date__gte=start)
+        doctor_stats = doctor_stats.filter(stat_date__gte=start)
+        records = records.filter(visit_date__gte=start)
+        payments = payments.filter(pay_date__gte=start)
+    if end:
+        dept_stats = dept_stats.filter(stat_date__lte=end)
+        doctor_stats = doctor_stats.filter(stat_date__lte=end)
+        records = records.filter(visit_date__lte=end)
+        payments = payments.filter(pay_date__lte=end)
+
+    dept_rows = records.values('visit_date', 'doctor__dept_id').annotate(visits=Count('pk'))
+    doctor_rows = {}
+    for row in records.values('visit_date', 'doctor_id').annotate(visits=Count('pk')):
+        doctor_rows[(row['visit_date'], row['doctor_id'])] = DoctorDailyStat(
+            stat_date=row['visit_date'], doctor_id=row['doctor_id'], visit_count=row['visits']
+        )
+    payment_rows = payments.values('pay_date', 'doctor_id').annotate(
+        payments=Count('pk'),
+        total=Sum('total_amount'),
+        insurance=Sum('medical_insurance'),
+        self_paid=Sum('self_pay')
+    )
+    for row in payment_rows:
+        key = (row['pay_date'], row['doctor_id'])
+        stat = doctor_rows.setdefault(key, DoctorDailyStat(stat_date=key[0], doctor_id=key[1]))
+        stat.payment_count = row['payments']
+        stat.total_amount = row['total'] or ZERO
+        stat.medical_insurance = row['insurance'] or ZERO
+        stat.self_pay = row['self_paid'] or ZERO
+
+    with transaction.atomic():
+        dept_stats.delete()
+        doctor_stats.delete()
+        dept_objs = DeptDailyStat.objects.bulk_create([
+            DeptDailyStat(stat_date=row['visit_date'], dept_id=row['doctor__dept_id'], visit_count=row['visits'])
+            for row in dept_rows
+        ], batch_size=500)
+        doctor_objs = DoctorDailyStat.objects.bulk_create(doctor_rows.values(), batch_size=500)
+    return len(dept_objs), len(doctor_objs)
+
+
+def dept_visit_stats(start, end):
+    """日期范围内各科室就诊人次及占比（读取预聚合行，代价只与天数×科室数有关）"""
+    rows = list(
+        DeptDailyStat.objects.filter(stat_date__gte=start, stat_date__lte=end)
+        .values('dept_id', 'dept__dept_name')
+        .annotate(count=Sum('visit_count'))
+        .filter(count__gt=0)
+        .order_by('-count')
+    )
+    total = sum(row['count'] for row in rows)
+    for row in rows:
+        row['dept_name'] = row.pop('dept__dept_name')
+        row['percent'] = round(row['count'] * 100 / total) if total else 0
+    return rows, total
+
+
+def doctor_payment_stats(start, end):
+    """日期范围内各医生的缴费汇总"""
+    rows = (
+        DoctorDailyStat.objects.filter(stat_date__gte=start, stat_date__lte=end)
+        .values('doctor_id', 'doctor__name')
+        .annotate(
+            total=Sum('total_amount'),
+            medical_insurance=Sum('medical_insurance'),
+            self_pay=Sum('self_pay'),
+            payments=Sum('payment_count')
+        )
+        .filter(payments__gt=0)
+        .order_by('-total')
+    )
+    return [
+        {
+            'doctor_name': row['doctor__name'],
+            'total': row['total'],
+            'medical_insurance': row['medical_insurance'],
+            'self_pay': row['self_pay'],
+        }
+        for row in rows
+    ]
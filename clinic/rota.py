@@ -0,0 +1,209 @@
+import re
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+
+from django.db import connection, transaction
+
+from . import assignment, availability
+from .models import ClinicRoom, Doctor, Schedule, parse_time_slot
+from .transactions import retry_locked
+
+WEEKDAY_NAMES = '一二三四五六日'
+# 无法解析的时间段（如“全天”）按整天占用，与 Schedule.covers 一致
+WHOLE_DAY = (0, 24 * 60)
+# 一次发布最多覆盖的天数，防止误填年份生成海量排班
+MAX_ROLLOUT_DAYS = 366
+
+# 周模板的一行：星期几（0=周一）由哪位医生在哪个诊室接诊哪个时间段
+TemplateEntry = namedtuple('TemplateEntry', 'doctor_id room_id weekday time_slot capacity status')
+
+# 一条排班：待发布的 schedule_id 为None；已有排班只取冲突检查用到的列，号源和状态为None。
+# 用元组而不是模型对象：一个季度的排班有上万条，构造模型实例和 ORM 编译 INSERT 的开销比检查冲突本身还大
+Shift = namedtuple('Shift', 'schedule_id doctor_id room_id schedule_date time_slot capacity status', defaults=(None, None))
+
+# 冲突：待发布的排班，冲突类型（doctor/room），与之冲突的排班（已有的或本次先排上的）
+Clash = namedtuple('Clash', 'schedule kind other')
+
+_INSERT_SQL = (
+    'INSERT INTO clinic_schedule (doctor_id, room_id, schedule_date, time_slot, capacity, status, booked_count) '
+    'VALUES (%s, %s, %s, %s, %s, %s, 0)'
+)
+
+_LINE_SPLIT_RE = re.compile(r'[,，\s]+')
+
+
+class RotaError(Exception):
+    """排班模板或日期范围有误，message 直接展示给管理员"""
+
+
+@lru_cache(maxsize=256)
+def slot_interval(time_slot):
+    return parse_time_slot(time_slot) or WHOLE_DAY
+
+
+def parse_template(text, default_capacity=None):
+    """
+    解析周模板文本，每行：医生ID 诊室编号 星期(1-7) 时间段 [号源数量]，逗号或空白分隔，# 开头为注释。
+    医生、诊室一次查询核对是否存在；任一行有误时抛出 RotaError（带行号）。
+    """
+    if default_capacity is None:
+        default_capacity = Schedule._meta.get_field('capacity').default
+    entries, errors = [], []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = _LINE_SPLIT_RE.split(line)
+        if len(parts) not in (4, 5) or not parts[0].isdigit() or len(parts[2]) != 1 or parts[2] not in '1234567':
+            errors.append(f'第{lineno}行格式错误：{line}')
+            continue
+        if len(parts) == 5 and not (parts[4].isdigit() and int(parts[4]) > 0):
+            errors.append(f'第{lineno}行号源数量必须为正整数：{line}')
+            continue
+        capacity = int(parts[4]) if len(parts) == 5 else default_capacity
+        entries.append((lineno, TemplateEntry(int(parts[0]), parts[1], int(parts[2]) - 1, parts[3], capacity, 1)))
+
+    doctor_ids = set(Doctor.objects.filter(pk__in={e.doctor_id for _, e in entries}).values_list('pk', flat=True))
+    room_ids = set(ClinicRoom.objects.filter(pk__in={e.room_id for _, e in entries}).values_list('pk', flat=True))
+    for lineno, entry in entries:
+        if entry.doctor_id not in doctor_ids:
+            errors.append(f'第{lineno}行医生ID不存在：{entry.doctor_id}')
+        if entry.room_id not in room_ids:
+            errors.append(f'第{lineno}行诊室不存在：{entry.room_id}')
+    if errors:
+        raise RotaError('；'.join(errors))
+    if not entries:
+        raise RotaError('排班模板为空')
+    return [entry for _, entry in entries]
+
+
+def expand(template, start, end):
+    """按周模板展开 [start, end] 内每一天的待发布排班（Shift）"""
+    if start > end:
+        raise RotaError('开始日期不能晚于结束日期')
+    if (end - start).days >= MAX_ROLLOUT_DAYS:
+        raise RotaError(f'一次最多发布 {MAX_ROLLOUT_DAYS} 天的排班')
+    by_weekday = {}
+    for entry in template:
+        by_weekday.setdefault(entry.weekday, []).append(entry)
+    schedules = []
+    day = start
+    while day <= end:
+        for entry in by_weekday.get(day.weekday(), ()):
+            schedules.append(Shift(
+                None, entry.doctor_id, entry.room_id, day, entry.time_slot, entry.capacity, entry.status
+            ))
+        day += timedelta(days=1)
+    return schedules
+
+
+class IntervalIndex:
+    """
+    按 (医生或诊室, 日期) 分组的时间段索引。组内区间互不重叠、按开始时间有序，
+    新时段只需和插入位置前后两个邻居比较，O(log n) 判断冲突。
+    """
+
+    def __init__(self):
+        self._groups = {}  # 键 -> ([开始分钟], [(开始, 结束, 排班)])
+
+    def clash(self, key, interval):
+        """与 interval 重叠的已收录排班，没有时返回None"""
+        group = self._groups.get(key)
+        if not group:
+            return None
+        starts, items = group
+        i = bisect_left(starts, interval[0])
+        if i < len(items) and items[i][0] < interval[1]:
+            return items[i][2]
+        if i > 0 and items[i - 1][1] > interval[0]:
+            return items[i - 1][2]
+        return None
+
+    def add(self, key, interval, schedule):
+        starts, items = self._groups.setdefault(key, ([], []))
+        start, end = interval
+        i = bisect_left(starts, start)
+        if i > 0 and items[i - 1][1] > start:
+            i -= 1
+        j = i
+        while j < len(items) and items[j][0] < end:
+            j += 1
+        if j > i:
+            # 已有排班本身就重叠（旧数据）时合并成一个区间，保持组内互不重叠；冲突提示用最早的那条
+            start, end, schedule = min(start, items[i][0]), max(end, items[j - 1][1]), items[i][2]
+        starts[i:j] = [start]
+        items[i:j] = [(start, end, schedule)]
+
+
+def find_clashes(schedules, existing):
+    """
+    依次检查待发布的排班：同一医生或同一诊室在同一天的时间段重叠即为冲突。
+    返回 (可发布的排班, 冲突列表)；先检查的排班先占位，后面与它重叠的算冲突。
+    """
+    doctors, rooms = IntervalIndex(), IntervalIndex()
+    for schedule in existing:
+        interval = slot_interval(schedule.time_slot)
+        doctors.add((schedule.doctor_id, schedule.schedule_date), interval, schedule)
+        rooms.add((schedule.room_id, schedule.schedule_date), interval, schedule)
+
+    accepted, clashes = [], []
+    for schedule in schedules:
+        interval = slot_interval(schedule.time_slot)
+        doctor_key = (schedule.doctor_id, schedule.schedule_date)
+        room_key = (schedule.room_id, schedule.schedule_date)
+        other = doctors.clash(doctor_key, interval)
+        if other is not None:
+            clashes.append(Clash(schedule, 'doctor', other))
+            continue
+        other = rooms.clash(room_key, interval)
+        if other is not None:
+            clashes.append(Clash(schedule, 'room', other))
+            continue
+        doctors.add(doctor_key, interval, schedule)
+        rooms.add(room_key, interval, schedule)
+        accepted.append(schedule)
+    return accepted, clashes
+
+
+def _publish(schedules, dry_run):
+    with transaction.atomic():
+        dates = [schedule.schedule_date for schedule in schedules]
+        # 日期范围内已有的排班一次查出；只取冲突检查和提示需要的列
+        existing = Schedule.objects.filter(
+            schedule_date__gte=min(dates), schedule_date__lte=max(dates)
+        ).values_list('schedule_id', 'doctor_id', 'room_id', 'schedule_date', 'time_slot')
+        accepted, clashes = find_clashes(schedules, (Shift(*row) for row in existing))
+        if accepted and not dry_run:
+            adapt = connection.ops.adapt_datefield_value
+            with connection.cursor() as cursor:
+                cursor.executemany(_INSERT_SQL, [
+                    (shift.doctor_id, shift.room_id, adapt(shift.schedule_date), shift.time_slot, shift.capacity, shift.status)
+                    for shift in accepted
+                ])
+            # 直接写入不触发 post_save，手动通知分诊索引和余号表
+            assignment.schedules_changed()
+            availability.schedules_changed()
+        return accepted, clashes
+
+
+def publish(schedules, dry_run=False):
+    """
+    检查冲突并批量写入排班（Shift 列表），返回 (已发布的排班, 冲突列表)；dry_run 只检查不写入。
+    读已有排班和写入在同一个事务里，配合 IMMEDIATE 事务模式不会与并发的排班交错。
+    """
+    if not schedules:
+        return [], []
+    return retry_locked(_publish, schedules, dry_run)
+
+
+def describe_clash(clash):
+    """冲突的中文说明，用于页面和命令行提示"""
+    schedule, other = clash.schedule, clash.other
+    who = f'医生{schedule.doctor_id}' if clash.kind == 'doctor' else f'诊室{schedule.room_id}'
+    existing = '已有排班' if other.schedule_id else '本次模板中的排班'
+    return (
+        f'{schedule.schedule_date}（周{WEEKDAY_NAMES[schedule.schedule_date.weekday()]}）{schedule.time_slot}：'
+        f'{who}与{existing}（医生{other.doctor_id}，诊室{other.room_id}，{other.time_slot}）时间重叠'
+    )
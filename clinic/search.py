@@ -0,0 +1,157 @@
+import re
+import unicodedata
+
+from django.db import connections, router, transaction
+
+from .models import MedicalRecord, MedicalRecordHistory, Patient
+
+# 重建索引时每批写入的行数
+REBUILD_BATCH_SIZE = 5000
+# 搜索默认返回条数；按主键倒序（最新的在前），FTS5 可以边走 rowid 边停，不必算出全部命中
+SEARCH_LIMIT = 50
+
+# 索引名 -> (FTS5 表名, 模型, 索引字段)
+INDEXES = {
+    'patient': ('clinic_patient_fts', Patient, ('name', 'mobile', 'id_card')),
+    'record': ('clinic_record_fts', MedicalRecord, ('symptom', 'prescription')),
+}
+# 重建时读取的数据源与搜索时的默认模型不同的索引：归档的就诊记录也要留在索引里
+REBUILD_SOURCES = {
+    'record': MedicalRecordHistory,
+}
+
+# 数字/英文串的词元最长字符数
+ASCII_GRAM = 8
+# 数字/英文查询的最短长度：一两位数字几乎命中全表，没有检索意义
+MIN_ASCII_QUERY = 3
+
+# 连续的数字/英文，或连续的汉字等其他文字各算一段，标点和空白把文本断开
+_SEGMENT_RE = re.compile(r'[0-9a-z]+|[^\W_0-9a-z]+')
+
+
+def _segments(text):
+    return _SEGMENT_RE.findall(unicodedata.normalize('NFKC', text or '').lower())
+
+
+def _tokens(segment):
+    if segment.isascii():
+        # 手机号、身份证号等：从每一位开始截取最多 ASCII_GRAM 位，任意片段都是某个词元的前缀。
+        # 只有十个数字时二元组的词表太小，每个词元都命中几乎全表，短语查询会很慢
+        return [segment[i:i + ASCII_GRAM] for i in range(len(segment))]
+    # 汉字：二元组，段末再补一个单字，这样每个字都是某个词元的开头，单字查询可以用前缀匹配
+    return [segment[i:i + 2] for i in range(len(segment) - 1)] + [segment[-1]]
+
+
+def grams(text):
+    """
+    把文本切成词元，空格分隔后交给 FTS5 的 unicode61 分词器（它不会切分连续的汉字）。
+    例如“头痛，发热” -> “头痛 痛 发热 热”，“13800” -> “13800 3800 800 00 0”。
+    """
+    return ' '.join(token for segment in _segments(text) for token in _tokens(segment))
+
+
+def _term(segment):
+    if segment.isascii():
+        if len(segment) < MIN_ASCII_QUERY:
+            return None
+        if len(segment) <= ASCII_GRAM:
+            return f'"{segment}"*'
+        size = ASCII_GRAM
+    elif len(segment) == 1:
+        return f'"{segment}"*'
+    else:
+        size = 2
+    # 相邻位置上的词元组成短语，即原文中连续出现（子串匹配）
+    return '"' + ' '.join(segment[i:i + size] for i in range(len(segment) - size + 1)) + '"'
+
+
+def match_expression(query):
+    """把用户输入转成 FTS5 查询，各段之间 AND；没有可搜索的内容时返回None"""
+    terms = [term for term in map(_term, _segments(query)) if term]
+    return ' AND '.join(terms) or None
+
+
+def create_tables(connection):
+    with connection.cursor() as cursor:
+        for table, model, fields in INDEXES.values():
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5('
+                f'{", ".join(fields)}, tokenize="unicode61 remove_diacritics 0")'
+            )
+
+
+def drop_tables(connection):
+    with connection.cursor() as cursor:
+        for table, model, fields in INDEXES.values():
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+def _insert_sql(table, fields):
+    return f'INSERT INTO {table} (rowid, {", ".join(fields)}) VALUES ({", ".join(["%s"] * (len(fields) + 1))})'
+
+
+def index(kind, obj, using='default'):
+    """写入或更新一条记录的索引；在调用方的事务里执行，回滚时一起撤销"""
+    table, model, fields = INDEXES[kind]
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [obj.pk])
+        cursor.execute(_insert_sql(table, fields), [obj.pk] + [grams(getattr(obj, field)) for field in fields])
+
+
+def unindex(kind, pk, using='default'):
+    table, model, fields = INDEXES[kind]
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [pk])
+
+
+def rebuild(kinds=None, batch_size=REBUILD_BATCH_SIZE, using='default'):
+    """
+    从原表全量重建索引（批量导入、数据修复、分词规则修改后使用），返回 {索引名: 行数}。
+    """
+    counts = {}
+    connection = connections[using]
+    for kind in kinds or INDEXES:
+        table, model, fields = INDEXES[kind]
+        model = REBUILD_SOURCES.get(kind, model)
+        sql = _insert_sql(table, fields)
+        count = 0
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table}')
+            rows = model._default_manager.using(using).values_list('pk', *fields).order_by('pk')
+            batch = []
+            for pk, *values in rows.iterator(chunk_size=batch_size):
+                batch.append([pk] + [grams(value) for value in values])
+                if len(batch) >= batch_size:
+                    cursor.executemany(sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+            # 合并成一个段，查询时不必逐段查找
+            cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+        counts[kind] = count
+    return counts
+
+
+def search(kind, query, limit=SEARCH_LIMIT):
+    """全文搜索，返回命中的主键列表（新的在前）；走读库路由，开启只读副本时在副本上查"""
+    table, model, fields = INDEXES[kind]
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    using = router.db_for_read(model)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rowid DESC LIMIT %s',
+            [expression, limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_objects(kind, query, queryset=None, limit=SEARCH_LIMIT):
+    """全文搜索并取出对象，保持搜索结果的顺序"""
+    table, model, fields = INDEXES[kind]
+    ids = search(kind, query, limit)
+    objects = (queryset if queryset is not None else model.objects.all()).in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
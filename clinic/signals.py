@@ -0,0 +1,331 @@
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import assignment, availability, counters, metrics, page_versions, queue_board, rollups, search
+from .models import Appointment, Department, Doctor, MedicalRecord, Patient, Payment, Schedule
+from .roles import invalidate_role
+
+
+# ==================== 统计汇总表增量维护 ====================
+# 新增时直接累加；修改时先在 pre_save 取出旧值，post_save 里撤销旧值再累加新值
+
+def _record_rollup_key(record):
+    return (record.visit_date, record.doctor_id)
+
+
+def _payment_rollup_values(payment):
+    # 创建缴费时一般已带着就诊记录对象，不必再查一次
+    if Payment.record.is_cached(payment):
+        doctor_id = payment.record.doctor_id
+    else:
+        doctor_id = MedicalRecord.objects.filter(pk=payment.record_id).values_list('doctor_id', flat=True).first()
+    return (
+        payment.pay_date, doctor_id,
+        rollups.money(payment.total_amount), rollups.money(payment.medical_insurance), rollups.money(payment.self_pay)
+    )
+
+
+@receiver(pre_save, sender=MedicalRecord)
+def remember_record_rollup(sender, instance, raw=False, **kwargs):
+    instance._rollup_old = None
+    if raw or instance._state.adding:
+        return
+    # 后两项（就诊状态、诊室）供分诊索引使用
+    instance._rollup_old = MedicalRecord.objects.filter(pk=instance.pk).values_list(
+        'visit_date', 'doctor_id', 'doctor__dept_id', 'visit_status', 'room_id'
+    ).first()
+
+
+@receiver(post_save, sender=MedicalRecord)
+def update_record_rollup(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new_date, new_doctor = _record_rollup_key(instance)
+    old = getattr(instance, '_rollup_old', None)
+    if old:
+        old_date, old_doctor, old_dept = old[:3]
+        if (old_date, old_doctor) == (new_date, new_doctor):
+            return
+        rollups.add_visit(old_date, old_doctor, old_dept, delta=-1)
+        if old_doctor != new_doctor:
+            _move_record_payment(instance.pk, old_doctor, new_doctor)
+    elif not created:
+        return
+    rollups.add_visit(new_date, new_doctor, rollups.doctor_dept_id(new_doctor))
+
+
+def _move_record_payment(record_id, old_doctor, new_doctor):
+    """就诊改派医生时，已缴费金额跟着记到新医生名下"""
+    payment = Payment.objects.filter(record_id=record_id).values_list(
+        'pay_date', 'total_amount', 'medical_insurance', 'self_pay'
+    ).first()
+    if not payment:
+        return
+    pay_date, total, insurance, self_pay = payment
+    rollups.add_payment(pay_date, old_doctor, -total, -insurance, -self_pay, count=-1)
+    rollups.add_payment(pay_date, new_doctor, total, insurance, self_pay)
+
+
+@receiver(post_delete, sender=MedicalRecord)
+def remove_record_rollup(sender, instance, **kwargs):
+    visit_date, doctor_id = _record_rollup_key(instance)
+    rollups.add_visit(visit_date, doctor_id, rollups.doctor_dept_id(doctor_id), delta=-1)
+
+
+@receiver(pre_save, sender=Payment)
+def remember_payment_rollup(sender, instance, raw=False, **kwargs):
+    instance._rollup_old = None
+    if raw or instance._state.adding:
+        return
+    instance._rollup_old = Payment.objects.filter(pk=instance.pk).values_list(
+        'pay_date', 'record__doctor_id', 'total_amount', 'medical_insurance', 'self_pay'
+    ).first()
+
+
+@receiver(post_save, sender=Payment)
+def update_payment_rollup(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = _payment_rollup_values(instance)
+    old = getattr(instance, '_rollup_old', None)
+    if old:
+        if old == new:
+            return
+        pay_date, old_doctor, total, insurance, self_pay = old
+        rollups.add_payment(pay_date, old_doctor, -total, -insurance, -self_pay, count=-1)
+    elif not created:
+        return
+    rollups.add_payment(*new)
+
+
+@receiver(post_delete, sender=Payment)
+def remove_payment_rollup(sender, instance, **kwargs):
+    pay_date, doctor_id, total, insurance, self_pay = _payment_rollup_values(instance)
+    rollups.add_payment(pay_date, doctor_id, -total, -insurance, -self_pay, count=-1)
+
+
+# ==================== 角色缓存失效 ====================
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # 登录只会更新 last_login，不影响角色
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    invalidate_role(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_role(instance.pk)
+        return
+    # 从用户组一侧修改成员：group.user_set.add/remove/clear
+    if action in ('post_add', 'post_remove'):
+        user_ids = pk_set
+    elif action == 'pre_clear':
+        user_ids = instance.user_set.values_list('pk', flat=True)
+    else:
+        return
+    for user_id in user_ids:
+        invalidate_role(user_id)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    for user_id in instance.user_set.values_list('pk', flat=True):
+        invalidate_role(user_id)
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Doctor)
+def profile_changed(sender, instance, **kwargs):
+    invalidate_role(instance.user_id)
+
+
+# ==================== 首页计数器 ====================
+# 计数器在缓存里，数据变动后按日期删掉受影响的计数器；旧值沿用上面 pre_save 中取出的 _rollup_old
+
+COUNTER_NAMES = {Patient: 'patients', Doctor: 'doctors', Department: 'depts'}
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Department)
+def count_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.invalidate(COUNTER_NAMES[sender])
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Doctor)
+@receiver(post_delete, sender=Department)
+def count_deleted(sender, instance, **kwargs):
+    counters.invalidate(COUNTER_NAMES[sender])
+
+
+@receiver(post_save, sender=MedicalRecord)
+def count_visit(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_rollup_old', None)
+    if created:
+        counters.invalidate('day_visits', instance.visit_date)
+    elif old and old[0] != instance.visit_date:
+        counters.invalidate('day_visits', old[0])
+        counters.invalidate('day_visits', instance.visit_date)
+
+
+@receiver(post_delete, sender=MedicalRecord)
+def uncount_visit(sender, instance, **kwargs):
+    counters.invalidate('day_visits', instance.visit_date)
+
+
+def _invalidate_payment_counters(pay_date):
+    counters.invalidate('day_payments', pay_date)
+    counters.invalidate('month_payments', counters.month_of(pay_date))
+
+
+@receiver(post_save, sender=Payment)
+def count_payment(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_rollup_old', None)
+    if old:
+        if (old[0], old[2]) == (instance.pay_date, rollups.money(instance.total_amount)):
+            return
+        _invalidate_payment_counters(old[0])
+    elif not created:
+        return
+    _invalidate_payment_counters(instance.pay_date)
+
+
+@receiver(post_delete, sender=Payment)
+def uncount_payment(sender, instance, **kwargs):
+    _invalidate_payment_counters(instance.pay_date)
+
+
+# ==================== 分诊索引 ====================
+# 进程内索引只记当天在诊（visit_status=0）的人数，就诊开始/结束/改派时增量调整
+
+@receiver(post_save, sender=MedicalRecord)
+def track_open_visit(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_rollup_old', None)
+    if old:
+        old_date, old_doctor, _, old_status, old_room = old
+        if (old_date, old_doctor, old_status, old_room) == (
+                instance.visit_date, instance.doctor_id, instance.visit_status, instance.room_id):
+            return
+        if old_status == 0:
+            assignment.visit_changed(old_date, old_doctor, old_room, -1)
+    elif not created:
+        return
+    if instance.visit_status == 0:
+        assignment.visit_changed(instance.visit_date, instance.doctor_id, instance.room_id, 1)
+
+
+@receiver(post_delete, sender=MedicalRecord)
+def untrack_open_visit(sender, instance, **kwargs):
+    if instance.visit_status == 0:
+        assignment.visit_changed(instance.visit_date, instance.doctor_id, instance.room_id, -1)
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+def schedule_changed(sender, raw=False, **kwargs):
+    if not raw:
+        assignment.schedules_changed()
+        availability.schedules_changed()
+
+
+# ==================== 候诊队列推送 ====================
+
+@receiver(post_save, sender=MedicalRecord)
+def publish_visit(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_rollup_old', None)
+    if created and instance.visit_status == 0:
+        queue_board.visit_event(queue_board.OPENED, instance.pk)
+    elif old and old[3] == 0 and instance.visit_status != 0:
+        queue_board.visit_event(queue_board.CLOSED, instance.pk)
+
+
+@receiver(post_save, sender=Payment)
+def publish_payment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        queue_board.visit_event(queue_board.PAID, instance.record_id)
+
+
+# ==================== 全文索引 ====================
+# 与原表写在同一个事务里，回滚时一起撤销；批量写入（bulk_create/update）后用 rebuild_search_index 重建
+
+SEARCH_INDEXES = {Patient: 'patient', MedicalRecord: 'record'}
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=MedicalRecord)
+def update_search_index(sender, instance, raw=False, using='default', update_fields=None, **kwargs):
+    kind = SEARCH_INDEXES[sender]
+    if raw or update_fields is not None and not set(update_fields) & set(search.INDEXES[kind][2]):
+        return
+    search.index(kind, instance, using=using)
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=MedicalRecord)
+def remove_search_index(sender, instance, using='default', **kwargs):
+    search.unindex(SEARCH_INDEXES[sender], instance.pk, using=using)
+
+
+# ==================== 患者页面版本号 ====================
+# 患者首页、预约列表和详情的 ETag 与片段缓存以此为准，见 clinic/page_versions.py
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=MedicalRecord)
+@receiver(post_delete, sender=MedicalRecord)
+def patient_data_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        page_versions.bump_patient(instance.patient_id)
+
+
+@receiver(post_save, sender=Patient)
+def patient_profile_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        page_versions.bump_patient(instance.pk)
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def department_changed(sender, raw=False, **kwargs):
+    # 页面上显示科室名称
+    if not raw:
+        page_versions.bump_all_patients()
+
+
+# ==================== 业务指标 ====================
+# 提交后才计数；bulk_create 等批量写入不触发信号，不计入
+
+@receiver(post_save, sender=Appointment)
+def count_booking(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        metrics.BOOKINGS.inc_on_commit()
+
+
+@receiver(post_save, sender=MedicalRecord)
+def count_checkin(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.appointment_id:
+        metrics.CHECKINS.inc_on_commit()
+
+
+@receiver(post_save, sender=Payment)
+def count_payment_metric(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        metrics.PAYMENTS.inc_on_commit(method=instance.pay_method)
+        metrics.PAYMENT_AMOUNT.inc_on_commit(float(instance.total_amount), method=instance.pay_method)
@@ -0,0 +1,301 @@
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import rollups, search
+from .models import (
+    Department, ClinicRoom, Doctor, Patient,
+    Schedule, Appointment, MedicalRecord, Payment,
+    ArchivedAppointment, ArchivedMedicalRecord, ArchivedPayment,
+    DeptDailyStat, DoctorDailyStat
+)
+from .roles import DOCTOR_GROUP
+
+# 批量生成的账号都以此为前缀，清理时只删这些账号
+SYNTHETIC_PREFIX = 'sim_'
+SYNTHETIC_PASSWORD = '123456'
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦方白邹孟熊秦邱江尹薛段雷侯龙史陶黎贺顾毛郝龚邵万钱严武戴莫孔汤'
+GIVEN_NAMES = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超兰霞平刚华玉萍红玲芬燕彬鑫浩宇轩然博文欣怡涵梓睿思雨佳琪晨阳'
+
+DEPARTMENTS = [
+    ('内科', '普通内科诊疗，涵盖呼吸、消化、心血管内科常见疾病'),
+    ('外科', '普通外科诊疗，涵盖骨科、普外科、泌尿外科常见疾病'),
+    ('儿科', '儿童常见疾病诊疗，0-14岁儿童内科/外科基础诊疗'),
+    ('妇产科', '妇科常见病、产前检查与产后复查'),
+    ('眼科', '屈光不正、结膜炎、白内障等眼部疾病诊疗'),
+    ('耳鼻喉科', '鼻炎、咽喉炎、中耳炎等耳鼻咽喉疾病诊疗'),
+    ('口腔科', '龋齿、牙周病诊疗及口腔检查'),
+    ('皮肤科', '湿疹、皮炎、痤疮等常见皮肤病诊疗'),
+    ('骨科', '骨折、关节及脊柱疾病诊疗'),
+    ('神经内科', '头痛、眩晕、失眠等神经系统疾病诊疗'),
+    ('中医科', '中医内科调理、针灸推拿'),
+    ('急诊科', '急症初诊与分诊'),
+]
+TITLES = ['医师', '主治医师', '副主任医师', '主任医师']
+# (时间段文本, 开始分钟, 结束分钟)
+TIME_SLOTS = [
+    ('上午（8:00-12:00）', 8 * 60, 12 * 60),
+    ('下午（14:00-18:00）', 14 * 60, 18 * 60),
+]
+CASES = [
+    ('咳嗽、发烧3天', '布洛芬缓释胶囊 1粒/次，3次/日；阿莫西林胶囊 2粒/次，2次/日'),
+    ('腹痛、腹泻1天，无发热', '蒙脱石散 1袋/次，3次/日；口服补液盐 500ml/日'),
+    ('咽痛、鼻塞2天', '连花清瘟胶囊 4粒/次，3次/日'),
+    ('头痛、失眠1周', '谷维素片 2片/次，3次/日'),
+    ('皮肤瘙痒、红疹', '氯雷他定片 1片/次，1次/日；炉甘石洗剂 外用'),
+    ('腰背酸痛半月', '双氯芬酸钠缓释片 1片/次，1次/日'),
+    ('复查', '继续原方案治疗'),
+]
+PAY_METHODS = ['现金', '微信', '支付宝']
+INSURANCE_RATIOS = [Decimal('0'), Decimal('0.3'), Decimal('0.5'), Decimal('0.7'), Decimal('1')]
+
+# 按外键依赖顺序写入：父表在前
+WRITE_ORDER = [User, User.groups.through, ClinicRoom, Doctor, Patient, Schedule, Appointment, MedicalRecord, Payment]
+# 清理顺序：子表在前；归档表引用患者、医生，也要先清
+CLEAR_ORDER = [
+    ArchivedPayment, ArchivedMedicalRecord, ArchivedAppointment,
+    Payment, MedicalRecord, Appointment, Schedule, DoctorDailyStat, DeptDailyStat,
+    Doctor, Patient, ClinicRoom, Department,
+]
+
+
+@contextmanager
+def keep_timestamps():
+    """
+    临时关闭 auto_now_add，让批量写入保留生成的历史时间（预约/就诊/缴费时间）。
+    LocalDateField 仍会从这些时间换算出日期字段。
+    """
+    fields = [
+        Appointment._meta.get_field('appt_time'),
+        MedicalRecord._meta.get_field('visit_time'),
+        Payment._meta.get_field('pay_time'),
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class BatchWriter:
+    """缓存待写入的对象，攒满 batch_size 条后在一个事务里按依赖顺序 bulk_create"""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.rows = {model: [] for model in WRITE_ORDER}
+        self.counts = {model: 0 for model in WRITE_ORDER}
+
+    def add(self, obj):
+        rows = self.rows[type(obj)]
+        rows.append(obj)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with transaction.atomic():
+            for model, rows in self.rows.items():
+                if rows:
+                    # 单条 INSERT 的行数交给数据库后端决定（SQLite 有变量个数上限）
+                    model.objects.bulk_create(rows)
+                    self.counts[model] += len(rows)
+                    rows.clear()
+
+
+def next_id(model):
+    """批量写入时自己分配主键（SQLite 的 bulk_create 拿不回自增ID）"""
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def clear_all():
+    """
+    直接 DELETE 清空门诊数据和批量生成的账号。
+    百万级数据走 ORM 的 delete() 会逐行触发信号，太慢；统计表最后会整体重算。
+    """
+    quote = connection.ops.quote_name
+    users = User.objects.filter(username__startswith=SYNTHETIC_PREFIX).values('pk')
+    users_sql, params = users.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in CLEAR_ORDER:
+            cursor.execute(f'DELETE FROM {quote(model._meta.db_table)}')
+        user_groups = User.groups.through._meta.db_table
+        cursor.execute(f'DELETE FROM {quote(user_groups)} WHERE user_id IN ({users_sql})', params)
+        cursor.execute(f'DELETE FROM {quote(User._meta.db_table)} WHERE id IN ({users_sql})', params)
+
+
+class Generator:
+    """
+    生成接近真实规模的门诊数据：科室、医生、诊室、患者，
+    以及最近 days 天的排班/预约/就诊/缴费和未来 ahead 天的排班与待就诊预约。
+    相同 seed 生成相同的数据。
+    """
+
+    def __init__(self, patients, days, ahead=7, doctors_per_dept=10, batch_size=5000, seed=0, log=None):
+        self.patient_count = patients
+        self.days = days
+        self.ahead = ahead
+        self.doctors_per_dept = doctors_per_dept
+        self.rng = random.Random(seed)
+        self.writer = BatchWriter(batch_size)
+        self.log = log or (lambda message: None)
+        # 所有批量账号共用一个密码哈希，省去每个用户一次的 PBKDF2 计算
+        self.password = make_password(SYNTHETIC_PASSWORD)
+        self.next_user_id = next_id(User)
+
+    def run(self):
+        with keep_timestamps():
+            self.create_departments()
+            self.create_doctors()
+            self.create_patients()
+            self.create_visits()
+        self.log('正在重算统计汇总...')
+        rollups.rebuild()
+        # 批量写入不触发信号，全文索引整体重建
+        self.log('正在重建全文索引...')
+        search.rebuild()
+        return {model._meta.verbose_name: count for model, count in self.writer.counts.items()
+                if model in (Doctor, Patient, Schedule, Appointment, MedicalRecord, Payment)}
+
+    def name(self):
+        rng = self.rng
+        return rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_NAMES) for _ in range(rng.randint(1, 2)))
+
+    def mobile(self):
+        return f'1{self.rng.choice("3456789")}{self.rng.randrange(10 ** 9):09d}'
+
+    def user(self, username, is_staff=False):
+        user = User(
+            id=self.next_user_id, username=SYNTHETIC_PREFIX + username,
+            password=self.password, is_staff=is_staff
+        )
+        self.next_user_id += 1
+        self.writer.add(user)
+        return user
+
+    def create_departments(self):
+        self.depts = [
+            Department.objects.get_or_create(dept_name=name, defaults={'dept_desc': desc})[0]
+            for name, desc in DEPARTMENTS
+        ]
+
+    def create_doctors(self):
+        self.log('正在创建医生...')
+        group, _ = Group.objects.get_or_create(name=DOCTOR_GROUP)
+        doctor_id = next_id(Doctor)
+        # (doctor_id, dept_id, room_id)
+        self.doctors = []
+        for floor, dept in enumerate(self.depts, start=1):
+            for n in range(1, self.doctors_per_dept + 1):
+                room_id = f'S{dept.pk}-{n}'
+                self.writer.add(ClinicRoom(room_id=room_id, dept=dept, location=f'{floor}楼{n:02d}诊室'))
+                user = self.user(f'doc{len(self.doctors)}', is_staff=True)
+                self.writer.add(User.groups.through(user_id=user.id, group_id=group.pk))
+                self.writer.add(Doctor(
+                    id=doctor_id, user_id=user.id, name=self.name(), dept=dept,
+                    title=self.rng.choice(TITLES), mobile=self.mobile()
+                ))
+                self.doctors.append((doctor_id, dept.pk, room_id))
+                doctor_id += 1
+        self.writer.flush()
+
+    def create_patients(self):
+        self.log(f'正在创建 {self.patient_count} 名患者...')
+        rng = self.rng
+        self.first_patient_id = next_id(Patient)
+        for i in range(self.patient_count):
+            patient_id = self.first_patient_id + i
+            user = self.user(f'p{i}')
+            birth = datetime(1940, 1, 1) + timedelta(days=rng.randrange(80 * 365))
+            # 地区码随序号递增，与序号后四位组合保证身份证号不重复
+            region = 110000 + (i // 10000) % 890000
+            self.writer.add(Patient(
+                patient_id=patient_id, user_id=user.id, name=self.name(),
+                gender=rng.choice('男女'), id_card=f'{region:06d}{birth:%Y%m%d}{i % 10000:04d}',
+                mobile=self.mobile(), birth_date=birth.date()
+            ))
+        self.writer.flush()
+
+    def create_visits(self):
+        rng = self.rng
+        today = timezone.localdate()
+        start = today - timedelta(days=self.days)
+        schedule_id = next_id(Schedule)
+        appt_id = first_appt_id = next_id(Appointment)
+        record_id = next_id(MedicalRecord)
+        pay_id = next_id(Payment)
+
+        for offset in range(self.days + self.ahead):
+            day = start + timedelta(days=offset)
+            history = day < today
+            workday_rate = 0.75 if day.weekday() < 5 else 0.3
+            # 每人每天最多一个预约（与预约规则一致，也避免 (患者, 到达时间) 重复）
+            seen = set()
+            for doctor_id, dept_id, room_id in self.doctors:
+                for time_slot, slot_start, slot_end in TIME_SLOTS:
+                    if rng.random() >= workday_rate:
+                        continue
+                    capacity = rng.choice((20, 30, 40))
+                    fill = rng.uniform(0.6, 1.0) if history else rng.uniform(0.1, 0.7)
+                    interval = (slot_end - slot_start) // capacity
+                    appointments = []
+                    for k in range(int(capacity * fill)):
+                        if len(seen) >= self.patient_count:
+                            break
+                        patient_id = self.first_patient_id + rng.randrange(self.patient_count)
+                        while patient_id in seen:
+                            patient_id = self.first_patient_id + rng.randrange(self.patient_count)
+                        seen.add(patient_id)
+                        minute = slot_start + k * interval
+                        arrival = timezone.make_aware(datetime.combine(day, time(minute // 60, minute % 60)))
+                        status = (2 if rng.random() < 0.05 else 1) if history else 0
+                        appointments.append((patient_id, arrival, status))
+
+                    # 已完成的预约仍占号，只有取消的会释放
+                    booked = sum(1 for _, _, status in appointments if status != 2)
+                    self.writer.add(Schedule(
+                        schedule_id=schedule_id, doctor_id=doctor_id, room_id=room_id, schedule_date=day,
+                        time_slot=time_slot, capacity=capacity, booked_count=booked
+                    ))
+                    for patient_id, arrival, status in appointments:
+                        self.writer.add(Appointment(
+                            appt_id=appt_id, patient_id=patient_id, dept_id=dept_id,
+                            appt_time=arrival - timedelta(minutes=rng.randint(60, 7 * 24 * 60)),
+                            arrival_time=arrival, status=status, schedule_id=schedule_id
+                        ))
+                        if status == 1:
+                            self.add_record(record_id, pay_id, appt_id, patient_id, doctor_id, room_id, arrival)
+                            record_id += 1
+                            pay_id += 1
+                        appt_id += 1
+                    schedule_id += 1
+            if offset % 30 == 29:
+                self.log(f'已生成至 {day}，累计预约 {appt_id - first_appt_id} 条')
+        self.writer.flush()
+
+    def add_record(self, record_id, pay_id, appt_id, patient_id, doctor_id, room_id, arrival):
+        rng = self.rng
+        visit_time = arrival + timedelta(minutes=rng.randint(0, 30))
+        symptom, prescription = rng.choice(CASES)
+        self.writer.add(MedicalRecord(
+            record_id=record_id, patient_id=patient_id, doctor_id=doctor_id, room_id=room_id,
+            visit_time=visit_time, visit_status=1, symptom=symptom, prescription=prescription,
+            appointment_id=appt_id
+        ))
+        total = Decimal(rng.randint(2000, 80000)) / 100
+        insurance = (total * rng.choice(INSURANCE_RATIOS)).quantize(rollups.CENT)
+        self.writer.add(Payment(
+            pay_id=pay_id, record_id=record_id, total_amount=total, medical_insurance=insurance,
+            # bulk_create 不走 Payment.save()，自费金额在这里算好
+            self_pay=total - insurance,
+            pay_time=visit_time + timedelta(minutes=rng.randint(10, 60)),
+            pay_method='医保' if insurance == total else rng.choice(PAY_METHODS)
+        ))
@@ -0,0 +1,2056 @@
+import asyncio
+import base64
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Max, Min, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import admin, analytics, archive, assignment, availability, benchmark, counters, metrics, rollups, rota
+from .backends.sqlite3.base import DatabaseWrapper
+from .queue_board import QueueHub, hub, stream_app
+from .booking import BookingError, book_appointment, cancel_appointment
+from .instrumentation import collect_queries
+from . import replica, search, synthetic, transactions
+from .models import (
+    Department, ClinicRoom, Doctor, Patient,
+    Schedule, Appointment, MedicalRecord, Payment, DoctorDailyStat, DeptDailyStat,
+    ArchivedAppointment, ArchivedMedicalRecord, ArchivedPayment, MedicalRecordHistory, PaymentHistory
+)
+from .exports import export_rows
+from .pagination import KeysetPaginator
+
+
+def create_clinic_data():
+    """最小化的测试数据：一个科室、医生、诊室、患者，以及若干预约/就诊/缴费"""
+    dept = Department.objects.create(dept_name='内科')
+    room = ClinicRoom.objects.create(room_id='101', dept=dept, location='1楼101室')
+    doctor = Doctor.objects.create(
+        user=User.objects.create_user('doctor1', password='123456', is_staff=True),
+        name='张三', dept=dept, title='主治医师', mobile='13800138000'
+    )
+    patient = Patient.objects.create(
+        user=User.objects.create_user('patient1', password='123456'),
+        name='小明', gender='男', id_card='110101199001011234',
+        mobile='13600136000', birth_date='1990-01-01'
+    )
+    today = timezone.localdate()
+    for day in range(8):
+        Schedule.objects.create(doctor=doctor, room=room, schedule_date=today + timedelta(days=day), time_slot='全天')
+    now = timezone.now()
+    for day in range(5):
+        appt = Appointment.objects.create(
+            patient=patient, dept=dept, arrival_time=now + timedelta(days=day, hours=1), status=day % 2
+        )
+        record = MedicalRecord.objects.create(patient=patient, doctor=doctor, room=room, appointment=appt)
+        Payment.objects.create(record=record, total_amount=Decimal('100'), medical_insurance=Decimal('40'), pay_method='微信')
+    return dept, room, doctor, patient
+
+
+class HotQueryPlanTests(TestCase):
+    """热点查询必须走索引：EXPLAIN QUERY PLAN 中不允许出现对大表的全表扫描"""
+
+    # 随业务增长的大表；科室、医生等字典表很小，不做要求
+    HOT_TABLES = (
+        'clinic_appointment', 'clinic_medicalrecord', 'clinic_payment',
+        'clinic_deptdailystat', 'clinic_doctordailystat',
+    )
+    # SCAN 后面没有 USING ... INDEX 就是全表扫描
+    FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?! USING)(?:\s|$)')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        User.objects.create_user('reception', password='123456', is_staff=True)
+        User.objects.create_superuser('admin', 'admin@test.com', '123456')
+
+    def setUp(self):
+        # 首页计数器走缓存，清空后才能检查到冷启动时的统计查询
+        cache.clear()
+
+    def assertNoFullScan(self, queries):
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any(table in sql for table in self.HOT_TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for line in plan:
+                match = self.FULL_SCAN.search(line)
+                if match and match.group(1) in self.HOT_TABLES:
+                    self.fail(f'全表扫描 {match.group(1)}:\n{sql}\n' + '\n'.join(plan))
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    def get_queries(self, username, url, method='get', data=None):
+        self.client.force_login(User.objects.get(username=username))
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertIn(response.status_code, (200, 302))
+        return ctx.captured_queries
+
+    def test_appointment_conflict_check(self):
+        arrival = timezone.localtime() + timedelta(days=1)
+        queries = self.get_queries('patient1', reverse('patient_appointment'), 'post', {
+            'dept': self.dept.pk,
+            'arrival_time': arrival.strftime('%Y-%m-%d %H:%M'),
+        })
+        self.assertTrue(any('arrival_date' in q['sql'] for q in queries))
+        self.assertNoFullScan(queries)
+
+    def test_patient_pages(self):
+        self.assertNoFullScan(self.get_queries('patient1', reverse('patient_dashboard')))
+        self.assertNoFullScan(self.get_queries('patient1', reverse('patient_appointment_list')))
+
+    def test_reception_pages(self):
+        self.assertNoFullScan(self.get_queries('reception', reverse('reception_dashboard')))
+        url = reverse('reception_visit_list')
+        self.assertNoFullScan(self.get_queries('reception', url))
+        today = timezone.localdate().strftime('%Y-%m-%d')
+        self.assertNoFullScan(self.get_queries('reception', f'{url}?date={today}&doctor={self.doctor.pk}'))
+
+    def test_admin_pages(self):
+        self.assertNoFullScan(self.get_queries('admin', reverse('admin_dashboard')))
+        self.assertNoFullScan(self.get_queries('admin', reverse('statistics')))
+
+    def test_export_date_range(self):
+        # 导出按本地日期列过滤，一天的导出不扫整张缴费表/就诊表
+        self.client.force_login(User.objects.get(username='reception'))
+        today = timezone.localdate().strftime('%Y-%m-%d')
+        for name in ('reception_payment_export', 'reception_visit_export'):
+            response = self.client.get(reverse(name), {'start': today, 'end': today})
+            with CaptureQueriesContext(connection) as ctx:
+                b''.join(response.streaming_content)
+            self.assertNoFullScan(ctx.captured_queries)
+
+
+def create_patients(count, start=0):
+    users = User.objects.bulk_create([User(username=f'p{i}') for i in range(start, start + count)])
+    users = User.objects.filter(username__in=[u.username for u in users])
+    return [
+        Patient.objects.create(
+            user=user, name=user.username, gender='男', id_card=f'{i:018d}',
+            mobile='13600136000', birth_date='1990-01-01'
+        )
+        for i, user in enumerate(users, start=start)
+    ]
+
+
+class BookingConcurrencyTests(TransactionTestCase):
+    """放号高峰压力测试：大量线程同时抢同一排班的号源"""
+
+    THREADS = 16
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('内存SQLite测试库不支持多线程各自连接')
+        self.dept = Department.objects.create(dept_name='内科')
+        self.room = ClinicRoom.objects.create(room_id='101', dept=self.dept, location='1楼101室')
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create_user('doctor1'),
+            name='张三', dept=self.dept, title='主治医师', mobile='13800138000'
+        )
+        self.arrival = timezone.localtime() + timedelta(days=1)
+
+    def run_concurrently(self, patients):
+        """THREADS 个线程同时开始，各自为一批患者预约，返回 (成功数, 失败数, 异常列表, 每次预约的SQL条数)"""
+        results = {'ok': 0, 'full': 0, 'errors': [], 'queries': []}
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker(batch):
+            try:
+                barrier.wait()
+                for patient in batch:
+                    try:
+                        with CaptureQueriesContext(connections['default']) as ctx:
+                            book_appointment(patient, self.dept, self.arrival)
+                        outcome = 'ok'
+                    except BookingError:
+                        outcome = 'full'
+                    with lock:
+                        results[outcome] += 1
+                        results['queries'].append(len(ctx.captured_queries))
+            except Exception as exc:  # 记下来交给主线程断言
+                with lock:
+                    results['errors'].append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=worker, args=(patients[i::self.THREADS],))
+            for i in range(self.THREADS)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results['ok'], results['full'], results['errors'], results['queries']
+
+    def test_no_overbooking(self):
+        schedule = Schedule.objects.create(
+            doctor=self.doctor, room=self.room, schedule_date=self.arrival.date(),
+            time_slot='全天', capacity=40
+        )
+        patients = create_patients(160)
+
+        ok, full, errors, _ = self.run_concurrently(patients)
+
+        self.assertEqual(errors, [])
+        schedule.refresh_from_db()
+        self.assertEqual(ok, 40)
+        self.assertEqual(full, 120)
+        self.assertEqual(schedule.booked_count, 40)
+        self.assertEqual(Appointment.objects.filter(schedule=schedule, status=0).count(), 40)
+
+        # 取消释放号源后，其他患者可以再约到
+        self.assertTrue(cancel_appointment(Appointment.objects.filter(schedule=schedule).first().pk,
+                                           Appointment.objects.filter(schedule=schedule).first().patient))
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.booked_count, 39)
+        book_appointment(patients[-1], self.dept, self.arrival)
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.booked_count, 40)
+
+    def test_throughput_steady(self):
+        """
+        连续几轮高并发预约，每轮的工作量不随已有预约增多而变：每次预约的SQL条数固定，
+        也没有锁冲突重试。不按耗时判断，机器负载高时也不会误报。
+        """
+        Schedule.objects.create(
+            doctor=self.doctor, room=self.room, schedule_date=self.arrival.date(),
+            time_slot='全天', capacity=10000
+        )
+        lock_errors = []
+        is_locked = transactions.is_locked
+
+        def record_lock_error(exc):
+            lock_errors.append(exc)
+            return is_locked(exc)
+
+        query_counts = set()
+        with mock.patch.object(transactions, 'is_locked', side_effect=record_lock_error):
+            for wave in range(4):
+                patients = create_patients(80, start=wave * 80)
+                ok, full, errors, queries = self.run_concurrently(patients)
+                self.assertEqual(errors, [])
+                self.assertEqual((ok, full), (80, 0))
+                query_counts.update(queries)
+        self.assertEqual(lock_errors, [])
+        # 查可约排班、BEGIN、条件UPDATE占号、同日冲突检查、保存点内建预约（SAVEPOINT/INSERT/RELEASE）
+        self.assertEqual(query_counts, {7})
+
+
+class DataMigrationTests(TransactionTestCase):
+    """数据迁移：升级前已有的数据按迁移当时的规则回填（0006 号源占用、0007 全文索引）"""
+
+    def migrate(self, target=None):
+        executor = MigrationExecutor(connection)
+        targets = [('clinic', target)] if target else executor.loader.graph.leaf_nodes('clinic')
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+    def test_backfills_pending_appointments(self):
+        self.addCleanup(self.migrate)
+        apps = self.migrate('0005_stored_dates_and_indexes')
+        models = {name: apps.get_model('clinic', name) for name in (
+            'Department', 'ClinicRoom', 'Doctor', 'Patient', 'Schedule', 'Appointment')}
+        user_model = apps.get_model('auth', 'User')
+        dept = models['Department'].objects.create(dept_name='内科')
+        room = models['ClinicRoom'].objects.create(room_id='101', dept=dept, location='1楼101室')
+        doctor = models['Doctor'].objects.create(
+            user=user_model.objects.create(username='doctor1'), name='张三', dept=dept, title='医师', mobile='13800138000'
+        )
+        day = timezone.localdate() + timedelta(days=1)
+        morning = models['Schedule'].objects.create(doctor=doctor, room=room, schedule_date=day, time_slot='上午（8:00-12:00）')
+        afternoon = models['Schedule'].objects.create(doctor=doctor, room=room, schedule_date=day, time_slot='14:00-17:00')
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        for i in range(32):
+            patient = models['Patient'].objects.create(
+                user=user_model.objects.create(username=f'p{i}'), name=f'患者{i}', gender='男',
+                id_card=f'1101011990010{i:05d}', mobile='13600136000', birth_date='1990-01-01'
+            )
+            models['Appointment'].objects.create(
+                patient=patient, dept=dept, appt_time=timezone.now(), arrival_time=start + timedelta(hours=9),
+                arrival_date=day, status=0 if i < 31 else 2
+            )
+
+        apps = self.migrate('0006_schedule_capacity')
+        Schedule, Appointment = apps.get_model('clinic', 'Schedule'), apps.get_model('clinic', 'Appointment')
+        morning, afternoon = Schedule.objects.get(pk=morning.pk), Schedule.objects.get(pk=afternoon.pk)
+        # 31 个未就诊预约都在上午：号源数量抬到31，已约满；下午不受影响；已取消的不挂
+        self.assertEqual((morning.booked_count, morning.capacity), (31, 31))
+        self.assertEqual((afternoon.booked_count, afternoon.capacity), (0, 30))
+        self.assertEqual(Appointment.objects.filter(schedule_id=morning.pk).count(), 31)
+        self.assertFalse(Appointment.objects.filter(status=2, schedule__isnull=False).exists())
+
+    def test_search_index_backfill_is_frozen(self):
+        self.addCleanup(self.migrate)
+        apps = self.migrate('0006_schedule_capacity')
+        user = apps.get_model('auth', 'User').objects.create(username='patient1')
+        apps.get_model('clinic', 'Patient').objects.create(
+            user=user, name='王小明', gender='男', id_card='110101199001011234', mobile='13600136000', birth_date='1990-01-01'
+        )
+        # 迁移不依赖当前的 search 模块：改了分词规则，回填结果也不变
+        with mock.patch.object(search, 'grams', side_effect=AssertionError), \
+                mock.patch.object(search, 'INDEXES', {}):
+            self.migrate('0007_search_index')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rowid FROM clinic_patient_fts WHERE clinic_patient_fts MATCH '\"小明\"'")
+            self.assertEqual(cursor.fetchall(), [(Patient.objects.get().pk,)])
+        self.assertEqual(search.search('patient', '13600136'), [Patient.objects.get().pk])
+
+
+class PopulateScaleTests(TestCase):
+    """populate_db 批量模式：数据自洽，相同种子结果相同"""
+
+    def populate(self, seed=7):
+        call_command(
+            'populate_db', patients=60, days=5, ahead=2, doctors_per_dept=1, batch_size=50, seed=seed,
+            stdout=StringIO()
+        )
+        return list(
+            Appointment.objects.filter(patient__user__username__startswith='sim_')
+            .order_by('arrival_time', 'patient__id_card')
+            .values_list('patient__id_card', 'arrival_time', 'status', 'medicalrecord__payment__total_amount')
+        )
+
+    def test_populate_scale(self):
+        first = self.populate()
+        self.assertEqual(Patient.objects.filter(user__username__startswith='sim_').count(), 60)
+        self.assertTrue(first)
+        # 历史时间按生成值保存，日期字段随之换算
+        self.assertTrue(Appointment.objects.filter(arrival_date__lt=timezone.localdate()).exists())
+        for total, insurance, self_pay in Payment.objects.values_list('total_amount', 'medical_insurance', 'self_pay'):
+            self.assertEqual(self_pay, total - insurance)
+        for schedule in Schedule.objects.all():
+            self.assertLessEqual(schedule.booked_count, schedule.capacity)
+        # 统计汇总表与原始记录一致
+        self.assertEqual(
+            DoctorDailyStat.objects.aggregate(n=Sum('payment_count'))['n'],
+            Payment.objects.count()
+        )
+
+        self.assertEqual(self.populate(), first)
+        self.assertNotEqual(self.populate(seed=8), first)
+
+
+class BenchCommandTests(TestCase):
+    """bench 命令：按角色压测路由，并能与基线对比发现回归"""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_clinic_data()
+        User.objects.create_user('reception', password='123456', is_staff=True)
+
+    def bench(self, path, **options):
+        call_command(
+            'bench', requests=3, warmup=0, views=['patient_dashboard', 'reception_visit_list', 'logout'],
+            output=path, stderr=StringIO(), **options
+        )
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_bench_and_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline_path = os.path.join(tmp, 'baseline.json')
+            results = self.bench(baseline_path)
+            self.assertEqual(set(results['views']), {'patient_dashboard', 'reception_visit_list'})
+            self.assertIn('logout', results['skipped'])
+            view = results['views']['reception_visit_list']
+            self.assertEqual((view['role'], view['status']), ('reception', 200))
+            self.assertGreater(view['queries'], 0)
+            self.assertLessEqual(view['p50_ms'], view['p95_ms'])
+
+            # 和自己比不算回归（放宽阈值避免计时抖动）
+            self.bench(os.path.join(tmp, 'same.json'), baseline=baseline_path, threshold=10)
+
+            view['queries'] -= 1
+            with open(baseline_path, 'w', encoding='utf-8') as f:
+                json.dump(results, f)
+            with self.assertRaisesRegex(CommandError, 'reception_visit_list: SQL'):
+                self.bench(os.path.join(tmp, 'worse.json'), baseline=baseline_path, threshold=10)
+
+
+class BenchDatasetTests(TransactionTestCase):
+    """bench --dataset：在指定的 SQLite 文件上压测，--patients 先生成该规模的数据集；当前数据库不受影响"""
+
+    def test_generate_and_reuse_dataset(self):
+        original = connection.settings_dict['NAME']
+        with tempfile.TemporaryDirectory() as tmp:
+            dataset = os.path.join(tmp, 'bench.sqlite3')
+            first, second = os.path.join(tmp, 'first.json'), os.path.join(tmp, 'second.json')
+            options = {'requests': 2, 'warmup': 0, 'views': ['patient_dashboard', 'reception_visit_list']}
+            call_command('bench', dataset=dataset, patients=30, days=3, output=first, stderr=StringIO(), **options)
+            self.assertEqual(connection.settings_dict['NAME'], original)
+            self.assertFalse(Patient.objects.exists())
+
+            results = benchmark.load(first)
+            self.assertEqual(results['meta']['database'], dataset)
+            db = sqlite3.connect(dataset)
+            self.assertEqual(results['meta']['dataset']['patient'], db.execute('SELECT count(*) FROM clinic_patient').fetchone()[0])
+            self.assertGreater(db.execute("SELECT count(*) FROM auth_user WHERE username LIKE 'sim_p%'").fetchone()[0], 0)
+            db.close()
+            self.assertEqual({view['status'] for view in results['views'].values()}, {200})
+
+            # 已生成的数据集直接压测，与基线对比
+            err = StringIO()
+            call_command('bench', dataset=dataset, output=second, baseline=first, threshold=10, stderr=err, **options)
+            self.assertIn('没有回归', err.getvalue())
+            self.assertNotIn('数据量不同', err.getvalue())
+
+            with self.assertRaisesMessage(CommandError, '--patients 需要配合 --dataset'):
+                call_command('bench', patients=10, stderr=StringIO())
+            with self.assertRaisesMessage(CommandError, '数据集文件不存在'):
+                call_command('bench', dataset=os.path.join(tmp, 'missing.sqlite3'), stderr=StringIO())
+
+
+class KeysetPaginatorTests(TestCase):
+    """游标分页：游标编解码、前后翻页、排序键相同时按主键定序、非法游标按第一页处理"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        for i in range(2):
+            MedicalRecord.objects.create(patient=cls.patient, doctor=cls.doctor, room=cls.room)
+        # 七条记录只有两个就诊时间：同一时间的多条靠主键区分先后
+        cls.when = timezone.now().replace(microsecond=0)
+        ids = list(MedicalRecord.objects.order_by('pk').values_list('pk', flat=True))
+        MedicalRecord.objects.filter(pk__in=ids[:4]).update(visit_time=cls.when - timedelta(hours=1))
+        MedicalRecord.objects.filter(pk__in=ids[4:]).update(visit_time=cls.when)
+        cls.expected = list(MedicalRecord.objects.order_by('-visit_time', '-record_id').values_list('pk', flat=True))
+
+    def paginator(self, **kwargs):
+        return KeysetPaginator(MedicalRecord.objects.all(), keys=('visit_time', 'record_id'), per_page=3, **kwargs)
+
+    def test_cursor_round_trip(self):
+        paginator = self.paginator()
+        record = MedicalRecord.objects.get(pk=self.expected[0])
+        cursor = paginator.encode_cursor(record)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(paginator.decode_cursor(cursor), [record.visit_time, record.pk])
+        # .values() 的字典和模型实例编码结果一致
+        self.assertEqual(paginator.encode_cursor({'visit_time': record.visit_time, 'record_id': record.pk}), cursor)
+
+    def test_walk_forward_and_back_with_ties(self):
+        paginator = self.paginator()
+        pages, page = [], paginator.page()
+        self.assertIsNone(page.prev_cursor)
+        while True:
+            pages.append([record.pk for record in page.object_list])
+            if not page.next_cursor:
+                break
+            page = paginator.page(after=page.next_cursor)
+        self.assertEqual([pk for ids in pages for pk in ids], self.expected)
+        self.assertEqual([len(ids) for ids in pages], [3, 3, 1])
+
+        # 从最后一页用 before 往回翻，每页与向前翻时相同
+        back = []
+        while page.prev_cursor:
+            page = paginator.page(before=page.prev_cursor)
+            back.append([record.pk for record in page.object_list])
+        self.assertEqual(back, pages[-2::-1])
+        self.assertIsNone(page.prev_cursor)
+
+    def test_ascending(self):
+        paginator = self.paginator(descending=False)
+        page = paginator.page()
+        second = paginator.page(after=page.next_cursor)
+        self.assertEqual([r.pk for r in page.object_list + second.object_list], self.expected[::-1][:6])
+
+    def test_malformed_cursors_fall_back_to_first_page(self):
+        paginator = self.paginator()
+        first = [record.pk for record in paginator.page().object_list]
+
+        def encode(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+        for cursor in ('!!!', 'bm90IGpzb24', encode({'a': 1}), encode([1]), encode(['昨天', 1]), encode([None, 'x'])):
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(paginator.decode_cursor(cursor))
+                self.assertEqual([record.pk for record in paginator.page(after=cursor).object_list], first)
+
+
+class SQLInstrumentationTests(TestCase):
+    """SQL 埋点中间件：Server-Timing 响应头、慢请求日志、N+1 识别"""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_clinic_data()
+
+    def test_disabled_by_default(self):
+        self.client.force_login(User.objects.get(username='patient1'))
+        response = self.client.get(reverse('patient_dashboard'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_server_timing_and_slow_log(self):
+        self.client.force_login(User.objects.get(username='patient1'))
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, 'slow.jsonl')
+            with override_settings(
+                CLINIC_SQL_INSTRUMENTATION=True, CLINIC_SLOW_REQUEST_MS=0, CLINIC_SLOW_REQUEST_LOG=log_path
+            ):
+                response = self.client.get(reverse('patient_dashboard'))
+            self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="SQL x\d+", app;dur=')
+            with open(log_path, encoding='utf-8') as f:
+                entry = json.loads(f.readline())
+        self.assertEqual(entry['path'], reverse('patient_dashboard'))
+        self.assertEqual(entry['status'], 200)
+        self.assertGreater(entry['queries'], 0)
+        self.assertTrue(entry['top'])
+
+    def test_repeated_sql(self):
+        with collect_queries() as queries:
+            for appt in Appointment.objects.all():
+                appt.dept.dept_name
+        [(sql, count, seconds)] = queries.repeated(5)
+        self.assertIn('clinic_department', sql)
+        self.assertEqual(count, Appointment.objects.count())
+
+
+class RollupSignalTests(TestCase):
+    """统计汇总表的增量维护：新增、修改、改派医生、改缴费日期、删除后与按原始记录重算的结果一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        other_dept = Department.objects.create(dept_name='外科')
+        cls.other = Doctor.objects.create(
+            user=User.objects.create_user('doctor2', password='123456', is_staff=True),
+            name='李四', dept=other_dept, title='医师', mobile='13800138001'
+        )
+
+    def snapshot(self):
+        dept_rows = DeptDailyStat.objects.filter(visit_count__gt=0).values_list('stat_date', 'dept_id', 'visit_count')
+        doctor_rows = DoctorDailyStat.objects.exclude(visit_count=0, payment_count=0).values_list(
+            'stat_date', 'doctor_id', 'visit_count', 'payment_count', 'total_amount', 'medical_insurance', 'self_pay'
+        )
+        return sorted(dept_rows), sorted(doctor_rows)
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_create(self):
+        record = MedicalRecord.objects.create(patient=self.patient, doctor=self.other, room=self.room)
+        Payment.objects.create(record=record, total_amount=Decimal('80.5'), medical_insurance=Decimal('20'), pay_method='现金')
+        self.assertMatchesRebuild()
+
+    def test_edit_record_and_payment(self):
+        record = MedicalRecord.objects.order_by('pk').first()
+        record.visit_time = record.visit_time - timedelta(days=3)
+        record.symptom = '咳嗽'
+        record.save()
+        payment = Payment.objects.get(record=record)
+        payment.total_amount, payment.medical_insurance, payment.self_pay = Decimal('120'), Decimal('50'), Decimal('70')
+        payment.save()
+        self.assertMatchesRebuild()
+
+    def test_reassign_doctor_moves_payment(self):
+        record = MedicalRecord.objects.order_by('pk').first()
+        record.doctor = self.other
+        record.save()
+        self.assertMatchesRebuild()
+        self.assertEqual(
+            DoctorDailyStat.objects.get(doctor=self.other).total_amount, Payment.objects.get(record=record).total_amount
+        )
+
+    def test_change_pay_date(self):
+        payment = Payment.objects.order_by('pk').first()
+        payment.pay_time = payment.pay_time - timedelta(days=10)
+        payment.save()
+        self.assertMatchesRebuild()
+
+    def test_delete(self):
+        Payment.objects.order_by('pk').first().delete()
+        MedicalRecord.objects.order_by('pk').last().delete()  # 级联删除缴费
+        self.assertMatchesRebuild()
+        self.assertEqual(DoctorDailyStat.objects.get(doctor=self.doctor).payment_count, 3)
+
+
+class RoleInvalidationTests(TestCase):
+    """会话中缓存的角色在反向修改医生组成员（add/remove/clear）和删除医生组后刷新"""
+
+    def setUp(self):
+        cache.clear()
+        self.dept, self.room, self.doctor, self.patient = create_clinic_data()
+        self.user = self.doctor.user
+        # 组主键与用户主键错开，避免误把 instance.pk 当用户 id 失效时碰巧通过
+        self.group = Group.objects.create(pk=self.user.pk + 100, name='医生')
+        self.client.force_login(self.user)
+
+    def assertHome(self, url_name):
+        self.assertRedirects(self.client.get(reverse('dashboard')), reverse(url_name), fetch_redirect_response=False)
+
+    def test_cached_role_without_signal_is_stale(self):
+        # 对照：绕过信号直接写关联表，会话里缓存的角色不会变
+        self.assertHome('reception_dashboard')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {User.groups.through._meta.db_table} (user_id, group_id) VALUES (%s, %s)',
+                [self.user.pk, self.group.pk],
+            )
+        self.assertHome('reception_dashboard')
+
+    def test_reverse_add_and_remove(self):
+        self.assertHome('reception_dashboard')
+        self.group.user_set.add(self.user)
+        self.assertHome('doctor_dashboard')
+        self.group.user_set.remove(self.user)
+        self.assertHome('reception_dashboard')
+
+    def test_reverse_clear(self):
+        self.group.user_set.add(self.user)
+        self.assertHome('doctor_dashboard')
+        self.group.user_set.clear()
+        self.assertHome('reception_dashboard')
+
+    def test_group_delete(self):
+        self.group.user_set.add(self.user)
+        self.assertHome('doctor_dashboard')
+        self.group.delete()
+        self.assertHome('reception_dashboard')
+
+
+class DashboardCounterTests(TransactionTestCase):
+    """首页计数器：预热后首页不做聚合查询；增删、改日期改金额后重新统计，事务回滚不动缓存"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.dept, self.room, self.doctor, self.patient = create_clinic_data()
+        today = timezone.localdate()
+        # 今天、昨天和上个月的某天（改日期会跨天、跨月）
+        self.days = (today, today - timedelta(days=1), today - timedelta(days=40))
+
+    def counters(self):
+        values = [counters.get('patients'), counters.get('doctors'), counters.get('depts')]
+        for day in self.days:
+            values += [
+                counters.get('day_visits', day), counters.get('day_payments', day),
+                counters.get('month_payments', counters.month_of(day)),
+            ]
+        return values
+
+    def recount(self):
+        def total(**filters):
+            return Payment.objects.filter(**filters).aggregate(total=Sum('total_amount'))['total'] or 0
+
+        values = [Patient.objects.count(), Doctor.objects.count(), Department.objects.count()]
+        for day in self.days:
+            month = day.replace(day=1)
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            values += [
+                MedicalRecord.objects.filter(visit_date=day).count(), total(pay_date=day),
+                total(pay_date__gte=month, pay_date__lt=next_month),
+            ]
+        return values
+
+    def assertCounters(self):
+        self.assertEqual(self.counters(), self.recount())
+        with self.assertNumQueries(0):
+            self.counters()
+
+    def create_patient(self):
+        return Patient.objects.create(
+            user=User.objects.create_user('patient2'), name='小红', gender='女',
+            id_card='110101199001011235', mobile='13600136001', birth_date='1990-01-01'
+        )
+
+    def test_dashboards_skip_aggregates_when_warm(self):
+        admin_user = User.objects.create_superuser('admin', password='123456')
+        reception = User.objects.create_user('reception', password='123456', is_staff=True)
+        for user, name in ((admin_user, 'admin_dashboard'), (reception, 'reception_dashboard')):
+            self.client.force_login(user)
+            self.client.get(reverse(name))
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([q['sql'] for q in ctx.captured_queries if re.search(r'\b(?:COUNT|SUM)\(', q['sql'])], [])
+        self.assertEqual(response.context['today_visits'], 5)
+        self.assertEqual(response.context['today_payments'], Decimal('500'))
+
+    def test_follow_changes(self):
+        self.assertCounters()
+        patient = self.create_patient()
+        dept = Department.objects.create(dept_name='外科')
+        self.assertCounters()
+
+        record = MedicalRecord.objects.create(patient=patient, doctor=self.doctor, room=self.room)
+        payment = Payment.objects.create(
+            record=record, total_amount=Decimal('88.5'), medical_insurance=Decimal('10'), pay_method='现金'
+        )
+        self.assertCounters()
+
+        record.visit_time -= timedelta(days=1)
+        record.save()
+        payment.pay_time -= timedelta(days=40)
+        payment.save()
+        self.assertCounters()
+        payment.total_amount, payment.self_pay = Decimal('99'), Decimal('89')
+        payment.save()
+        self.assertCounters()
+
+        payment.delete()
+        record.delete()
+        MedicalRecord.objects.order_by('pk').first().delete()  # 级联删除缴费
+        patient.delete()
+        dept.delete()
+        self.doctor.delete()
+        self.assertCounters()
+
+    def test_rollback_leaves_counters(self):
+        before = self.counters()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            patient = self.create_patient()
+            record = MedicalRecord.objects.create(patient=patient, doctor=self.doctor, room=self.room)
+            Payment.objects.create(record=record, total_amount=Decimal('50'), medical_insurance=0, pay_method='现金')
+            MedicalRecord.objects.order_by('pk').first().delete()
+            raise RuntimeError
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counters(), before)
+        self.assertEqual(before, self.recount())
+
+
+class FileCacheDashboardCounterTests(DashboardCounterTests):
+    """同上，改用多进程部署时的文件缓存"""
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        override = self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+        }})
+        override.enable()
+        self.addCleanup(override.disable)
+        super().setUp()
+
+
+class ReceptionWriteTests(TestCase):
+    """前台核验预约、缴费：先读后写的流程在一个事务里完成，重复提交不会重复写入"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        User.objects.create_user('reception', password='123456', is_staff=True)
+
+    def setUp(self):
+        # 分诊索引是进程内状态，各测试的数据互不相干
+        assignment.index.reset()
+        self.client.force_login(User.objects.get(username='reception'))
+
+    def test_verify_then_pay(self):
+        appt = Appointment.objects.create(
+            patient=self.patient, dept=self.dept, arrival_time=timezone.now() + timedelta(days=9), status=0
+        )
+        response = self.client.post(reverse('verify_appointment'), {'appt_id': appt.pk})
+        self.assertRedirects(response, reverse('reception_visit_list'))
+        record = MedicalRecord.objects.get(appointment=appt)
+        self.assertEqual((record.doctor, record.visit_status), (self.doctor, 0))
+        appt.refresh_from_db()
+        self.assertEqual(appt.status, 1)
+
+        # 重复核验：预约已完成，不再生成就诊记录
+        response = self.client.post(reverse('verify_appointment'), {'appt_id': appt.pk})
+        self.assertEqual(response.context['error'], '预约ID不存在或已完成/取消')
+        self.assertEqual(MedicalRecord.objects.filter(appointment=appt).count(), 1)
+
+        response = self.client.post(reverse('payment'), {
+            'record_id': record.pk, 'total_amount': '120', 'medical_insurance': '20', 'pay_method': '微信'
+        })
+        self.assertRedirects(response, reverse('reception_payment_list'), fetch_redirect_response=False)
+        self.assertEqual(Payment.objects.get(record=record).self_pay, Decimal('100'))
+        record.refresh_from_db()
+        self.assertEqual(record.visit_status, 1)
+
+
+class ExportTests(TestCase):
+    """缴费/就诊流式导出：CSV/JSONL 格式、本地日期范围、含归档、前台权限、走副本时的流式输出，以及 export_data 命令"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        cls.reception = User.objects.create_user('reception', password='123456', is_staff=True)
+        # 记录都在一年多以前（可以归档）；前两条分别落在同一天的零点和前一天的最后一秒，检查日期边界按本地时间划分
+        cls.day = timezone.localdate() - timedelta(days=400)
+        midnight = timezone.make_aware(datetime.combine(cls.day, datetime.min.time()))
+        times = [midnight, midnight - timedelta(seconds=1)] + [midnight - timedelta(days=i) for i in (2, 3, 4)]
+        cls.records = list(MedicalRecord.objects.order_by('pk'))
+        for record, when in zip(cls.records, times):
+            MedicalRecord.objects.filter(pk=record.pk).update(
+                visit_time=when, visit_date=timezone.localdate(when), visit_status=1
+            )
+            Payment.objects.filter(record=record).update(pay_time=when, pay_date=timezone.localdate(when))
+
+    def setUp(self):
+        self.client.force_login(self.reception)
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        response, body = self.export('reception_payment_export')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertRegex(response['Content-Disposition'], r'attachment; filename="payments_\d{14}\.csv"')
+        self.assertTrue(body.startswith('\ufeff'))
+        lines = body[1:].splitlines()
+        self.assertEqual(lines[0], 'pay_id,record_id,patient_name,doctor_name,dept_name,'
+                                   'total_amount,medical_insurance,self_pay,pay_method,pay_time')
+        self.assertEqual(len(lines), 6)
+        first = Payment.objects.order_by('pk').first()
+        self.assertEqual(lines[1], f'{first.pk},{first.record_id},小明,张三,内科,100.00,40.00,60.00,微信,'
+                                   f'{timezone.localtime(first.pay_time):%Y-%m-%d %H:%M:%S}')
+
+    def test_jsonl_with_date_bounds(self):
+        day = self.day.strftime('%Y-%m-%d')
+        response, body = self.export('reception_visit_export', format='jsonl', start=day, end=day)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['record_id'] for row in rows], [self.records[0].pk])
+        self.assertEqual(rows[0]['visit_time'], f'{day} 00:00:00')
+        self.assertEqual(rows[0]['patient_name'], '小明')
+
+        before = (self.day - timedelta(days=1)).strftime('%Y-%m-%d')
+        _, body = self.export('reception_payment_export', format='jsonl', end=before)
+        self.assertEqual(len(body.splitlines()), 4)
+        _, body = self.export('reception_payment_export', format='jsonl', start=day)
+        self.assertEqual(len(body.splitlines()), 1)
+        # 日期格式错误时忽略该条件，未知格式按 CSV
+        _, body = self.export('reception_payment_export', format='xml', start='2025-13-01')
+        self.assertEqual(len(body[1:].splitlines()), 6)
+
+    def test_include_archive(self):
+        self.assertEqual(archive.archive()[1], 5)
+        _, body = self.export('reception_payment_export', format='jsonl')
+        self.assertEqual(body, '')
+        _, body = self.export('reception_payment_export', format='jsonl', archive='1')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(row['archived'] and row['patient_name'] == '小明' for row in rows))
+        day = self.day.strftime('%Y-%m-%d')
+        _, body = self.export('reception_visit_export', archive='1', start=day, end=day)
+        lines = body[1:].splitlines()
+        self.assertTrue(lines[0].endswith(',archived'))
+        self.assertEqual(len(lines), 2)
+
+    def test_reception_only(self):
+        for user in (self.patient.user, User.objects.create_superuser('admin', password='123456')):
+            self.client.force_login(user)
+            for name in ('reception_payment_export', 'reception_visit_export'):
+                self.assertRedirects(self.client.get(reverse(name)), reverse('login'), fetch_redirect_response=False)
+        self.client.logout()
+        response = self.client.get(reverse('reception_payment_export'))
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(b'pay_id', response.content)
+
+    def test_streamed_body_reads_replica(self):
+        # 副本可用时，视图返回后才逐块执行的导出查询也要在副本上下文里（路由只记录、仍读主库）
+        routed = []
+
+        def db_for_read(router, model, **hints):
+            routed.append(replica._use_replica.get())
+
+        with mock.patch.object(replica, 'replica_available', return_value=True), \
+                mock.patch.object(replica.ReplicaRouter, 'db_for_read', autospec=True, side_effect=db_for_read):
+            response = self.client.get(reverse('reception_payment_export'))
+            routed.clear()
+            body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(body[1:].splitlines()), 6)
+        self.assertTrue(routed)
+        self.assertTrue(all(routed))
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'payments.csv')
+            err = StringIO()
+            call_command('export_data', 'payments', '--output', path, '--chunk-size', '2', stderr=err)
+            self.assertIn(f'已导出 5 行到 {path}', err.getvalue())
+            with open(path, encoding='utf-8', newline='') as f:
+                content = f.read()
+            self.assertTrue(content.startswith('\ufeffpay_id,record_id,'))
+            self.assertEqual(content.count('\r\n'), 6)
+
+            path = os.path.join(tmp, 'visits.jsonl')
+            day = self.day.strftime('%Y-%m-%d')
+            call_command('export_data', 'visits', '--format', 'jsonl', '--start', day, '--output', path, stderr=err)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual([json.loads(line)['record_id'] for line in f], [self.records[0].pk])
+            self.assertIn(f'已导出 1 行到 {path}', err.getvalue())
+
+        archive.archive()
+        with mock.patch('sys.stdout', new_callable=StringIO) as out:
+            call_command('export_data', 'visits', '--format', 'jsonl', '--include-archive', '--primary')
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+        with self.assertRaisesMessage(CommandError, '日期格式错误'):
+            call_command('export_data', 'payments', '--start', '2025/01/01')
+
+
+class ProductionBackendTests(TestCase):
+    """生产 SQLite 后端：连接时执行 PRAGMA，事务以 BEGIN IMMEDIATE 开始"""
+
+    def test_pragmas_and_immediate_transactions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'prod.sqlite3')
+            wrapper = DatabaseWrapper({
+                **connection.settings_dict,
+                'NAME': path,
+                'OPTIONS': {
+                    'timeout': 1,
+                    'transaction_mode': 'immediate',
+                    'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 100},
+                },
+            }, alias='production_test')
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+                    cursor.execute('CREATE TABLE t (x INTEGER)')
+
+                # 事务一开始就持有写锁，其他连接此时无法开始写事务
+                wrapper._start_transaction_under_autocommit()
+                other = sqlite3.connect(path, timeout=0, isolation_level=None)
+                with self.assertRaises(sqlite3.OperationalError):
+                    other.execute('BEGIN IMMEDIATE')
+                with wrapper.cursor() as cursor:
+                    cursor.execute('ROLLBACK')
+                other.execute('BEGIN IMMEDIATE')
+                other.execute('ROLLBACK')
+                other.close()
+            finally:
+                wrapper.close()
+
+
+class ReplicaTests(TestCase):
+    """只读副本：整库同步、延迟判定与读写分流"""
+
+    def test_sync_copies_database(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source, target = os.path.join(tmp, 'primary.sqlite3'), os.path.join(tmp, 'replica.sqlite3')
+            db = sqlite3.connect(source)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('CREATE TABLE t (x INTEGER)')
+            db.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(100)])
+            db.commit()
+            out = StringIO()
+            with mock.patch.dict(connection.settings_dict, NAME=source):
+                call_command('sync_replica', output=target, stdout=out)
+            db.close()
+
+            self.assertIn(target, out.getvalue())
+            self.assertTrue(os.path.exists(replica.marker_path(target)))
+            self.assertFalse(os.path.exists(f'{target}.tmp'))
+            copy = sqlite3.connect(f'file:{target}?mode=ro', uri=True)
+            self.assertEqual(copy.execute('SELECT count(*) FROM t').fetchone()[0], 100)
+            self.assertEqual(copy.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+            copy.close()
+
+    def test_sync_time_is_snapshot_start(self):
+        """拷贝期间写入的用户，副本里没有他的数据，同步完成后仍不能读副本"""
+        with tempfile.TemporaryDirectory() as tmp:
+            source, target = os.path.join(tmp, 'primary.sqlite3'), os.path.join(tmp, 'replica.sqlite3')
+            sqlite3.connect(source).close()
+            written = []
+            connect = sqlite3.connect
+
+            class SlowBackup:
+                def __init__(self, path):
+                    self.db = connect(path)
+
+                def backup(self, target_db):
+                    self.db.backup(target_db)
+                    time.sleep(0.05)
+                    written.append(time.time())  # 快照已开始，之后的写入不在副本里
+                    time.sleep(0.05)
+
+                def __getattr__(self, name):
+                    return getattr(self.db, name)
+
+            with mock.patch.object(replica.sqlite3, 'connect', side_effect=lambda path: SlowBackup(path) if path == source else connect(path)):
+                replica.sync(source, target)
+
+            patches = [
+                mock.patch.object(replica, 'replica_configured', return_value=True),
+                mock.patch.object(replica, 'connections', {replica.REPLICA_ALIAS: mock.Mock()}),
+            ]
+            for patch in patches:
+                patch.start()
+                self.addCleanup(patch.stop)
+            with override_settings(CLINIC_REPLICA_PATH=target, CLINIC_REPLICA_MAX_LAG=60):
+                self.assertLess(replica.replica_synced_at(), written[0])
+                self.assertFalse(replica.replica_available(not_before=written[0]))
+                self.assertTrue(replica.replica_available(not_before=written[0] - 60))
+
+    def test_router_follows_replica_freshness(self):
+        router = replica.ReplicaRouter()
+        synced_at = time.time()
+        patches = [
+            mock.patch.object(replica, 'replica_configured', return_value=True),
+            mock.patch.object(replica, 'replica_synced_at', side_effect=lambda: synced_at),
+            mock.patch.object(replica, 'connections', {replica.REPLICA_ALIAS: mock.Mock()}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.assertIsNone(router.db_for_read(Payment))
+        with override_settings(CLINIC_REPLICA_MAX_LAG=60):
+            with replica.use_replica():
+                self.assertEqual(router.db_for_read(Payment), replica.REPLICA_ALIAS)
+                self.assertEqual(router.db_for_write(Payment), 'default')
+            # 用户刚写入、副本还没同步到 → 读主库
+            with replica.use_replica(not_before=synced_at + 1):
+                self.assertIsNone(router.db_for_read(Payment))
+            # 副本过期 → 读主库
+            synced_at -= 120
+            with replica.use_replica():
+                self.assertIsNone(router.db_for_read(Payment))
+
+    def test_reads_stay_on_primary_without_replica(self):
+        dept, room, doctor, patient = create_clinic_data()
+        self.client.force_login(User.objects.create_user('reception1', password='123456', is_staff=True))
+        response = self.client.get(reverse('reception_visit_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(replica.replica_configured())
+        self.assertIsNone(replica.ReplicaRouter().db_for_read(Payment))
+
+
+class AssignmentTests(TransactionTestCase):
+    """到诊分配：按当前时段排班挑在诊人数最少的医生，索引随就诊开始/结束更新"""
+
+    def setUp(self):
+        assignment.index.reset()
+        self.dept = Department.objects.create(dept_name='内科')
+        self.doctors, self.rooms = [], []
+        for i in range(2):
+            room = ClinicRoom.objects.create(room_id=f'10{i}', dept=self.dept, location=f'1楼10{i}室')
+            doctor = Doctor.objects.create(
+                user=User.objects.create_user(f'doctor{i}'),
+                name=f'医生{i}', dept=self.dept, title='主治医师', mobile='13800138000'
+            )
+            Schedule.objects.create(doctor=doctor, room=room, schedule_date=timezone.localdate(), time_slot='全天')
+            self.doctors.append(doctor)
+            self.rooms.append(room)
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user('patient1'), name='小明', gender='男',
+            id_card='110101199001011234', mobile='13600136000', birth_date='1990-01-01'
+        )
+        self.client.force_login(User.objects.create_user('reception', is_staff=True))
+
+    def verify(self, dept=None):
+        appt = Appointment.objects.create(
+            patient=self.patient, dept=dept or self.dept, status=0,
+            arrival_time=timezone.now() + timedelta(minutes=Appointment.objects.count())
+        )
+        self.client.post(reverse('verify_appointment'), {'appt_id': appt.pk})
+        return MedicalRecord.objects.get(appointment=appt)
+
+    def test_least_loaded_doctor_and_room(self):
+        records = [self.verify() for _ in range(3)]
+        self.assertEqual([r.doctor for r in records], [self.doctors[0], self.doctors[1], self.doctors[0]])
+        self.assertEqual([r.room for r in records], [self.rooms[0], self.rooms[1], self.rooms[0]])
+
+        # 医生0 的两个病人都缴费离院，下一位分给医生0
+        for record in records[::2]:
+            self.client.post(reverse('payment'), {
+                'record_id': record.pk, 'total_amount': '100', 'medical_insurance': '0', 'pay_method': '现金'
+            })
+        with self.assertNumQueries(0):
+            self.assertEqual(assignment.assign(self.dept.pk), (self.doctors[0].pk, self.rooms[0].pk))
+
+    def test_time_slot_and_fallback(self):
+        today = timezone.localdate()
+        night = Doctor.objects.create(
+            user=User.objects.create_user('doctor_night'),
+            name='夜班', dept=self.dept, title='主治医师', mobile='13800138000'
+        )
+        Schedule.objects.create(doctor=night, room=self.rooms[1], schedule_date=today, time_slot='20:00-23:00')
+        Schedule.objects.filter(time_slot='全天').delete()
+        evening = timezone.make_aware(datetime.combine(today, datetime.min.time()).replace(hour=21))
+        morning = evening.replace(hour=9)
+        self.assertEqual(assignment.index.pick(self.dept.pk, evening), (night.pk, self.rooms[1].pk))
+        self.assertIsNone(assignment.index.pick(self.dept.pk, morning))
+
+        # 当前时段无人排班：在科室在职医生里挑，离职的不分
+        other = Department.objects.create(dept_name='外科')
+        ClinicRoom.objects.create(room_id='201', dept=other, location='2楼201室')
+        Doctor.objects.create(
+            user=User.objects.create_user('doctor_off'), name='离职', dept=other,
+            title='主治医师', mobile='13800138000', work_status='离职'
+        )
+        self.assertEqual(self.client.post(reverse('verify_appointment'), {
+            'appt_id': Appointment.objects.create(
+                patient=self.patient, dept=other, arrival_time=timezone.now(), status=0
+            ).pk
+        }).context['error'], '该科室当前没有可接诊的医生或诊室')
+        on_duty = Doctor.objects.create(
+            user=User.objects.create_user('doctor_on'), name='在职', dept=other, title='主治医师', mobile='13800138000'
+        )
+        self.assertEqual(self.verify(other).doctor, on_duty)
+
+
+class QueueBoardTests(TransactionTestCase):
+    """候诊队列推送：所有屏幕共用一个事件缓冲区，新连接先收快照，之后只收增量事件"""
+
+    def test_hub_buffer_and_wakeup(self):
+        board = QueueHub(size=3)
+        for i in range(5):
+            board.publish('opened', i % 2, {'record_id': i})
+        events, last_id, complete = board.since(3)
+        self.assertEqual(([e[0] for e in events], last_id, complete), ([4, 5], 5, True))
+        self.assertEqual([e[0] for e in board.since(2, dept_id=1)[0]], [4])
+        # ID 已滚出缓冲区或来自重启前的进程：需要重发快照
+        self.assertFalse(board.since(1)[2])
+        self.assertFalse(board.since(99)[2])
+
+        async def wait_for_publish():
+            waiters = [asyncio.ensure_future(board.wait(5, timeout=5)) for _ in range(3)]
+            await asyncio.sleep(0)
+            threading.Thread(target=board.publish, args=('closed', 0, {})).start()
+            started = time.monotonic()
+            await asyncio.gather(*waiters)
+            return time.monotonic() - started
+        self.assertLess(asyncio.run(wait_for_publish()), 1)
+
+    def test_stream_pushes_visit_changes(self):
+        assignment.index.reset()
+        dept, room, doctor, patient = create_clinic_data()
+        other = Department.objects.create(dept_name='外科')
+        reception = User.objects.create_user('reception', password='123456', is_staff=True)
+        self.client.force_login(reception)
+        cookie = f'sessionid={self.client.cookies["sessionid"].value}'.encode()
+        appt = Appointment.objects.create(patient=patient, dept=dept, arrival_time=timezone.now(), status=0)
+
+        async def session(query, cookie=cookie):
+            inbox, chunks = asyncio.Queue(), []
+
+            async def send(message):
+                chunks.append(message)
+                if message.get('body'):
+                    await inbox.put(message['body'].decode())
+            received = asyncio.Queue()
+            scope = {'type': 'http', 'method': 'GET', 'path': '/reception/queue/stream/',
+                     'query_string': query.encode(), 'headers': [(b'cookie', cookie)]}
+            task = asyncio.ensure_future(stream_app(scope, received.get, send))
+            return task, inbox, received, chunks
+
+        async def scenario():
+            # 未登录不给看
+            task, inbox, received, chunks = await session('', cookie=b'')
+            await task
+            self.assertEqual(chunks[0]['status'], 403)
+
+            task, inbox, received, chunks = await session(f'dept={dept.pk}')
+            other_task, other_inbox, other_received, _ = await session(f'dept={other.pk}')
+            self.assertIn('retry:', await inbox.get())
+            snapshot = await inbox.get()
+            self.assertIn('event: snapshot', snapshot)
+            self.assertIn('"patient":"小*"', snapshot)
+            await other_inbox.get()
+            await other_inbox.get()
+
+            await asyncio.get_running_loop().run_in_executor(None, lambda: self.client.post(
+                reverse('verify_appointment'), {'appt_id': appt.pk}
+            ))
+            opened = await asyncio.wait_for(inbox.get(), 5)
+            record = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: MedicalRecord.objects.get(appointment=appt).pk
+            )
+            self.assertIn('event: opened', opened)
+            self.assertIn(f'"record_id":{record}', opened)
+            # 其他科室的屏幕被唤醒后只发保活注释，收不到本科室的事件
+            self.assertEqual(await asyncio.wait_for(other_inbox.get(), 5), ': keepalive\n\n')
+
+            for queue in (received, other_received):
+                await queue.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(asyncio.gather(task, other_task), 5)
+            self.assertEqual(chunks[0]['status'], 200)
+
+        asyncio.run(scenario())
+
+        # WSGI 下的兜底：直接返回当前快照
+        response = self.client.get(reverse('reception_queue_stream'), {'dept': dept.pk})
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        self.assertIn(f'id: {hub.last_id}', response.content.decode())
+        self.assertEqual(self.client.get(reverse('reception_queue_board')).status_code, 200)
+
+
+class SearchIndexTests(TestCase):
+    """FTS5 全文索引：随信号同步，支持姓名、号码片段和病历关键词检索"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        cls.doctor.user.groups.create(name='医生')
+        cls.record = MedicalRecord.objects.filter(patient=cls.patient).first()
+        cls.record.symptom = '咳嗽、发烧3天，体温38.5℃'
+        cls.record.prescription = '布洛芬缓释胶囊 1粒/次'
+        cls.record.save()
+
+    def test_query_expression(self):
+        self.assertEqual(search.grams('头痛，发热'), '头痛 痛 发热 热')
+        self.assertEqual(search.match_expression('张 １３８'), '"张"* AND "138"*')
+        self.assertEqual(search.match_expression('头痛发热'), '"头痛 痛发 发热"')
+        # 一两位数字命中面太大，不查
+        self.assertIsNone(search.match_expression('13'))
+
+    def test_index_follows_writes(self):
+        for query in ('小明', '明', '3600136', '110101199001011234', '01011234', '小明 1234'):
+            self.assertEqual(search.search('patient', query), [self.patient.pk], query)
+        for query in ('布洛芬', '发烧 咳嗽', '38'):
+            self.assertEqual(search.search('record', query), [self.record.pk] if query != '38' else [], query)
+        self.assertEqual(search.search('record', '头痛'), [])
+
+        # 改的是新取出的对象，类级别的测试数据留给其他测试
+        patient = Patient.objects.get(pk=self.patient.pk)
+        patient.name = '王小二'
+        patient.save()
+        self.assertEqual(search.search('patient', '小明'), [])
+        self.assertEqual(search.search('patient', '王小'), [patient.pk])
+
+        MedicalRecord.objects.get(pk=self.record.pk).delete()
+        self.assertEqual(search.search('record', '布洛芬'), [])
+        # 批量写入不走信号，重建后补上
+        MedicalRecord.objects.filter(patient=self.patient).update(symptom='头痛')
+        self.assertEqual(search.search('record', '头痛'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('patient 1 行，record 4 行', out.getvalue())
+        self.assertEqual(len(search.search('record', '头痛')), 4)
+
+    def test_search_views(self):
+        self.client.force_login(User.objects.create_user('reception', is_staff=True))
+        response = self.client.get(reverse('reception_patient_search'), {'q': '0136'})
+        self.assertEqual([p.pk for p in response.context['patients']], [self.patient.pk])
+        # 非医生不能检索病历
+        self.assertRedirects(self.client.get(reverse('doctor_record_search')), reverse('reception_dashboard'),
+                             fetch_redirect_response=False)
+
+        self.client.force_login(self.doctor.user)
+        self.client.get(reverse('doctor_record_search'))  # 首次请求解析角色并缓存到 session
+        with self.assertNumQueries(4):  # 会话、用户、全文检索、取记录
+            response = self.client.get(reverse('doctor_record_search'), {'q': '布洛芬'})
+        self.assertEqual(response.context['records'], [self.record])
+
+        self.client.force_login(User.objects.create_superuser('admin', password='123456'))
+        response = self.client.get('/admin/clinic/patient/', {'q': '小明'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class ArchiveTests(TestCase):
+    """冷数据归档：已离院且已缴费的旧记录移到归档表，默认查询只看热表，带 archive=1 时合并读取"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        cls.doctor.user.groups.create(name='医生')
+        old = timezone.now() - timedelta(days=400)
+        records = list(MedicalRecord.objects.order_by('pk'))
+        # 前两条：旧、已离院、已缴费 -> 归档；第三条旧但仍在就诊中 -> 保留
+        for i, record in enumerate(records[:3]):
+            when = old + timedelta(minutes=i)
+            MedicalRecord.objects.filter(pk=record.pk).update(
+                visit_time=when, visit_date=timezone.localdate(when),
+                visit_status=1 if record in records[:2] else 0, symptom='头痛'
+            )
+            Appointment.objects.filter(pk=record.appointment_id).update(
+                arrival_time=when, arrival_date=timezone.localdate(when), status=1
+            )
+            Payment.objects.filter(record=record).update(pay_time=when, pay_date=timezone.localdate(when))
+        # 旧的已取消预约，没有就诊记录
+        Appointment.objects.create(
+            patient=cls.patient, dept=cls.dept, arrival_time=old + timedelta(hours=1), status=2
+        )
+        cls.archived_ids = [record.pk for record in records[:2]]
+        search.rebuild()
+        rollups.rebuild()
+
+    def test_cutoff_keeps_current_month(self):
+        today = datetime(2026, 10, 17).date()
+        self.assertEqual(archive.archive_cutoff(365, today), datetime(2025, 10, 17).date())
+        self.assertEqual(archive.archive_cutoff(0, today), datetime(2026, 10, 1).date())
+
+    def test_archive_moves_cold_rows(self):
+        stats = list(DoctorDailyStat.objects.values_list('stat_date', 'visit_count', 'total_amount').order_by('stat_date'))
+
+        out = StringIO()
+        call_command('archive_records', '--dry-run', stdout=out)
+        self.assertIn('就诊记录 2 条，预约 3 条', out.getvalue())
+        self.assertEqual(MedicalRecord.objects.count(), 5)
+
+        call_command('archive_records', '--chunk-size', '1', stdout=out)
+        self.assertIn('就诊记录 2 条，预约 3 条', out.getvalue())
+        self.assertEqual(sorted(ArchivedMedicalRecord.objects.values_list('pk', flat=True)), self.archived_ids)
+        self.assertEqual(ArchivedPayment.objects.count(), 2)
+        self.assertEqual(ArchivedAppointment.objects.count(), 3)
+        # 默认查询只看热表，历史视图合并两边
+        self.assertEqual(MedicalRecord.objects.count(), 3)
+        self.assertEqual(Payment.objects.count(), 3)
+        self.assertEqual(MedicalRecordHistory.objects.count(), 5)
+        self.assertEqual(
+            sorted(MedicalRecordHistory.objects.filter(archived=True).values_list('pk', flat=True)), self.archived_ids
+        )
+        self.assertEqual(PaymentHistory.objects.aggregate(total=Sum('total_amount'))['total'], Decimal('500'))
+        # 再跑一次没有可归档的
+        self.assertEqual(archive.archive(), (archive.archive_cutoff(), 0, 0))
+
+        # 统计汇总不受影响，按历史视图重算结果也一致
+        self.assertEqual(list(DoctorDailyStat.objects.values_list(
+            'stat_date', 'visit_count', 'total_amount').order_by('stat_date')), stats)
+        rollups.rebuild()
+        self.assertEqual(list(DoctorDailyStat.objects.values_list(
+            'stat_date', 'visit_count', 'total_amount').order_by('stat_date')), stats)
+
+        headers, rows = export_rows('payments')
+        self.assertEqual(len(list(rows)), 3)
+        headers, rows = export_rows('payments', include_archive=True)
+        rows = list(rows)
+        self.assertEqual(headers[-1], 'archived')
+        self.assertEqual(sorted(row[0] for row in rows if row[-1]), list(
+            ArchivedPayment.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual({row[2] for row in rows}, {'小明'})
+
+        # 列表和病历检索带 archive=1 时才包含归档记录
+        self.client.force_login(User.objects.create_user('reception', is_staff=True))
+        response = self.client.get(reverse('reception_visit_list'))
+        self.assertEqual(len(response.context['visit_records']), 3)
+        response = self.client.get(reverse('reception_visit_list'), {'archive': '1'})
+        self.assertEqual(len(response.context['visit_records']), 5)
+        self.assertContains(response, '已归档', count=3)  # 两个徽标 + 复选框文字
+
+        self.client.force_login(self.doctor.user)
+        response = self.client.get(reverse('doctor_record_search'), {'q': '头痛'})
+        self.assertEqual(len(response.context['records']), 1)
+        response = self.client.get(reverse('doctor_record_search'), {'q': '头痛', 'archive': '1'})
+        self.assertEqual(len(response.context['records']), 3)
+
+        self.client.force_login(self.patient.user)
+        response = self.client.get(reverse('patient_appointment_list'))
+        self.assertEqual(len(response.context['appointments']), 3)
+        response = self.client.get(reverse('patient_appointment_list'), {'archive': '1'})
+        self.assertEqual(len(response.context['appointments']), 6)
+        archived = ArchivedAppointment.objects.first()
+        detail = reverse('appointment_detail', args=[archived.pk])
+        self.assertEqual(self.client.get(detail).status_code, 404)
+        self.assertEqual(self.client.get(detail, {'archive': '1'}).status_code, 200)
+
+    def test_clear_all_after_archive(self):
+        # populate_db 重新生成数据前清空：归档表引用患者、医生，不能留下悬空外键
+        archive.archive()
+        self.assertTrue(ArchivedPayment.objects.exists())
+        synthetic.clear_all()
+        connection.check_constraints()
+        self.assertFalse(ArchivedAppointment.objects.exists())
+        self.assertFalse(MedicalRecordHistory.objects.exists())
+        self.assertFalse(Patient.objects.exists())
+
+
+
+class PatientPageCacheTests(TransactionTestCase):
+    """患者页面：按页面版本号返回304，预约、就诊变化后版本号和片段缓存一起更新"""
+
+    def setUp(self):
+        cache.clear()
+        self.dept, self.room, self.doctor, self.patient = create_clinic_data()
+        self.client.force_login(self.patient.user)
+
+    def test_conditional_get(self):
+        url = reverse('patient_appointment_list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(len(response.context['appointments']), 5)
+
+        with self.assertNumQueries(2):  # 会话、用户；不查预约也不渲染
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # 已归档视图也是同一个版本号，但 URL 不同，浏览器分别保存
+        self.assertEqual(self.client.get(url, {'archive': '1'})['ETag'], etag)
+
+        # 条件UPDATE取消预约不经过模型信号，也要更新版本号
+        appt = Appointment.objects.filter(patient=self.patient, status=0).first()
+        self.client.get(reverse('appointment_cancel', args=[appt.pk]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        # 片段缓存换了键，取消后的状态立即可见
+        self.assertContains(response, 'badge bg-danger', count=1)
+
+        etag = response['ETag']
+        MedicalRecord.objects.filter(patient=self.patient).first().delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_fragment_cache_skips_queries(self):
+        url = reverse('patient_dashboard')
+        self.client.get(url)
+        # 没有条件头时重新渲染页面，但表格片段命中缓存：不查预约、不查患者信息
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, '小明')
+        Patient.objects.filter(pk=self.patient.pk).update(name='小明明')
+        patient = Patient.objects.get(pk=self.patient.pk)
+        patient.save()
+        self.assertContains(self.client.get(url), '小明明')
+
+
+class ScheduleRotaTests(TestCase):
+    """按周模板批量排班：一次查出已有排班，在内存中检查医生、诊室时间冲突"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        cls.room2 = ClinicRoom.objects.create(room_id='102', dept=cls.dept, location='1楼102室')
+        cls.doctor2 = Doctor.objects.create(
+            user=User.objects.create_user('doctor2'), name='李四', dept=cls.dept, title='主治医师', mobile='13800138001'
+        )
+        cls.admin = User.objects.create_superuser('admin', password='123456')
+
+    def test_interval_index(self):
+        index = rota.IntervalIndex()
+        # 旧数据本身重叠时合并，不会漏掉与外层区间的冲突
+        index.add('k', (480, 1080), 'a')
+        index.add('k', (540, 600), 'b')
+        self.assertEqual(index.clash('k', (660, 720)), 'a')
+        self.assertIsNone(index.clash('k', (1080, 1140)))
+        self.assertIsNone(index.clash('other', (660, 720)))
+
+    def test_rollout(self):
+        monday = timezone.localdate() + timedelta(days=14 - timezone.localdate().weekday())
+        self.client.force_login(self.admin)
+        template = '\n'.join([
+            '# 医生 诊室 星期 时间段 号源',
+            f'{self.doctor.pk} 101 1 08:00-12:00 20',
+            f'{self.doctor2.pk} 101 1 10:00-14:00',  # 诊室冲突
+            f'{self.doctor.pk},102,1,11:00-13:00',  # 医生冲突
+            f'{self.doctor2.pk} 102 3 全天',
+        ])
+        data = {'start': monday, 'end': monday + timedelta(days=13), 'template': template, 'preview': 'on'}
+        response = self.client.post(reverse('schedule_rollout'), data)
+        self.assertEqual((response.context['published_count'], response.context['clash_count']), (4, 4))
+        self.assertFalse(Schedule.objects.filter(schedule_date__gte=monday).exists())
+
+        del data['preview']
+        with self.assertNumQueries(8):  # 会话、用户、核对医生、核对诊室、已有排班、批量写入，外加保存点的开始和释放
+            response = self.client.post(reverse('schedule_rollout'), data)
+        self.assertIn('诊室101与本次模板中的排班', response.context['clashes'][0])
+        self.assertEqual(Schedule.objects.filter(schedule_date__gte=monday).count(), 4)
+        self.assertEqual(
+            Schedule.objects.get(doctor=self.doctor, schedule_date=monday).capacity, 20
+        )
+        # 再发布一次，全部与已有排班冲突
+        response = self.client.post(reverse('schedule_rollout'), data)
+        self.assertEqual((response.context['published_count'], response.context['clash_count']), (0, 8))
+
+        response = self.client.post(reverse('schedule_rollout'), dict(data, template='1 101 8 08:00-12:00'))
+        self.assertIn('第1行格式错误', response.context['form'].errors['template'][0])
+
+    def test_single_schedule(self):
+        self.client.force_login(self.admin)
+        url = reverse('schedule_management')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # 今天医生1已在101诊室全天排班：换个医生也不能占用同一诊室
+        data = {
+            'doctor': self.doctor2.pk, 'room': '101', 'schedule_date': timezone.localdate(),
+            'time_slot': '08:00-12:00', 'status': 1, 'capacity': 30,
+        }
+        response = self.client.post(url, data)
+        self.assertIn('诊室101与已有排班', response.context['error'])
+        self.assertRedirects(self.client.post(url, dict(data, room='102')), url)
+        self.assertTrue(Schedule.objects.filter(doctor=self.doctor2, room_id='102').exists())
+
+
+class ReconciliationTests(TestCase):
+    """结算文件对账：逐行读取，按渠道、金额和时间窗口匹配结算日的缴费"""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_clinic_data()
+        cls.day = timezone.localdate() - timedelta(days=1)
+        start = timezone.make_aware(datetime.combine(cls.day, datetime.min.time())) + timedelta(hours=10)
+        cls.pay_ids = []
+        # 五笔缴费：10点起每小时一笔，微信自费60元、医保40元
+        for i, payment in enumerate(Payment.objects.order_by('pk')):
+            when = start + timedelta(hours=i)
+            Payment.objects.filter(pk=payment.pk).update(pay_time=when, pay_date=cls.day)
+            cls.pay_ids.append(payment.pk)
+
+    def test_reconcile_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            wechat = os.path.join(tmp, 'wechat.csv')
+            with open(wechat, 'w', encoding='utf-8-sig', newline='') as f:
+                f.write('交易单号,交易时间,金额\n')
+                f.write(f'W1,{self.day} 10:02:00,60.00\n')
+                f.write(f'W2,{self.day} 11:01:30,59.00\n')
+                f.write(f'W3,{self.day} 15:30:00,60.00\n')
+                f.write(f'W4,{self.day} 16:00:00,abc\n')
+            insurance = os.path.join(tmp, 'insurance.jsonl')
+            with open(insurance, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'trade_no': 'Y1', 'trade_time': f'{self.day}T10:00:05', 'amount': '40', 'channel': 'insurance'}) + '\n')
+            report = os.path.join(tmp, 'report.jsonl')
+            err = StringIO()
+            call_command(
+                'reconcile_settlements', wechat, insurance, '--channel', 'wechat',
+                '--output', report, '--report-format', 'jsonl', stderr=err
+            )
+            with open(report, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f]
+
+        self.assertIn('matched 2，mismatched 1，unmatched 1，missing 7，invalid 1', err.getvalue())
+        by_trade = {row['trade_no']: row for row in rows if row['trade_no']}
+        self.assertEqual(by_trade['W1']['pay_id'], self.pay_ids[0])
+        self.assertEqual((by_trade['W2']['bucket'], by_trade['W2']['note']), ('mismatched', '差额 -1.00'))
+        self.assertEqual(by_trade['W3']['bucket'], 'unmatched')
+        self.assertEqual((by_trade['Y1']['bucket'], by_trade['Y1']['channel']), ('matched', '医保'))
+        self.assertEqual(by_trade['Y1']['pay_id'], self.pay_ids[0])
+        invalid = [row for row in rows if row['bucket'] == 'invalid']
+        self.assertEqual(invalid[0]['source'], 'wechat.csv:5')
+        missing = [(row['channel'], row['pay_id']) for row in rows if row['bucket'] == 'missing']
+        self.assertEqual(missing, [('医保', pk) for pk in self.pay_ids[1:]] + [('微信', pk) for pk in self.pay_ids[2:]])
+
+
+class JsonApiTests(TestCase):
+    """JSON API：按 values() 投影字段、游标分页，权限与页面装饰器一致，查询次数固定"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        other = Patient.objects.create(
+            user=User.objects.create_user('patient2', password='123456'), name='小红', gender='女',
+            id_card='110101199001011235', mobile='13600136001', birth_date='1990-01-01'
+        )
+        cls.other_appt = Appointment.objects.create(
+            patient=other, dept=cls.dept, arrival_time=timezone.now() + timedelta(days=3), status=0
+        )
+        cls.admin = User.objects.create_superuser('admin', password='123456')
+
+    def get(self, name, **params):
+        return self.client.get(reverse(name), params)
+
+    def test_permissions(self):
+        self.assertEqual(self.get('api_departments').status_code, 401)
+        self.client.force_login(self.patient.user)
+        self.assertEqual(self.get('api_records').status_code, 403)
+        self.assertEqual(self.get('api_payments').status_code, 403)
+        self.assertEqual(self.client.delete(reverse('api_departments')).status_code, 405)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.get('api_appointments').status_code, 403)
+        self.client.force_login(self.doctor.user)
+        self.assertEqual(self.get('api_payments').status_code, 200)
+        response = self.client.post(reverse('api_schedules'), {})
+        self.assertEqual(response.status_code, 403)
+
+    def test_patient_appointments(self):
+        self.client.force_login(self.patient.user)
+        self.get('api_appointments')  # 角色解析结果缓存进 session
+
+        seen = []
+        params = {'limit': 2, 'fields': 'id,status'}
+        with self.assertNumQueries(3):  # 会话、用户、一页预约
+            response = self.get('api_appointments', **params)
+        data = response.json()
+        while True:
+            self.assertTrue(all(set(row) == {'id', 'status'} for row in data['results']))
+            seen += [row['id'] for row in data['results']]
+            if not data['next']:
+                break
+            data = self.get('api_appointments', after=data['next'], **params).json()
+        own = list(Appointment.objects.filter(patient=self.patient).order_by('-pk').values_list('pk', flat=True))
+        self.assertEqual(seen, own)
+
+        response = self.get('api_appointments', ids=f'{own[0]},{self.other_appt.pk},{own[1]}')
+        self.assertEqual([row['id'] for row in response.json()['results']], own[:2])
+        self.assertEqual(response.json()['missing'], [self.other_appt.pk])
+        self.assertEqual(response.json()['results'][0]['dept_name'], '内科')
+
+        response = self.get('api_appointments', fields='id,password')
+        self.assertEqual((response.status_code, response.json()['error']), (400, '未知字段：password'))
+
+    def test_book_and_cancel(self):
+        self.client.force_login(self.patient.user)
+        # 先取消已有的未就诊预约，避免同日冲突
+        Appointment.objects.filter(patient=self.patient).update(status=1)
+        arrival = timezone.localtime() + timedelta(days=2)
+        payload = {'dept': self.dept.pk, 'arrival_time': arrival.strftime('%Y-%m-%d %H:%M')}
+        response = self.client.post(reverse('api_appointments'), json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        appt_id = response.json()['id']
+        self.assertEqual(Schedule.objects.get(schedule_date=arrival.date()).booked_count, 1)
+        response = self.client.post(reverse('api_appointments'), json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+
+        response = self.client.post(reverse('api_appointment_cancel', args=[appt_id]))
+        self.assertEqual(response.json()['status'], 2)
+        self.assertEqual(Schedule.objects.get(schedule_date=arrival.date()).booked_count, 0)
+        self.assertEqual(self.client.post(reverse('api_appointment_cancel', args=[appt_id])).status_code, 404)
+
+    def test_reception_lists(self):
+        self.client.force_login(self.doctor.user)
+        self.get('api_departments')
+        with self.assertNumQueries(3):
+            response = self.get('api_payments', fields='id,patient_name,self_pay')
+        self.assertEqual(response.json()['results'][0]['patient_name'], '小明')
+        self.assertEqual(response.json()['results'][0]['self_pay'], '60.00')
+        params = {'doctor': self.doctor.pk, 'date': timezone.localdate(), 'limit': 3}
+        response = self.get('api_records', **params)
+        self.assertEqual(len(response.json()['results']), 3)
+        response = self.get('api_records', after=response.json()['next'], **params)
+        self.assertEqual((len(response.json()['results']), response.json()['next']), (2, None))
+        self.assertEqual(self.get('api_records', doctor='x').status_code, 400)
+
+    def test_reception_check_in_and_pay(self):
+        assignment.index.reset()
+        self.client.force_login(self.patient.user)
+        self.assertEqual(self.client.post(reverse('api_records'), {'appt_id': self.other_appt.pk}).status_code, 403)
+        self.client.force_login(User.objects.create_user('reception', password='123456', is_staff=True))
+
+        def post(name, payload):
+            return self.client.post(reverse(name), json.dumps(payload), content_type='application/json')
+
+        response = post('api_records', {'appt_id': self.other_appt.pk})
+        self.assertEqual(response.status_code, 201)
+        record = response.json()
+        self.assertEqual((record['patient_name'], record['doctor_name'], record['visit_status']), ('小红', '张三', 0))
+        self.other_appt.refresh_from_db()
+        self.assertEqual(self.other_appt.status, 1)
+        # 重复核验、不存在的预约
+        self.assertEqual(post('api_records', {'appt_id': self.other_appt.pk}).status_code, 404)
+        self.assertEqual(post('api_records', {'appt_id': 'x'}).status_code, 404)
+        self.assertEqual(MedicalRecord.objects.filter(appointment=self.other_appt).count(), 1)
+
+        payment = {'record_id': record['id'], 'total_amount': '120', 'medical_insurance': '20', 'pay_method': '微信'}
+        response = post('api_payments', dict(payment, medical_insurance='130'))
+        self.assertEqual((response.status_code, response.json()['error']), (400, '医保金额不能超过总金额'))
+        response = post('api_payments', payment)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['self_pay'], response.json()['patient_name']), ('100.00', '小红'))
+        self.assertEqual(MedicalRecord.objects.get(pk=record['id']).visit_status, 1)
+        self.assertEqual(post('api_payments', payment).status_code, 404)
+        self.assertEqual(Payment.objects.filter(record_id=record['id']).count(), 1)
+
+    def test_admin_creates_schedule(self):
+        self.client.force_login(self.admin)
+        day = timezone.localdate() + timedelta(days=20)
+        data = {
+            'doctor': self.doctor.pk, 'room': '101', 'schedule_date': day,
+            'time_slot': '08:00-12:00', 'status': 1, 'capacity': 10,
+        }
+        response = self.client.post(reverse('api_schedules'), data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['date'], response.json()['capacity']), (str(day), 10))
+        response = self.client.post(reverse('api_schedules'), dict(data, time_slot='10:00-14:00'))
+        self.assertEqual(response.status_code, 409)
+
+
+class ProfilingTests(TestCase):
+    """按需剖析：超级管理员请求头或抽样触发，按视图名保存 .prof、折叠栈和热点摘要"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        cls.admin = User.objects.create_superuser('admin', password='123456')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        override = override_settings(CLINIC_PROFILE_DIR=self.dir, CLINIC_PROFILE_KEEP=2)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_header_and_sampling(self):
+        # 非超级管理员带请求头不剖析
+        self.client.force_login(self.patient.user)
+        response = self.client.get(reverse('patient_dashboard'), HTTP_X_CLINIC_PROFILE='1')
+        self.assertNotIn('X-Clinic-Profile', response)
+
+        self.client.force_login(self.admin)
+        for _ in range(3):
+            response = self.client.get(reverse('admin_dashboard'), HTTP_X_CLINIC_PROFILE='1')
+        saved = response['X-Clinic-Profile']
+        self.assertTrue(saved.startswith('admin_dashboard/'))
+        view_dir = os.path.join(self.dir, 'admin_dashboard')
+        # 只保留最近两份
+        self.assertEqual(len([name for name in os.listdir(view_dir) if name.endswith('.prof')]), 2)
+        with open(os.path.join(self.dir, saved + '.collapsed'), encoding='utf-8') as f:
+            stack, us = f.readline().rsplit(' ', 1)
+        self.assertGreater(int(us), 0)
+        with open(os.path.join(view_dir, 'hot.jsonl'), encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual((entries[-1]['reason'], entries[-1]['status']), ('header', 200))
+        self.assertTrue(entries[-1]['hot'])
+
+        with override_settings(CLINIC_PROFILE_SAMPLE_RATE=1.0):
+            self.client.get(reverse('statistics'))
+        self.assertTrue(os.path.isdir(os.path.join(self.dir, 'statistics')))
+
+        out = StringIO()
+        call_command('profile_report', '--view', 'admin_dashboard', '--collapsed', self.dir, stdout=out)
+        self.assertIn('== admin_dashboard（2 份', out.getvalue())
+        self.assertIn('admin_dashboard (views.py:', out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'admin_dashboard.collapsed')))
+
+
+class MetricsTests(TransactionTestCase):
+    """指标：每个进程写自己的内存映射文件，/metrics 合并各进程输出 Prometheus 文本格式"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        override = override_settings(CLINIC_METRICS=True, CLINIC_METRICS_DIR=self.dir, CLINIC_METRICS_TOKEN='s3cret')
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(metrics.reset, self.dir)
+        self.dept, self.room, self.doctor, self.patient = create_clinic_data()
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                sample, value = line.rsplit(' ', 1)
+                samples[sample] = float(value)
+        return samples
+
+    def test_requests_and_business_counters(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.client.force_login(self.patient.user)
+        for _ in range(3):
+            self.client.get(reverse('patient_dashboard'))
+        cancel_appointment(Appointment.objects.filter(patient=self.patient, status=0).first().pk, self.patient)
+
+        samples = self.scrape()
+        self.assertEqual(samples['clinic_requests_total{view="patient_dashboard",method="GET"}'], 3)
+        self.assertEqual(samples['clinic_request_duration_seconds_count{view="patient_dashboard"}'], 3)
+        self.assertEqual(samples['clinic_request_duration_seconds_bucket{view="patient_dashboard",le="+Inf"}'], 3)
+        self.assertGreater(samples['clinic_request_queries_sum{view="patient_dashboard"}'], 0)
+        # create_clinic_data：5个预约、5次核验就诊、5笔微信缴费
+        self.assertEqual(samples['clinic_bookings_total'], 5)
+        self.assertEqual(samples['clinic_checkins_total'], 5)
+        self.assertEqual(samples['clinic_payments_total{method="微信"}'], 5)
+        self.assertEqual(samples['clinic_payment_amount_yuan_total{method="微信"}'], 500)
+        self.assertEqual(samples['clinic_cancellations_total'], 1)
+
+    def test_without_token_staff_only(self):
+        with override_settings(CLINIC_METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.client.force_login(self.patient.user)
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.client.force_login(self.doctor.user)
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '# TYPE clinic_payment_amount_yuan_total counter')
+
+    def test_merge_worker_files(self):
+        metrics.BOOKINGS.inc(2)
+        metrics.REQUEST_LATENCY.observe(0.03, view='x')
+        # 另一个 worker 的文件：同名样本相加
+        other = metrics.MmapValues(os.path.join(self.dir, 'metrics-999999999.db'))
+        for key in metrics.REQUEST_LATENCY._keys[(('view', 'x'),)][3:]:
+            other.add(key, 1)
+        other.add(metrics.BOOKINGS._key('clinic_bookings_total'), 1)
+        other.close()
+        families = metrics.collect()
+        self.assertEqual(families['clinic_bookings_total']['clinic_bookings_total'], 5 + 3)
+        latency = families['clinic_request_duration_seconds']
+        self.assertEqual(latency['clinic_request_duration_seconds_bucket{view="x",le="0.025"}'], 0)
+        self.assertEqual(latency['clinic_request_duration_seconds_bucket{view="x",le="0.05"}'], 2)
+        self.assertEqual(latency['clinic_request_duration_seconds_count{view="x"}'], 2)
+
+
+class AdminLargeTableTests(TestCase):
+    """后台大表：列表页查询数不随行数增长、游标翻页、计数上限、日期层级按索引查找"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        cls.admin = User.objects.create_superuser('admin', password='123456')
+        # 缴费日期分散到不同的年、月、日
+        for i, pay_id in enumerate(Payment.objects.order_by('pay_id').values_list('pay_id', flat=True)):
+            Payment.objects.filter(pk=pay_id).update(pay_date=datetime(2024 + i // 3, 1 + i, 10 + i % 2).date())
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_visits(self, count):
+        for _ in range(count):
+            record = MedicalRecord.objects.create(patient=self.patient, doctor=self.doctor, room=self.room)
+            Payment.objects.create(record=record, total_amount=Decimal('50'), pay_method='现金')
+
+    def test_changelist_queries_do_not_grow(self):
+        urls = ['/admin/clinic/payment/', '/admin/clinic/medicalrecord/', '/admin/clinic/appointment/',
+                '/admin/clinic/schedule/', '/admin/clinic/clinicroom/', '/admin/clinic/doctor/']
+        before = {}
+        for url in urls:
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            before[url] = len(ctx)
+        self.add_visits(5)
+        # 新缴费落在已有的日期上，日期层级的查询数不变
+        Payment.objects.filter(pay_method='现金').update(pay_date='2024-01-10')
+        for url in urls:
+            with self.assertNumQueries(before[url]):
+                self.client.get(url)
+
+    def test_keyset_navigation(self):
+        self.add_visits(3)
+        expected = list(Payment.objects.order_by('-pay_date', '-pay_id').values_list('pay_id', flat=True))
+        with mock.patch.object(admin.PaymentAdmin, 'list_per_page', 3):
+            cl = self.client.get('/admin/clinic/payment/').context['cl']
+            seen = [p.pay_id for p in cl.result_list]
+            pages = [cl]
+            while cl.next_url:
+                cl = self.client.get('/admin/clinic/payment/' + cl.next_url).context['cl']
+                seen += [p.pay_id for p in cl.result_list]
+                pages.append(cl)
+            self.assertEqual(seen, expected)
+            self.assertEqual(len(pages), 3)
+            self.assertEqual(pages[-1].page_num, -1)
+            self.assertNotIn('after', pages[-1].get_query_string())
+            # 从最后一页往前翻回到第二页
+            cl = self.client.get('/admin/clinic/payment/' + pages[-1].prev_url).context['cl']
+            self.assertEqual([p.pay_id for p in cl.result_list], expected[3:6])
+            # 游标与日期层级、筛选条件一起使用
+            response = self.client.get('/admin/clinic/payment/', {'pay_method__exact': '微信', 'after': pages[0].next_cursor})
+            self.assertEqual(
+                [p.pay_id for p in response.context['cl'].result_list],
+                [pk for pk in expected[3:] if Payment.objects.get(pk=pk).pay_method == '微信'][:3],
+            )
+
+    @override_settings(CLINIC_ADMIN_COUNT_LIMIT=3)
+    def test_count_limit_and_estimate(self):
+        response = self.client.get('/admin/clinic/payment/', {'pay_method__exact': '微信'})
+        cl = response.context['cl']
+        self.assertEqual(cl.result_count, 3)
+        self.assertTrue(cl.paginator.truncated)
+        self.assertContains(response, '3+ 缴费记录')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE clinic_payment')
+        self.add_visits(2)
+        cl = self.client.get('/admin/clinic/payment/').context['cl']
+        # 统计信息是 ANALYZE 那一刻的行数
+        self.assertEqual(cl.result_count, 5)
+        self.assertTrue(cl.paginator.estimated)
+
+    def test_seek_dates_match_django(self):
+        for kind in ('year', 'month', 'day'):
+            for queryset in (Payment.objects.all(), Payment.objects.filter(pay_date__gte='2025-01-01')):
+                seek = admin.SeekDatesQuerySet(model=Payment, query=queryset.query)
+                self.assertEqual(seek.dates('pay_date', kind), list(queryset.dates('pay_date', kind)))
+                self.assertEqual(seek.dates('pay_date', kind, 'DESC'), list(queryset.dates('pay_date', kind, 'DESC')))
+        seek = admin.SeekDatesQuerySet(model=Payment)
+        self.assertEqual(
+            seek.aggregate(first=Min('pay_date'), last=Max('pay_date')),
+            Payment.objects.aggregate(first=Min('pay_date'), last=Max('pay_date')),
+        )
+        response = self.client.get('/admin/clinic/payment/', {'pay_date__year': 2025})
+        self.assertContains(response, '?pay_date__month=4&amp;pay_date__year=2025')
+
+    def test_foreign_key_widgets(self):
+        payment = Payment.objects.first()
+        response = self.client.get(reverse('admin:clinic_payment_change', args=[payment.pk]))
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+        response = self.client.get(reverse('admin:clinic_medicalrecord_add'))
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(response, f'>{self.patient.name}</option>')
+
+
+class AvailabilityTests(TransactionTestCase):
+    """余号表：建一次放缓存，预约/取消增量更新，排班变动后重建；预约页和 API 读取时不查排班"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.dept, self.room, self.doctor, self.patient = create_clinic_data()
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        # 明天上午再加一个30号的半天排班（create_clinic_data 的排班是全天）
+        other = Doctor.objects.create(
+            user=User.objects.create_user('doctor2', password='123456'),
+            name='李四', dept=self.dept, title='医师', mobile='13800138001'
+        )
+        self.morning = Schedule.objects.create(
+            doctor=other, room=self.room, schedule_date=self.tomorrow, time_slot='上午（8:00-12:00）', capacity=2
+        )
+
+    def tomorrow_summary(self):
+        with self.assertNumQueries(0):
+            departments = availability.get_map().summary(dept_id=self.dept.pk)
+        return departments[0]['days'][1]
+
+    def test_map_and_incremental_updates(self):
+        availability.get_map()
+        day = self.tomorrow_summary()
+        self.assertEqual(day['date'], self.tomorrow)
+        self.assertEqual(day['seats'], 32)
+        self.assertEqual(day['open'], ['00:00-24:00'])
+        self.assertTrue(day['mask'] >> 16 & 1)
+
+        arrival = timezone.make_aware(datetime.combine(self.tomorrow, datetime.min.time())) + timedelta(hours=9)
+        appointment = book_appointment(self.patient, self.dept, arrival)
+        self.assertEqual(self.tomorrow_summary()['seats'], 31)
+        cancel_appointment(appointment.pk, self.patient)
+        self.assertEqual(self.tomorrow_summary()['seats'], 32)
+
+        # 半天排班约满后，上午的格子只剩全天排班的余号
+        full_day = Schedule.objects.get(doctor=self.doctor, schedule_date=self.tomorrow)
+        availability.get_map().adjust(full_day.pk, -30)
+        self.assertEqual(availability.AvailabilityMap.build(self.tomorrow - timedelta(days=1)).cells[(self.dept.pk, 1)][16], 32)
+
+    def test_schedule_changes_rebuild(self):
+        availability.get_map()
+        self.morning.capacity = 5
+        self.morning.save()
+        self.assertEqual(availability.get_map().summary(dept_id=self.dept.pk)[0]['days'][1]['seats'], 35)
+        # 批量发布排班不触发 post_save，同样要重建
+        room = ClinicRoom.objects.create(room_id='203', dept=self.dept, location='2楼203室')
+        accepted, clashes = rota.publish([rota.Shift(None, self.morning.doctor_id, room.pk, self.tomorrow, '19:00-21:00', 4, 1)])
+        self.assertEqual((len(accepted), clashes), (1, []))
+        day = availability.get_map().summary(dept_id=self.dept.pk)[0]['days'][1]
+        self.assertEqual(day['seats'], 39)
+
+    def test_past_and_late_slots_are_closed(self):
+        now = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time())) + timedelta(hours=10)
+        days = availability.AvailabilityMap.build(timezone.localdate()).summary(now=now, dept_id=self.dept.pk)[0]['days']
+        self.assertEqual(days[0]['open'], ['10:00-24:00'])
+        self.assertEqual(days[-1]['open'], ['00:00-10:30'])
+
+    def test_high_capacity_department(self):
+        # 同一格子的余号之和超过 65535（array('H') 的上限）时仍能建表
+        Schedule.objects.create(
+            doctor=self.morning.doctor, room=self.room, schedule_date=self.tomorrow, time_slot='全天', capacity=70000
+        )
+        availability.get_map()
+        self.assertEqual(self.tomorrow_summary()['seats'], 70032)
+        self.assertEqual(availability.get_map().cells[(self.dept.pk, 1)][16], 70032)
+        self.client.force_login(self.patient.user)
+        response = self.client.get(reverse('api_availability'), {'dept': self.dept.pk})
+        self.assertEqual(response.json()['departments'][0]['days'][1]['seats'], 70032)
+        self.assertContains(self.client.get(reverse('patient_appointment')), '余70032')
+
+    def test_booking_page_and_api(self):
+        self.client.force_login(self.patient.user)
+        response = self.client.get(reverse('patient_appointment'))
+        self.assertContains(response, '未来7天余号')
+        self.assertContains(response, '余32')
+        with self.assertNumQueries(2):  # 会话、用户
+            response = self.client.get(reverse('api_availability'), {'dept': self.dept.pk})
+        data = response.json()
+        self.assertEqual(data['slot_minutes'], 30)
+        self.assertEqual(data['departments'][0]['days'][1]['date'], self.tomorrow.isoformat())
+        self.assertEqual(data['departments'][0]['days'][1]['seats'], 32)
+        self.assertEqual(self.client.get(reverse('api_availability'), {'dept': 'x'}).status_code, 400)
+
+
+@skipUnless(analytics.np, '需要 numpy')
+class AnalyticsTests(TestCase):
+    """统计分析：numpy 分块按列计算与逐行 ORM 实现结果一致；统计子页面和命令行"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept, cls.room, cls.doctor, cls.patient = create_clinic_data()
+        cls.admin = User.objects.create_superuser('admin', password='123456')
+        cls.today = timezone.localdate()
+        # 小明的前两次就诊挪到三个月前，本月再来就是老患者
+        old = timezone.now() - timedelta(days=95)
+        for record in MedicalRecord.objects.order_by('pk')[:2]:
+            MedicalRecord.objects.filter(pk=record.pk).update(visit_time=old, visit_date=timezone.localdate(old))
+            Payment.objects.filter(record=record).update(pay_time=old, pay_date=timezone.localdate(old))
+        # 闰日出生的女童、高龄的“其他”性别患者；女童本月首诊
+        cls.girl = Patient.objects.create(
+            user=User.objects.create_user('patient2', password='123456'), name='小红', gender='女',
+            id_card='110101202002291234', mobile='13600136001', birth_date='2020-02-29'
+        )
+        Patient.objects.create(
+            user=User.objects.create_user('patient3', password='123456'), name='老李', gender='其他',
+            id_card='110101194006151234', mobile='13600136002', birth_date='1940-06-15'
+        )
+        record = MedicalRecord.objects.create(patient=cls.girl, doctor=cls.doctor, room=cls.room)
+        Payment.objects.create(record=record, total_amount=Decimal('50.5'), medical_insurance=Decimal('0'), pay_method='现金')
+        cls.start, cls.end = analytics.default_range()
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_matches_orm_loops(self):
+        for name, (title, vectorised, loop) in analytics.REPORTS.items():
+            with self.subTest(report=name):
+                self.assertEqual(vectorised(self.start, self.end), loop(self.start, self.end))
+
+    def test_ages_and_repeat_visits(self):
+        end = datetime(2026, 2, 28).date()
+        rows = {row[0]: row[1:4] for row in analytics.age_distribution(end, end)['rows']}
+        # 2020-02-29 出生，2026-02-28 还不满6周岁
+        self.assertEqual(rows['0-6岁'], [0, 1, 0])
+        self.assertEqual(rows['35-59岁'], [1, 0, 0])
+        self.assertEqual(rows['80岁及以上'], [0, 0, 1])
+
+        result = analytics.repeat_visits(self.start, self.end)
+        summary = dict(result['summary'])
+        self.assertEqual((summary['就诊人次'], summary['就诊患者'], summary['多次就诊患者']), (6, 2, 1))
+        self.assertEqual(summary['复诊率（%）'], 50.0)
+        self.assertEqual(summary['就诊5次及以上'], 1)
+        # 本月：小明是老患者，小红是新患者
+        self.assertEqual(result['rows'][-1], [self.today.strftime('%Y-%m'), 4, 2, 1, 50.0])
+
+    def test_revenue_and_insurance(self):
+        summary = dict(analytics.insurance_trend(self.start, self.end)['summary'])
+        self.assertEqual(summary['总金额（元）'], Decimal('550.50'))
+        self.assertEqual(summary['医保占比（%）'], 36.3)
+        rows = analytics.cohort_revenue(self.start, self.end)['rows']
+        month = self.today.strftime('%Y-%m')
+        self.assertEqual([row for row in rows if row[0] == month], [[month, 1, 1, Decimal('50.50'), Decimal('50.50')]])
+        self.assertEqual(rows[0][1:4], [1, 1, Decimal('500.00')])
+
+    def test_pages(self):
+        self.client.force_login(self.admin)
+        self.assertContains(self.client.get(reverse('statistics')), reverse('statistics_report', args=['cohorts']))
+        response = self.client.get(reverse('statistics_report', args=['repeat']))
+        self.assertContains(response, '复诊率')
+        self.assertEqual(response.context['result'], analytics.repeat_visits(self.start, self.end))
+        # 第二次读缓存，不再查就诊记录
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('statistics_report', args=['repeat']))
+        self.assertFalse([q for q in queries if 'medicalrecord' in q['sql']])
+        self.assertEqual(self.client.get(reverse('statistics_report', args=['nope'])).status_code, 404)
+
+        cache.clear()
+        with mock.patch.object(analytics, 'np', None):
+            self.assertContains(self.client.get(reverse('statistics_report', args=['ages'])), '需要安装 numpy')
+
+    def test_command(self):
+        out = StringIO()
+        call_command('analytics', 'insurance', '--json', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['insurance']['summary'][1], ['总金额（元）', '550.50'])
+        err = StringIO()
+        call_command('analytics', '--benchmark', stderr=err)
+        self.assertEqual(err.getvalue().count('结果一致'), len(analytics.REPORTS))
+        with self.assertRaises(CommandError):
+            call_command('analytics', 'nope')
@@ -0,0 +1,51 @@
+import random
+import time
+from functools import wraps
+
+from django.db import OperationalError, transaction
+
+# SQLite 写锁冲突时的重试次数与退避时间（秒）
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.05
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def is_locked(exc):
+    return 'locked' in str(exc) or 'busy' in str(exc)
+
+
+def retry_locked(func, *args, **kwargs):
+    """
+    写高峰时 SQLite 可能短暂锁库，按指数退避（带抖动）重试几次。
+    func 应当自带事务：失败时整体回滚，重试才是安全的。
+    """
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as exc:
+            if not is_locked(exc) or attempt == LOCK_RETRIES - 1:
+                raise
+            time.sleep(LOCK_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def write_transaction(view_func):
+    """
+    写操作视图装饰器：POST 等请求的整个视图在一个事务里执行，锁冲突时整体重试；
+    GET 请求不开事务。配合 transaction_mode=IMMEDIATE，事务一开始就拿到写锁，
+    先读后写的流程（核验预约、缴费）不会被并发的同类请求插队。
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return view_func(request, *args, **kwargs)
+
+        def run():
+            with transaction.atomic():
+                return view_func(request, *args, **kwargs)
+
+        # 已经在外层事务里时无法单独重试，直接执行
+        if transaction.get_connection().in_atomic_block:
+            return view_func(request, *args, **kwargs)
+        return retry_locked(run)
+    return wrapper
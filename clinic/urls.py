@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     # 通用路由
@@ -23,15 +23,36 @@ urlpatterns = [
     path('reception/payment/', views.reception_payment, name='payment'),
     path('reception/visit/list/', views.reception_visit_list, name='reception_visit_list'),
     path('reception/payment/list/', views.reception_payment_list, name='reception_payment_list'),
+    path('reception/payment/export/', views.reception_payment_export, name='reception_payment_export'),
+    path('reception/visit/export/', views.reception_visit_export, name='reception_visit_export'),
+    path('reception/patient/search/', views.reception_patient_search, name='reception_patient_search'),
+    # 候诊队列看板；事件流在 ASGI 下由 hospital_management/asgi.py 分派给 clinic.queue_board.stream_app
+    path('reception/queue/', views.reception_queue_board, name='reception_queue_board'),
+    path('reception/queue/stream/', views.reception_queue_stream, name='reception_queue_stream'),
 
     # 管理员路由（补充缺失的路由名）
     path('admin/dashboard/', views.admin_dashboard, name='admin_dashboard'),
     # 修复3：添加 schedule_management 路由名（匹配模板）
     path('admin/schedule/', views.admin_schedule, name='schedule_management'),
+    path('admin/schedule/rollout/', views.admin_schedule_rollout, name='schedule_rollout'),
     # 修复4：添加 statistics 路由名（匹配模板）
     path('admin/statistics/', views.admin_statistics, name='statistics'),
+    path('admin/statistics/<slug:report>/', views.admin_statistics_report, name='statistics_report'),
 
     # 新增医生首页路由
     path('doctor/dashboard/', views.doctor_dashboard, name='doctor_dashboard'),
+    path('doctor/record/search/', views.doctor_record_search, name='doctor_record_search'),
+
+    # JSON API（自助机、移动端）：?fields= 选择字段，?after= / ?before= 游标翻页
+    path('api/departments/', api.api_departments, name='api_departments'),
+    path('api/schedules/', api.api_schedules, name='api_schedules'),
+    path('api/availability/', api.api_availability, name='api_availability'),
+    path('api/appointments/', api.api_appointments, name='api_appointments'),
+    path('api/appointments/<int:appt_id>/cancel/', api.api_appointment_cancel, name='api_appointment_cancel'),
+    path('api/records/', api.api_records, name='api_records'),
+    path('api/payments/', api.api_payments, name='api_payments'),
+
+    # Prometheus 指标（CLINIC_METRICS=1 时开启）
+    path('metrics', views.metrics_endpoint, name='metrics'),
     
 ]
\ No newline at end of file
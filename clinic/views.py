@@ -1,30 +1,53 @@
 from functools import wraps
 from datetime import datetime, timedelta
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.db.models import Count, Sum
 from django.contrib import messages  # 新增：用于提示信息
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from .models import Patient 
 
 from .models import (
     Department, ClinicRoom, Doctor, Patient,
-    Schedule, Appointment, MedicalRecord, Payment
+    Schedule, Appointment, MedicalRecord, Payment, AppointmentHistory, MedicalRecordHistory
 )
-from .forms import PaymentForm, AppointmentForm
+from .forms import PaymentForm, AppointmentForm, RotaForm, ScheduleForm
+from .pagination import KeysetPaginator
+from .exports import EXPORT_FORMATS, iter_export, parse_date
+from . import analytics, availability, counters, metrics, queue_board, rollups, rota, search
+from .assignment import AssignmentError
+from .booking import BookingError, book_appointment, cancel_appointment
+from .frontdesk import check_in, settle
+from .replica import replica_reads
+from .page_versions import patient_conditional
+from .roles import get_role, is_admin_user, is_reception_user
+from .transactions import write_transaction
+
+# 就诊记录列表每页条数
+VISIT_LIST_PAGE_SIZE = 50
+# 数据统计默认展示的天数
+STATISTICS_DEFAULT_DAYS = 30
+# 排班列表、批量排班冲突列表最多展示的条数
+SCHEDULE_LIST_LIMIT = 200
 
 # ==================== 权限装饰器 ====================
 def patient_required(view_func):
+    """患者ID取自 request.role（session缓存），request.patient 用到时才查库"""
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
         if request.user.is_authenticated:
-            try:
-                request.patient = request.user.patient
-                return view_func(request, *args, **kwargs)
-            except Patient.DoesNotExist:
+            patient_id = request.role.patient_id
+            if patient_id is None:
                 return redirect('patient_profile')
+            request.patient_id = patient_id
+            request.patient = SimpleLazyObject(lambda: Patient.objects.get(pk=patient_id))
+            return view_func(request, *args, **kwargs)
         return redirect('login')
     return wrapper
 
@@ -32,7 +55,7 @@ def patient_required(view_func):
 def reception_required(view_func):
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
-        if request.user.is_authenticated and request.user.is_staff and not request.user.is_superuser:
+        if is_reception_user(request.user):
             return view_func(request, *args, **kwargs)
         return redirect('login')
     return wrapper
@@ -40,7 +63,7 @@ def reception_required(view_func):
 def admin_required(view_func):
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
-        if request.user.is_authenticated and request.user.is_superuser:
+        if is_admin_user(request.user):
             return view_func(request, *args, **kwargs)
         return redirect('login')
     return wrapper
@@ -63,30 +86,12 @@ def login_view(request):
         user = authenticate(request, username=username, password=password)
         if user:
             login(request, user)
-            # 按角色精准跳转，补充医生角色判断（通过user.groups或自定义字段）
-            if user.is_superuser:
-                # 超级管理员 → 管理员首页
-                return redirect('admin_dashboard')
-            elif user.is_staff:
-                # 区分医生和前台（推荐用用户组，若无则先跳前台/医生通用首页）
-                # 方式1：通过用户组判断（需先在后台给医生/前台建对应组）
-                if user.groups.filter(name='医生').exists():
-                    return redirect('doctor_dashboard')  # 医生首页
-                elif user.groups.filter(name='前台').exists():
-                    return redirect('reception_dashboard')  # 前台首页
-                # 方式2：无用户组时，默认跳前台首页（兼容原有逻辑）
-                else:
-                    return redirect('reception_dashboard')
-            else:
-                # 普通患者：先检查是否完善信息
-                try:
-                    # 已完善患者信息 → 患者首页
-                    request.user.patient
-                    return redirect('patient_dashboard')
-                except Patient.DoesNotExist:
-                    # 未完善信息 → 跳信息完善页
-                    messages.info(request, '请先完善您的患者信息')
-                    return redirect('patient_profile')
+            # 按角色精准跳转（角色解析一次后缓存在session中，见 clinic/roles.py）
+            role = get_role(request)
+            if role.is_patient and not role.patient_id:
+                # 未完善信息 → 跳信息完善页
+                messages.info(request, '请先完善您的患者信息')
+            return redirect(role.home_url_name())
         else:
             return render(request, 'registration/login.html', {'error': '用户名或密码错误'})
     return render(request, 'registration/login.html')
@@ -99,29 +104,21 @@ def logout_view(request):
 @login_required
 def dashboard(request):
     """通用首页路由，按角色分发到对应专属首页"""
-    if request.user.is_superuser:
-        return redirect('admin_dashboard')
-    elif request.user.is_staff:
-        # 同样区分医生/前台
-        if request.user.groups.filter(name='医生').exists():
-            return redirect('doctor_dashboard')
-        else:
-            return redirect('reception_dashboard')
-    else:
+    role = request.role
+    if role.is_patient and not role.patient_id:
         # 患者：强制检查信息完善状态
-        try:
-            request.user.patient
-            return redirect('patient_dashboard')
-        except Patient.DoesNotExist:
-            messages.info(request, '请先完善您的患者信息')
-            return redirect('patient_profile')
+        messages.info(request, '请先完善您的患者信息')
+    return redirect(role.home_url_name())
 
 # ==================== 患者视图 ====================
 @login_required
 @patient_required
+@patient_conditional
 def patient_dashboard(request):
     # 修复：确保待就诊列表包含所有未就诊预约（不限制数量，原逻辑保留切片但确保新预约能显示）
-    upcoming_appointments = request.patient.appointment_set.filter(status=0).order_by('arrival_time')[:3]
+    upcoming_appointments = Appointment.objects.filter(
+        patient_id=request.patient_id, status=0
+    ).select_related('dept').order_by('arrival_time')[:3]
     return render(request, 'clinic/patient/dashboard.html', {
         'upcoming_appointments': upcoming_appointments
     })
@@ -167,33 +164,24 @@ def patient_appointment(request):
     """修复：确保提交后正确跳转并提示成功信息"""
     form = AppointmentForm(request.POST or None)
     depts = Department.objects.all()
+    # 未来几天各科室的余号，从缓存的余号表读取，患者先看好有号的时段再提交
+    open_slots = availability.get_map().summary()
     
     if request.method == 'POST':
         if form.is_valid():
             dept = form.cleaned_data['dept']
             arrival_time = form.cleaned_data['arrival_time']
-            
-            conflict = Appointment.objects.filter(
-                patient=request.patient,
-                status=0,
-                arrival_time__date=arrival_time.date()
-            ).exists()
-            
-            if conflict:
+
+            # 按排班号源占号（条件UPDATE + 事务），同日冲突检查也在同一事务内
+            try:
+                book_appointment(request.patient, dept, arrival_time)
+            except BookingError as e:
                 return render(request, 'clinic/patient/appointment.html', {
                     'form': form,
                     'depts': depts,
-                    'error': '您当天已有未完成的预约，请先处理后再新增'
+                    'availability': open_slots,
+                    'error': str(e)
                 })
-            
-            # 创建预约
-            Appointment.objects.create(
-                patient=request.patient,
-                dept=dept,
-                appt_time=timezone.now(),
-                arrival_time=arrival_time,
-                status=0  # 0=未就诊
-            )
             # 新增：添加成功提示
             messages.success(request, "预约提交成功！")
             # 修复：提交后返回患者首页（原逻辑跳转到列表，根据需求调整）
@@ -202,30 +190,40 @@ def patient_appointment(request):
             return render(request, 'clinic/patient/appointment.html', {
                 'form': form,
                 'depts': depts,
+                'availability': open_slots,
                 'error': '请检查填写的信息是否正确'
             })
     
     return render(request, 'clinic/patient/appointment.html', {
         'form': form,
-        'depts': depts
+        'depts': depts,
+        'availability': open_slots,
     })
 
 @login_required
 @patient_required
+@patient_conditional
 def patient_appointment_list(request):
-    """患者预约列表（保持不变，为模板提供数据）"""
-    appointments = Appointment.objects.filter(patient=request.patient).order_by('-appt_time')
-    return render(request, 'clinic/patient/appointment_list.html', {'appointments': appointments})
+    """患者预约列表（保持不变，为模板提供数据）；archive=1 时包含已归档的预约"""
+    include_archive = request.GET.get('archive') == '1'
+    model = AppointmentHistory if include_archive else Appointment
+    appointments = model.objects.filter(patient_id=request.patient_id).select_related('dept').order_by('-appt_time')
+    return render(request, 'clinic/patient/appointment_list.html', {
+        'appointments': appointments, 'include_archive': include_archive
+    })
 
 @login_required
 @patient_required
+@patient_conditional
 def appointment_detail(request, appt_id):
     """查看预约详情（修复：用appt_id查询，匹配模型主键）"""
     # 修复：查询条件用 appt_id=appt_id（不是 id=appt_id）
+    # 从归档列表点进来时带 archive=1，查热表 + 归档表
+    model = AppointmentHistory if request.GET.get('archive') == '1' else Appointment
     appointment = get_object_or_404(
-        Appointment, 
+        model.objects.select_related('patient', 'dept'),
         appt_id=appt_id,  # 关键：模型主键是appt_id，不是id
-        patient=request.patient
+        patient_id=request.patient_id
     )
     return render(request, 'clinic/patient/appointment_detail.html', {
         'appointment': appointment
@@ -235,14 +233,9 @@ def appointment_detail(request, appt_id):
 @patient_required
 def appointment_cancel(request, appt_id):
     """取消预约（修复：用appt_id查询）"""
-    appointment = get_object_or_404(
-        Appointment, 
-        appt_id=appt_id,  # 关键：模型主键是appt_id
-        patient=request.patient,
-        status=0  # 仅允许取消未就诊状态
-    )
-    appointment.status = 2  # 2=已取消
-    appointment.save()
+    # 仅允许取消未就诊状态；取消的同时释放占用的号源
+    if not cancel_appointment(appt_id, request.patient_id):
+        raise Http404('预约不存在或已无法取消')
     messages.success(request, "预约已成功取消")
     return redirect('patient_appointment_list')
 
@@ -251,9 +244,10 @@ def appointment_cancel(request, appt_id):
 @login_required
 @reception_required
 def reception_dashboard(request):
-    today = datetime.now().date()
-    today_visits = MedicalRecord.objects.filter(visit_time__date=today).count()
-    today_payments = Payment.objects.filter(pay_time__date=today).aggregate(total=Sum('total_amount'))['total'] or 0
+    # 计数器读缓存，数据变动后由模型信号失效重算，平时不做聚合查询
+    today = timezone.localdate()
+    today_visits = counters.get('day_visits', today)
+    today_payments = counters.get('day_payments', today)
     return render(request, 'clinic/reception/dashboard.html', {
         'today_visits': today_visits,
         'today_payments': today_payments
@@ -261,32 +255,27 @@ def reception_dashboard(request):
 
 @login_required
 @reception_required
+@write_transaction
 def reception_verify_appointment(request):
     """前台预约核验"""
     if request.method == 'POST':
         appt_id = request.POST.get('appt_id')
         try:
-            appointment = Appointment.objects.get(id=appt_id, status=0)
-            # 生成就诊记录
-            MedicalRecord.objects.create(
-                patient=appointment.patient,
-                doctor=Doctor.objects.filter(dept=appointment.dept, work_status=True).first(),
-                room=ClinicRoom.objects.filter(dept=appointment.dept).first(),
-                visit_time=datetime.now(),
-                visit_status=0  # 0=就诊中
-            )
-            # 更新预约状态为已完成
-            appointment.status = 1
-            appointment.save()
+            check_in(appt_id)
             return redirect('reception_visit_list')
         except Appointment.DoesNotExist:
             return render(request, 'clinic/reception/verify_appointment.html', {
                 'error': '预约ID不存在或已完成/取消'
             })
+        except AssignmentError as e:
+            return render(request, 'clinic/reception/verify_appointment.html', {
+                'error': str(e)
+            })
     return render(request, 'clinic/reception/verify_appointment.html')
 
 @login_required
 @reception_required
+@write_transaction
 def reception_payment(request):
     """前台缴费结算"""
     if request.method == 'POST':
@@ -296,50 +285,147 @@ def reception_payment(request):
         pay_method = request.POST.get('pay_method')
         
         try:
-            record = MedicalRecord.objects.get(id=record_id, visit_status=0)
-            # 创建缴费记录
-            Payment.objects.create(
-                record=record,
-                total_amount=float(total_amount),
-                medical_insurance=float(medical_insurance),
-                self_pay=float(total_amount) - float(medical_insurance),
-                pay_method=pay_method,
-                pay_time=datetime.now()
-            )
-            # 更新就诊状态为已离院
-            record.visit_status = 1
-            record.save()
+            settle(record_id, float(total_amount), float(medical_insurance), pay_method)
             return redirect('reception_payment_list')
         except MedicalRecord.DoesNotExist:
             return render(request, 'clinic/reception/payment.html', {
-                'error': '就诊记录不存在或已缴费'
+                'form': PaymentForm(request.POST), 'error': '就诊记录不存在或已缴费'
             })
     return render(request, 'clinic/reception/payment.html', {'form': PaymentForm()})
 
 
 @login_required
 @reception_required
+@replica_reads
 def reception_visit_list(request):
-    visit_records = MedicalRecord.objects.all().order_by('-visit_time')
-    return render(request, 'clinic/reception/visit_list.html', {'visit_records': visit_records})
+    """就诊记录列表：按 (visit_time, record_id) 游标分页，支持按日期、医生筛选；archive=1 时包含已归档的记录"""
+    include_archive = request.GET.get('archive') == '1'
+    model = MedicalRecordHistory if include_archive else MedicalRecord
+    visit_records = model.objects.select_related('patient', 'doctor', 'room__dept')
+
+    visit_date = request.GET.get('date') or ''
+    doctor_id = request.GET.get('doctor') or ''
+    if visit_date:
+        try:
+            day = datetime.strptime(visit_date, '%Y-%m-%d').date()
+        except ValueError:
+            visit_date = ''
+        else:
+            # 用时间范围代替 visit_time__date，避免对列套函数导致索引失效
+            day_start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+            visit_records = visit_records.filter(
+                visit_time__gte=day_start,
+                visit_time__lt=day_start + timedelta(days=1)
+            )
+    if doctor_id.isdigit():
+        visit_records = visit_records.filter(doctor_id=int(doctor_id))
+    else:
+        doctor_id = ''
+
+    paginator = KeysetPaginator(visit_records, keys=('visit_time', 'record_id'), per_page=VISIT_LIST_PAGE_SIZE)
+    page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+
+    # 翻页链接保留筛选条件
+    filters = request.GET.copy()
+    filters.pop('after', None)
+    filters.pop('before', None)
+    return render(request, 'clinic/reception/visit_list.html', {
+        'visit_records': page,
+        'page': page,
+        'doctors': Doctor.objects.only('id', 'name').order_by('name'),
+        'selected_date': visit_date,
+        'selected_doctor': doctor_id,
+        'include_archive': include_archive,
+        'filter_query': filters.urlencode(),
+    })
 
 @login_required
 @reception_required
+@replica_reads
 def reception_payment_list(request):
-    payments = Payment.objects.all().order_by('-pay_time')
+    payments = Payment.objects.select_related('record__patient').order_by('-pay_time')
     return render(request, 'clinic/reception/payment_list.html', {'payments': payments})
 
+def _export_response(request, kind):
+    """流式导出：边查边写，导出百万行也不会占满内存"""
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        fmt = 'csv'
+    chunks = iter_export(
+        kind, fmt,
+        start=parse_date(request.GET.get('start')),
+        end=parse_date(request.GET.get('end')),
+        include_archive=request.GET.get('archive') == '1'
+    )
+    content_type = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson; charset=utf-8'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    filename = f"{kind}_{timezone.localtime().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+@reception_required
+@replica_reads
+def reception_payment_export(request):
+    """导出缴费记录（?format=csv|jsonl&start=YYYY-MM-DD&end=YYYY-MM-DD，archive=1 连同归档记录）"""
+    return _export_response(request, 'payments')
+
+@login_required
+@reception_required
+@replica_reads
+def reception_visit_export(request):
+    """导出就诊记录（参数同缴费导出）"""
+    return _export_response(request, 'visits')
+
+@login_required
+@reception_required
+@replica_reads
+def reception_patient_search(request):
+    """按姓名、手机号或身份证号片段查找患者（FTS5 全文索引）"""
+    query = request.GET.get('q', '').strip()
+    return render(request, 'clinic/reception/patient_search.html', {
+        'query': query,
+        'patients': search.search_objects('patient', query) if query else [],
+        'searchable': bool(search.match_expression(query)),
+    })
+
+@login_required
+@reception_required
+def reception_queue_board(request):
+    """候诊队列看板：页面订阅队列事件流实时更新，不再定时刷新整页"""
+    dept_id = queue_board.parse_id(request.GET.get('dept'))
+    stream_url = reverse('reception_queue_stream')
+    if dept_id is not None:
+        stream_url += f'?dept={dept_id}'
+    return render(request, 'clinic/reception/queue_board.html', {
+        'depts': Department.objects.only('dept_id', 'dept_name').order_by('dept_id'),
+        'selected_dept': dept_id,
+        'stream_url': stream_url,
+    })
+
+@login_required
+@reception_required
+def reception_queue_stream(request):
+    """
+    队列事件流（text/event-stream）。ASGI 部署时该路径由 queue_board.stream_app 接管并保持长连接；
+    这里是 WSGI 下的兜底：每次只发一份当前快照，浏览器按 retry 间隔重连。
+    """
+    dept_id = queue_board.parse_id(request.GET.get('dept'))
+    body = f'retry: {queue_board.RETRY_MS}\n\n'.encode() + queue_board.snapshot_event(queue_board.hub.last_id, dept_id)
+    response = HttpResponse(body, content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
 # ==================== 管理员视图 ====================
 # （所有管理员视图保持不变）
 @login_required
 @admin_required
 def admin_dashboard(request):
-    total_patients = Patient.objects.count()
-    total_doctors = Doctor.objects.count()
-    total_depts = Department.objects.count()
-    today = datetime.now()
-    month_start = datetime(today.year, today.month, 1)
-    month_payments = Payment.objects.filter(pay_time__gte=month_start).aggregate(total=Sum('total_amount'))['total'] or 0
+    # 计数器读缓存，数据变动后由模型信号失效重算，平时不做聚合查询
+    total_patients = counters.get('patients')
+    total_doctors = counters.get('doctors')
+    total_depts = counters.get('depts')
+    month_payments = counters.get('month_payments', counters.month_of(timezone.localdate()))
     
     return render(request, 'clinic/admin/dashboard.html', {
         'total_patients': total_patients,
@@ -351,55 +437,102 @@ def admin_dashboard(request):
 @login_required
 @admin_required
 def admin_schedule(request):
-    schedules = Schedule.objects.all().order_by('-schedule_date')
+    """单条新增排班：与已有排班按医生、诊室检查时间段重叠"""
+    form = ScheduleForm(request.POST or None)
+    error = None
     if request.method == 'POST':
-        doctor_id = request.POST.get('doctor')
-        room_id = request.POST.get('room')
-        schedule_date = request.POST.get('schedule_date')
-        time_slot = request.POST.get('time_slot')
-        status = request.POST.get('status')
-        
-        if not schedule_date:
-            return render(request, 'clinic/admin/schedule.html', {
-                'schedules': schedules,
-                'error': '请选择排班日期'
-            })
-        
-        Schedule.objects.create(
-            doctor=get_object_or_404(Doctor, id=doctor_id),
-            room=get_object_or_404(ClinicRoom, id=room_id),
-            schedule_date=datetime.strptime(schedule_date, '%Y-%m-%d').date(),
-            time_slot=time_slot,
-            status=int(status)
-        )
-        return redirect('admin_schedule')
-    
-    return render(request, 'clinic/admin/schedule.html', {'schedules': schedules})
+        if form.is_valid():
+            data = form.cleaned_data
+            published, clashes = rota.publish([rota.Shift(
+                None, data['doctor'].pk, data['room'].pk, data['schedule_date'],
+                data['time_slot'], data['capacity'], data['status']
+            )])
+            if published:
+                return redirect('schedule_management')
+            error = rota.describe_clash(clashes[0])
+        else:
+            error = '；'.join(message for errors in form.errors.values() for message in errors)
+
+    # 只列最近的排班，按周模板发布后总量会很大
+    schedules = Schedule.objects.select_related('doctor', 'room__dept').order_by(
+        '-schedule_date', 'doctor_id', 'time_slot'
+    )[:SCHEDULE_LIST_LIMIT]
+    return render(request, 'clinic/admin/schedule.html', {
+        'form': form,
+        'schedules': schedules,
+        'error': error,
+    })
+
+@login_required
+@admin_required
+def admin_schedule_rollout(request):
+    """按周模板批量发布排班：先在内存中检查医生、诊室冲突，其余一次性写入；勾选“仅预览”时不写入"""
+    form = RotaForm(request.POST or None)
+    context = {'form': form}
+    if request.method == 'POST' and form.is_valid():
+        schedules = rota.expand(form.cleaned_data['template'], form.cleaned_data['start'], form.cleaned_data['end'])
+        published, clashes = rota.publish(schedules, dry_run=form.cleaned_data['preview'])
+        context.update({
+            'preview': form.cleaned_data['preview'],
+            'published_count': len(published),
+            'clash_count': len(clashes),
+            'clashes': [rota.describe_clash(clash) for clash in clashes[:SCHEDULE_LIST_LIMIT]],
+        })
+    return render(request, 'clinic/admin/schedule_rollout.html', context)
 
 @login_required
 @admin_required
+@replica_reads
 def admin_statistics(request):
-    dept_visits = MedicalRecord.objects.values('doctor__dept__dept_name').annotate(count=Count('id')).order_by('-count')
-    total_visits = sum(item['count'] for item in dept_visits) if dept_visits else 0
-    
-    doctor_payments = Payment.objects.values('record__doctor__name').annotate(
-        total=Sum('total_amount'),
-        medical_insurance__sum=Sum('medical_insurance'),
-        self_pay__sum=Sum('self_pay')
-    ).order_by('-total')
-    
+    """数据统计：读取每日汇总表，支持任意日期范围（默认最近30天）"""
+    end = parse_date(request.GET.get('end')) or timezone.localdate()
+    start = parse_date(request.GET.get('start')) or end - timedelta(days=STATISTICS_DEFAULT_DAYS - 1)
+    if start > end:
+        start, end = end, start
+
+    dept_visits, total_visits = rollups.dept_visit_stats(start, end)
+    doctor_payments = rollups.doctor_payment_stats(start, end)
+
     return render(request, 'clinic/admin/statistics.html', {
         'dept_visits': dept_visits,
         'total_visits': total_visits,
-        'doctor_payments': doctor_payments
+        'doctor_payments': doctor_payments,
+        'reports': [(name, title) for name, (title, _, _) in analytics.REPORTS.items()],
+        'start': start,
+        'end': end
     })
 
+@login_required
+@admin_required
+@replica_reads
+def admin_statistics_report(request, report):
+    """数据统计子页面：年龄分布、复诊率、患者群收入、医保占比趋势（clinic/analytics.py，默认最近12个月）"""
+    if report not in analytics.REPORTS:
+        raise Http404
+    end = parse_date(request.GET.get('end')) or timezone.localdate()
+    start = parse_date(request.GET.get('start')) or analytics.default_range(end)[0]
+    if start > end:
+        start, end = end, start
+
+    context = {
+        'report': report,
+        'title': analytics.REPORTS[report][0],
+        'reports': [(name, title) for name, (title, _, _) in analytics.REPORTS.items()],
+        'start': start,
+        'end': end,
+    }
+    try:
+        context['result'] = analytics.report(report, start, end)
+    except analytics.AnalyticsUnavailable as exc:
+        context['error'] = str(exc)
+    return render(request, 'clinic/admin/statistics_report.html', context)
+
 # ==================== 医生视图 ====================
 @login_required
 def doctor_dashboard(request):
     """医生专属首页（仅staff且属于医生组的用户可访问）"""
     # 权限校验：非医生组的staff用户强制跳前台首页
-    if not request.user.groups.filter(name='医生').exists():
+    if not request.role.is_doctor:
         return redirect('reception_dashboard')
     
     # 医生首页逻辑（示例：显示今日接诊预约）
@@ -411,6 +544,25 @@ def doctor_dashboard(request):
     }
     return render(request, 'clinic/doctor/dashboard.html', context)
 
+@login_required
+@replica_reads
+def doctor_record_search(request):
+    """医生按病情描述、处方检索历史就诊记录（FTS5 全文索引）；archive=1 时包含已归档的记录"""
+    if not request.role.is_doctor:
+        return redirect('reception_dashboard')
+    query = request.GET.get('q', '').strip()
+    include_archive = request.GET.get('archive') == '1'
+    model = MedicalRecordHistory if include_archive else MedicalRecord
+    records = search.search_objects(
+        'record', query, model.objects.select_related('patient', 'doctor')
+    ) if query else []
+    return render(request, 'clinic/doctor/record_search.html', {
+        'query': query,
+        'include_archive': include_archive,
+        'records': records,
+        'searchable': bool(search.match_expression(query)),
+    })
+
 @login_required
 def patient_profile(request):
     """患者信息完善页（仅普通患者可访问）"""
@@ -437,4 +589,22 @@ def patient_profile(request):
         messages.success(request, '信息完善成功！')
         return redirect('patient_dashboard')
     
-    return render(request, 'clinic/patient/profile.html', {'patient': patient})
\ No newline at end of file
+    return render(request, 'clinic/patient/profile.html', {'patient': patient})
+
+
+# ==================== 监控 ====================
+def metrics_endpoint(request):
+    """
+    Prometheus 抓取入口：合并各 worker 进程的指标文件。
+    设置了 CLINIC_METRICS_TOKEN 时须带 Bearer 令牌；未设置时只有登录的员工能看（指标含缴费金额等业务数据）。
+    """
+    if not settings.CLINIC_METRICS:
+        raise Http404('未开启指标')
+    token = settings.CLINIC_METRICS_TOKEN
+    if token:
+        allowed = constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+    else:
+        allowed = request.user.is_authenticated and request.user.is_staff
+    if not allowed:
+        return HttpResponse('未授权', status=401, content_type='text/plain; charset=utf-8')
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_management.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+django_application = get_asgi_application()
+
+# 应用加载完成后才能导入模型和解析路由
+from django.urls import reverse  # noqa: E402
+
+from clinic.queue_board import stream_app  # noqa: E402
+
+# 候诊队列事件流是长连接，交给异步的 stream_app，其余请求照常由 Django 处理
+QUEUE_STREAM_PATH = reverse('reception_queue_stream')
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == QUEUE_STREAM_PATH:
+        return await stream_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -28,15 +28,46 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'clinic.middleware.SQLInstrumentationMiddleware',  # SQL埋点（默认关闭，需覆盖整个请求所以放最前）
+    'clinic.middleware.MetricsMiddleware',  # 请求指标（默认关闭）
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'clinic.middleware.RoleMiddleware',  # 角色解析（缓存在session中）
+    'clinic.middleware.ReplicaMiddleware',  # 记录用户最近写入时间（仅开启只读副本时）
+    'clinic.middleware.ProfilingMiddleware',  # 按需剖析请求（设置、抽样或超级管理员请求头触发）
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# SQL 埋点：设置环境变量 CLINIC_SQL_INSTRUMENTATION=1 开启
+# 每个响应带 Server-Timing 头，耗时超过 CLINIC_SLOW_REQUEST_MS 的请求写入慢请求日志
+CLINIC_SQL_INSTRUMENTATION = os.environ.get('CLINIC_SQL_INSTRUMENTATION') == '1'
+CLINIC_SLOW_REQUEST_MS = int(os.environ.get('CLINIC_SLOW_REQUEST_MS', 500))
+CLINIC_SLOW_REQUEST_LOG = os.environ.get(
+    'CLINIC_SLOW_REQUEST_LOG', os.path.join(BASE_DIR, 'logs', 'slow_requests.jsonl')
+)
+# 同一SQL在一个请求里执行达到这么多次视为 N+1
+CLINIC_REPEATED_SQL_THRESHOLD = 5
+
+# 请求剖析：CLINIC_PROFILE=1 时剖析每个请求，CLINIC_PROFILE_SAMPLE_RATE 按比例抽样（如 0.01），
+# 超级管理员的请求带 X-Clinic-Profile: 1 头时也会剖析。结果按视图名存在 CLINIC_PROFILE_DIR 下，
+# 每个视图保留最近 CLINIC_PROFILE_KEEP 份，用 profile_report 命令合并查看
+CLINIC_PROFILE = os.environ.get('CLINIC_PROFILE') == '1'
+CLINIC_PROFILE_SAMPLE_RATE = float(os.environ.get('CLINIC_PROFILE_SAMPLE_RATE', 0))
+CLINIC_PROFILE_DIR = os.environ.get('CLINIC_PROFILE_DIR', os.path.join(BASE_DIR, 'logs', 'profiles'))
+CLINIC_PROFILE_KEEP = int(os.environ.get('CLINIC_PROFILE_KEEP', 50))
+
+# 指标：CLINIC_METRICS=1 开启。每个 worker 进程把请求数、耗时/SQL条数直方图、错误数和预约/就诊/缴费等业务计数
+# 写入 CLINIC_METRICS_DIR 下自己的内存映射文件，/metrics 合并各进程的文件输出 Prometheus 文本格式。
+# 部署重启时先执行 reset_metrics 清空旧文件再启动 worker；设置 CLINIC_METRICS_TOKEN 后抓取须带 Bearer 令牌，
+# 不设置时只有登录的员工能访问
+CLINIC_METRICS = os.environ.get('CLINIC_METRICS') == '1'
+CLINIC_METRICS_DIR = os.environ.get('CLINIC_METRICS_DIR', os.path.join(BASE_DIR, 'logs', 'metrics'))
+CLINIC_METRICS_TOKEN = os.environ.get('CLINIC_METRICS_TOKEN')
+
 ROOT_URLCONF = 'hospital_management.urls'
 
 TEMPLATES = [
@@ -63,9 +94,83 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),  # 关键：改为字符串路径
+        # 测试库用文件而不是内存库，多线程并发测试才能各自建立连接
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
+# 生产数据库配置：设置环境变量 CLINIC_DB_PROFILE=production 开启
+# WAL 模式下读写互不阻塞；写事务以 BEGIN IMMEDIATE 开始，锁等待交给 busy_timeout；
+# 连接在请求之间保持，不再每个请求重新打开并执行 PRAGMA
+if os.environ.get('CLINIC_DB_PROFILE') == 'production':
+    DATABASES['default'].update({
+        'ENGINE': 'clinic.backends.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 10,  # 秒，sqlite3.connect 的锁等待
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',  # WAL 下 NORMAL 不会损坏数据库，只在断电时可能丢最后几个事务
+                'busy_timeout': 10000,  # 毫秒
+                'cache_size': -65536,  # 负数表示 KiB，即 64MB
+                'mmap_size': 268435456,  # 256MB
+                'temp_store': 'MEMORY',
+            },
+        },
+    })
+    # 生产环境缓存编译好的模板，不再每次请求都读文件、解析模板（修改模板后需重启进程）
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
+# 只读副本：设置 CLINIC_REPLICA_PATH 后，统计报表、就诊/缴费列表、导出和后台列表页的读查询走副本，
+# 副本由 sync_replica 命令定期从主库整库同步；距上次同步超过 CLINIC_REPLICA_MAX_LAG 秒时退回主库
+CLINIC_REPLICA_PATH = os.environ.get('CLINIC_REPLICA_PATH')
+CLINIC_REPLICA_MAX_LAG = int(os.environ.get('CLINIC_REPLICA_MAX_LAG', 300))
+if CLINIC_REPLICA_PATH:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{CLINIC_REPLICA_PATH}?mode=ro',  # 只读打开
+        'OPTIONS': {'uri': True},
+        'CONN_MAX_AGE': DATABASES['default'].get('CONN_MAX_AGE', 0),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['clinic.replica.ReplicaRouter']
+
+# 后台大表列表页：计数最多数到 CLINIC_ADMIN_COUNT_LIMIT 行（不带过滤条件时用 ANALYZE 的统计估算），
+# 数字页码只覆盖这么多行，再往后按主键游标翻页
+CLINIC_ADMIN_COUNT_LIMIT = int(os.environ.get('CLINIC_ADMIN_COUNT_LIMIT', 10000))
+
+# 冷数据归档：archive_records 命令把就诊日期超过 CLINIC_ARCHIVE_AFTER_DAYS 天、已离院且已缴费的就诊记录
+# （连同缴费、预约）移到归档表；列表和统计默认只查热表，带 archive=1 时才合并归档数据
+CLINIC_ARCHIVE_AFTER_DAYS = int(os.environ.get('CLINIC_ARCHIVE_AFTER_DAYS', 365))
+
+# 缓存（首页计数器、角色版本号等）
+# 默认本地内存缓存；多进程部署时设置环境变量 CLINIC_CACHE=file，改用各进程共享的文件缓存
+if os.environ.get('CLINIC_CACHE') == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CLINIC_CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+            'TIMEOUT': 600,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'clinic',
+            'TIMEOUT': 600,
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [